@@ -0,0 +1,283 @@
+"""Read-only JSON API under /api/v1 for projects, categories, tags and comments.
+
+Every endpoint accepts ``fields=`` (comma-separated) to return only some
+fields of each item. ``id`` is always included. Relationships that are not
+asked for are not loaded. Lists are newest first and paginated with the
+same opaque ``after``/``before`` cursors as the HTML pages, ``limit`` items
+at a time.
+
+Responses carry a weak ETag derived from what they show: ``updated_at``
+and the engagement counters of each project, or the edit time and author
+version of each comment. A matching ``If-None-Match`` is answered with 304
+before anything is serialized. Bodies of at least API_GZIP_MIN_SIZE bytes
+are gzip-compressed for clients that accept it.
+"""
+import gzip
+import hashlib
+import json
+from flask import current_app, request, url_for
+from sqlalchemy.orm import joinedload
+from app import app, db
+from models import Category, Comment, Project, project_tags
+from pagination import decode_cursor, keyset_paginate
+from query_budget import query_budget
+from tag_index import tag_index
+
+API_PREFIX = '/api/v1'
+# Part of every ETag; bump it when a serializer's output changes
+SERIALIZER_VERSION = 1
+
+class APIError(Exception):
+    """Turned into a JSON error response with ``status``"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+@app.errorhandler(APIError)
+def _api_error(error):
+    return _json_response({'error': error.message}, status=error.status)
+
+def _timestamp(value):
+    # Stored as naive UTC
+    return value.isoformat() + 'Z' if value else None
+
+def _upload_url(filename):
+    return url_for('uploaded_file', filename=filename, _external=True)
+
+class Serializer:
+    """Named field getters for one resource, and the relationships each field needs loaded"""
+
+    def __init__(self, fields, defaults=None, relationships=None):
+        self.fields = fields
+        self.defaults = tuple(defaults or fields)
+        self.relationships = relationships or {}
+
+    def requested(self, defaults=None):
+        """Field names picked by the ``fields`` argument, in declaration order"""
+        raw = request.args.get('fields')
+        if not raw:
+            return defaults or self.defaults
+        names = {name.strip() for name in raw.split(',') if name.strip()}
+        unknown = names - set(self.fields)
+        if unknown:
+            raise APIError(400, f'Unknown fields: {", ".join(sorted(unknown))}. '
+                                f'Available: {", ".join(self.fields)}')
+        return tuple(name for name in self.fields if name in names or name == 'id')
+
+    def loads(self, names):
+        """Relationships the given fields read"""
+        return {self.relationships[name] for name in names if name in self.relationships}
+
+    def dump(self, obj, names):
+        return {name: self.fields[name](obj) for name in names}
+
+def _featured_image(project):
+    if not project.featured_image or not project.featured_image_ready:
+        return None
+    return _upload_url(f'projects/{project.featured_image}')
+
+def _author(comment):
+    author = comment.author
+    image = author.profile_image if author.profile_image and author.profile_image_ready else None
+    return {'id': author.id, 'username': author.username,
+            'name': f'{author.first_name} {author.last_name}',
+            'profile_image': _upload_url(f'profiles/{image}') if image else None}
+
+projects_serializer = Serializer(
+    {
+        'id': lambda p: p.id,
+        'title': lambda p: p.title,
+        'description': lambda p: p.description,
+        'content': lambda p: p.content,
+        'featured': lambda p: p.featured,
+        'featured_image': _featured_image,
+        'external_url': lambda p: p.external_url,
+        'github_url': lambda p: p.github_url,
+        'demo_url': lambda p: p.demo_url,
+        'like_count': lambda p: p.like_count,
+        'comment_count': lambda p: p.comment_count,
+        'created_at': lambda p: _timestamp(p.created_at),
+        'updated_at': lambda p: _timestamp(p.updated_at),
+        'url': lambda p: url_for('project_detail', id=p.id, _external=True),
+        'category': lambda p: p.category and {'id': p.category.id, 'name': p.category.name},
+        'tags': lambda p: [{'id': tag.id, 'name': tag.name} for tag in p.tags],
+        'media': lambda p: [{'id': media.id, 'url': _upload_url(media.filename),
+                             'media_type': media.media_type, 'original_filename': media.original_filename,
+                             'file_size': media.file_size} for media in p.media],
+    },
+    # Lists leave out the heavy fields unless asked for them
+    defaults=('id', 'title', 'description', 'featured', 'featured_image', 'like_count', 'comment_count',
+              'created_at', 'updated_at', 'url', 'category', 'tags'),
+    relationships={'category': 'category', 'tags': 'tags', 'media': 'media'},
+)
+
+categories_serializer = Serializer({
+    'id': lambda c: c.id,
+    'name': lambda c: c.name,
+    'description': lambda c: c.description,
+})
+
+tags_serializer = Serializer({
+    'id': lambda t: t.id,
+    'name': lambda t: t.name,
+    'project_count': lambda t: t.project_count,
+})
+
+comments_serializer = Serializer(
+    {
+        'id': lambda c: c.id,
+        'content': lambda c: c.content,
+        'created_at': lambda c: _timestamp(c.created_at),
+        'updated_at': lambda c: _timestamp(c.updated_at),
+        'author': _author,
+    },
+    relationships={'author': 'author'},
+)
+
+def _etag(*parts):
+    digest = hashlib.sha1(repr((SERIALIZER_VERSION, request.full_path) + parts).encode())
+    return digest.hexdigest()
+
+def _project_version(project, names):
+    """What a serialized project depends on; the engagement counters do not move updated_at"""
+    version = [project.id, project.updated_at, project.like_count, project.comment_count,
+               project.featured_image_ready]
+    if 'category' in names and project.category:
+        version.append(project.category.name)
+    if 'tags' in names:
+        version.append(tuple(tag.name for tag in project.tags))
+    if 'media' in names:
+        version.append(tuple(media.id for media in project.media))
+    return tuple(version)
+
+def _not_modified(etag):
+    """A 304 response if the client already has ``etag``, else None"""
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    response = current_app.response_class(status=304)
+    _set_validators(response, etag)
+    return response
+
+def _set_validators(response, etag):
+    response.set_etag(etag, weak=True)
+    # Clients may keep responses but must revalidate them every time
+    response.cache_control.no_cache = True
+    response.vary.add('Accept-Encoding')
+
+def _json_response(payload, etag=None, status=200):
+    body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode()
+    response = current_app.response_class(mimetype='application/json', status=status)
+    if 'gzip' in request.accept_encodings and len(body) >= current_app.config['API_GZIP_MIN_SIZE']:
+        body = gzip.compress(body, compresslevel=current_app.config['API_GZIP_LEVEL'])
+        response.content_encoding = 'gzip'
+    response.set_data(body)
+    if etag:
+        _set_validators(response, etag)
+    else:
+        response.vary.add('Accept-Encoding')
+    return response
+
+def _page_limit():
+    limit = request.args.get('limit', current_app.config['API_PAGE_SIZE'], type=int)
+    return min(max(limit, 1), current_app.config['API_MAX_PAGE_SIZE'])
+
+def _cursors():
+    after, before = request.args.get('after'), request.args.get('before')
+    for cursor in (after, before):
+        if cursor and decode_cursor(cursor) is None:
+            raise APIError(400, 'Malformed cursor')
+    return after, before
+
+def _page_links(endpoint, page, **values):
+    """Absolute next/prev URLs that keep the request's other arguments"""
+    args = {key: value for key, value in request.args.items() if key not in ('after', 'before')}
+    links = {'next': None, 'prev': None}
+    if page.has_next:
+        links['next'] = url_for(endpoint, **values, **args, after=page.next_cursor, _external=True)
+    if page.has_prev:
+        links['prev'] = url_for(endpoint, **values, **args, before=page.prev_cursor, _external=True)
+    return links
+
+def _published_projects(names, profile):
+    options = Project.load_profile(profile, only=projects_serializer.loads(names))
+    return Project.query.options(*options).filter(Project.status == 'published')
+
+@app.route(f'{API_PREFIX}/projects')
+@query_budget(4)
+def api_projects():
+    """Published projects, filtered by ``category`` id and/or ``tag`` name like /projects"""
+    names = projects_serializer.requested()
+    after, before = _cursors()
+    query = _published_projects(names, 'card')
+
+    category_id = request.args.get('category', type=int)
+    if category_id:
+        query = query.filter(Project.category_id == category_id)
+    tag_name = request.args.get('tag')
+    if tag_name:
+        tag_id = tag_index.id_for(tag_name)
+        if tag_id is None:
+            raise APIError(404, f'No tag named {tag_name!r}')
+        query = query.filter(Project.id.in_(
+            db.select(project_tags.c.project_id).where(project_tags.c.tag_id == tag_id)))
+
+    page = keyset_paginate(query, Project, _page_limit(), after=after, before=before)
+    etag = _etag(tuple(_project_version(project, names) for project in page.items),
+                 page.next_cursor, page.prev_cursor)
+    return _not_modified(etag) or _json_response({
+        'data': [projects_serializer.dump(project, names) for project in page.items],
+        'links': _page_links('api_projects', page),
+    }, etag)
+
+@app.route(f'{API_PREFIX}/projects/<int:id>')
+@query_budget(4)
+def api_project(id):
+    names = projects_serializer.requested(defaults=tuple(projects_serializer.fields))
+    project = _published_projects(names, 'detail').filter(Project.id == id).first()
+    if project is None:
+        raise APIError(404, 'Project not found')
+    etag = _etag(_project_version(project, names))
+    return _not_modified(etag) or _json_response({'data': projects_serializer.dump(project, names)}, etag)
+
+@app.route(f'{API_PREFIX}/projects/<int:id>/comments')
+@query_budget(3)
+def api_project_comments(id):
+    names = comments_serializer.requested()
+    after, before = _cursors()
+    if db.session.execute(db.select(Project.id).where(Project.id == id, Project.status == 'published')).first() is None:
+        raise APIError(404, 'Project not found')
+
+    query = Comment.query.filter(Comment.project_id == id)
+    if comments_serializer.loads(names):
+        query = query.options(joinedload(Comment.author))
+    page = keyset_paginate(query, Comment, _page_limit(), after=after, before=before)
+    # The author's session_version moves with every change to their name or picture
+    etag = _etag(tuple((comment.id, comment.updated_at,
+                        comment.author.session_version if 'author' in names else None)
+                       for comment in page.items),
+                 page.next_cursor, page.prev_cursor)
+    return _not_modified(etag) or _json_response({
+        'data': [comments_serializer.dump(comment, names) for comment in page.items],
+        'links': _page_links('api_project_comments', page, id=id),
+    }, etag)
+
+@app.route(f'{API_PREFIX}/categories')
+@query_budget(1)
+def api_categories():
+    names = categories_serializer.requested()
+    categories = Category.query.order_by(Category.name).all()
+    data = [categories_serializer.dump(category, names) for category in categories]
+    # Categories have no updated_at; the list is short, so the ETag hashes the data itself
+    etag = _etag(tuple(tuple(item.values()) for item in data))
+    return _not_modified(etag) or _json_response({'data': data}, etag)
+
+@app.route(f'{API_PREFIX}/tags')
+@query_budget(1)
+def api_tags():
+    """Tags, most used on published projects first, served from the tag index"""
+    names = tags_serializer.requested()
+    data = [tags_serializer.dump(tag, names) for tag in tag_index.popular()]
+    etag = _etag(tuple(tuple(item.values()) for item in data))
+    return _not_modified(etag) or _json_response({'data': data}, etag)
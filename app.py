@@ -5,21 +5,31 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_wtf.csrf import CSRFProtect
 from flask_mail import Mail
+from jinja2 import FileSystemBytecodeCache
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
+import database
+import metrics
+import query_budget
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+# Configure logging (DEBUG also logs every SQLAlchemy pool checkout and PIL plugin import)
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
 
 class Base(DeclarativeBase):
     pass
 
 # Initialize extensions
-db = SQLAlchemy(model_class=Base)
+db = SQLAlchemy(model_class=Base, session_options={"class_": database.RoutingSession})
 login_manager = LoginManager()
 csrf = CSRFProtect()
 mail = Mail()
 
+def _drop_inherited_connections(app):
+    # The parent still uses these sockets, so forget them without closing them
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
 def create_app():
     app = Flask(__name__)
     
@@ -29,29 +39,150 @@ def create_app():
     
     # Database configuration
     app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///portfolio.db")
-    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-        "pool_recycle": 300,
-        "pool_pre_ping": True,
-    }
+    # Connection pool per worker (and per database): connections kept open, extra ones allowed
+    # under load, seconds to wait for a free one, seconds before one is replaced, and whether
+    # to test each connection on checkout (one more round-trip per request)
+    app.config["DB_POOL_SIZE"] = int(os.environ.get("DB_POOL_SIZE", 5))
+    app.config["DB_MAX_OVERFLOW"] = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+    app.config["DB_POOL_TIMEOUT"] = float(os.environ.get("DB_POOL_TIMEOUT", 30))
+    app.config["DB_POOL_RECYCLE"] = int(os.environ.get("DB_POOL_RECYCLE", 300))
+    app.config["DB_POOL_PRE_PING"] = os.environ.get("DB_POOL_PRE_PING", "").lower() in ("1", "true", "yes")
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = database.engine_options(app.config["SQLALCHEMY_DATABASE_URI"], app.config)
+    
+    # SQLite pragmas set on every connection: journal mode ('' leaves the file's as it is),
+    # synchronous level and milliseconds to wait for a lock before failing with "database is locked"
+    app.config["SQLITE_JOURNAL_MODE"] = os.environ.get("SQLITE_JOURNAL_MODE", "WAL")
+    app.config["SQLITE_SYNCHRONOUS"] = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL")
+    app.config["SQLITE_BUSY_TIMEOUT"] = int(os.environ.get("SQLITE_BUSY_TIMEOUT", 5000))
+    
+    # Read replica for GET requests ('' = none), and seconds a visitor reads from the primary
+    # after their own write (longer than the replica lag)
+    app.config["DATABASE_REPLICA_URL"] = os.environ.get("DATABASE_REPLICA_URL", "")
+    app.config["DATABASE_REPLICA_STICKY_SECONDS"] = float(os.environ.get("DATABASE_REPLICA_STICKY_SECONDS", 10))
+    if app.config["DATABASE_REPLICA_URL"]:
+        app.config["SQLALCHEMY_BINDS"] = {database.REPLICA: {
+            "url": app.config["DATABASE_REPLICA_URL"],
+            **database.engine_options(app.config["DATABASE_REPLICA_URL"], app.config),
+        }}
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
     
+    # Seconds a worker may serve cached SiteSettings before re-checking the row version
+    app.config["SITE_SETTINGS_TTL"] = float(os.environ.get("SITE_SETTINGS_TTL", 5))
+    
+    # Anonymous page cache: seconds an entry may live (0 disables) and max entries per worker
+    app.config["PAGE_CACHE_TTL"] = float(os.environ.get("PAGE_CACHE_TTL", 60))
+    app.config["PAGE_CACHE_SIZE"] = int(os.environ.get("PAGE_CACHE_SIZE", 512))
+    
+    # Text search configuration used for PostgreSQL tsvector indexing (e.g. simple, portuguese)
+    app.config["SEARCH_LANGUAGE"] = os.environ.get("SEARCH_LANGUAGE", "simple")
+    # Broad SQLite searches rank only this many of the newest matches
+    app.config["SEARCH_RANK_CANDIDATES"] = int(os.environ.get("SEARCH_RANK_CANDIDATES", 1000))
+    
+    # Pagination: seconds a listing total is reused, how many filter sets' totals are kept, and the
+    # catalog size above which listings switch to cursor (keyset) navigation (0 = only when a cursor is given)
+    app.config["PAGINATION_COUNT_TTL"] = float(os.environ.get("PAGINATION_COUNT_TTL", 60))
+    app.config["PAGINATION_COUNT_SIZE"] = int(os.environ.get("PAGINATION_COUNT_SIZE", 1000))
+    app.config["PAGINATION_KEYSET_THRESHOLD"] = int(os.environ.get("PAGINATION_KEYSET_THRESHOLD", 1000))
+    
+    # Comments rendered with a project page and returned per infinite-scroll request
+    app.config["COMMENTS_PER_PAGE"] = int(os.environ.get("COMMENTS_PER_PAGE", 20))
+    
+    # JSON API: items per page (default and maximum) and the smallest body worth gzipping
+    app.config["API_PAGE_SIZE"] = int(os.environ.get("API_PAGE_SIZE", 20))
+    app.config["API_MAX_PAGE_SIZE"] = int(os.environ.get("API_MAX_PAGE_SIZE", 100))
+    app.config["API_GZIP_MIN_SIZE"] = int(os.environ.get("API_GZIP_MIN_SIZE", 1024))
+    app.config["API_GZIP_LEVEL"] = int(os.environ.get("API_GZIP_LEVEL", 6))
+    
+    # Static export (flask export-static): output directory, and the public URL pages are rendered for
+    app.config["STATIC_EXPORT_DIR"] = os.environ.get("STATIC_EXPORT_DIR", "")
+    app.config["STATIC_EXPORT_BASE_URL"] = os.environ.get("STATIC_EXPORT_BASE_URL", "http://localhost")
+    
+    # Related projects: neighbours stored per project, and seconds a worker keeps the feature
+    # matrix it uses to update them when a project is saved
+    app.config["RELATED_PROJECTS_K"] = int(os.environ.get("RELATED_PROJECTS_K", 6))
+    app.config["RELATED_INDEX_TTL"] = float(os.environ.get("RELATED_INDEX_TTL", 600))
+    
+    # Seconds a worker serves its cached tag list/name index before reloading it
+    app.config["TAG_INDEX_TTL"] = float(os.environ.get("TAG_INDEX_TTL", 30))
+    
+    # Signed-in users: seconds a worker serves its cached copy before re-checking the row
+    # version, and max users cached per worker
+    app.config["USER_CACHE_TTL"] = float(os.environ.get("USER_CACHE_TTL", 10))
+    app.config["USER_CACHE_SIZE"] = int(os.environ.get("USER_CACHE_SIZE", 1000))
+    
+    # Likes: buffer toggles per worker and write them in batches (write-behind) instead of
+    # one transaction per click; flushed every LIKES_FLUSH_INTERVAL seconds or LIKES_FLUSH_SIZE changes
+    app.config["LIKES_WRITE_BEHIND"] = os.environ.get("LIKES_WRITE_BEHIND", "").lower() in ("1", "true", "yes")
+    app.config["LIKES_FLUSH_INTERVAL"] = float(os.environ.get("LIKES_FLUSH_INTERVAL", 2))
+    app.config["LIKES_FLUSH_SIZE"] = int(os.environ.get("LIKES_FLUSH_SIZE", 200))
+    
+    # Jinja bytecode cache: on/off and its directory ('' = a per-user temp directory)
+    app.config["JINJA_BYTECODE_CACHE"] = os.environ.get("JINJA_BYTECODE_CACHE", "true").lower() in ("1", "true", "yes")
+    app.config["JINJA_CACHE_DIR"] = os.environ.get("JINJA_CACHE_DIR", "")
+    
     # Upload configuration
-    app.config["UPLOAD_FOLDER"] = "static/uploads"
+    app.config["UPLOAD_FOLDER"] = os.environ.get("UPLOAD_FOLDER", "static/uploads")  # relative to the app root
     app.config["MAX_CONTENT_LENGTH"] = 16 * 1024 * 1024  # 16MB max file size
     
+    # Upload delivery: '' (Flask streams the file), 'x-sendfile' (Apache/lighttpd) or
+    # 'x-accel' (nginx internal location at UPLOADS_ACCEL_PREFIX mapped to static/uploads)
+    app.config["UPLOADS_SENDFILE"] = os.environ.get("UPLOADS_SENDFILE", "").lower()
+    app.config["UPLOADS_ACCEL_PREFIX"] = os.environ.get("UPLOADS_ACCEL_PREFIX", "/protected-uploads/")
+    app.config["USE_X_SENDFILE"] = app.config["UPLOADS_SENDFILE"] == "x-sendfile"
+    
+    # Background image processing: pool size, attempts before giving up, first retry delay (s)
+    app.config["IMAGE_WORKERS"] = int(os.environ.get("IMAGE_WORKERS", 2))
+    app.config["IMAGE_MAX_ATTEMPTS"] = int(os.environ.get("IMAGE_MAX_ATTEMPTS", 3))
+    app.config["IMAGE_RETRY_DELAY"] = float(os.environ.get("IMAGE_RETRY_DELAY", 2))
+    
+    # Responsive variants written for each processed image (formats need Pillow codec support)
+    app.config["IMAGE_VARIANT_WIDTHS"] = [int(w) for w in os.environ.get("IMAGE_VARIANT_WIDTHS", "160,320,480,640,800").split(",")]
+    app.config["IMAGE_VARIANT_FORMATS"] = os.environ.get("IMAGE_VARIANT_FORMATS", "AVIF,WEBP").upper().split(",")
+    
+    # Query budget: off, warn (log) or raise (fail the request, for tests/CI)
+    app.config["QUERY_BUDGET_MODE"] = os.environ.get("QUERY_BUDGET_MODE", "off")
+    
+    # Metrics at /metrics: on/off, directory each worker writes its counts to for the others to
+    # merge ('' = a temp directory per server), seconds between writes, and the bearer token to require
+    # (without one /metrics answers 404; the other instrumentation and slow-request logs still run)
+    app.config["METRICS_ENABLED"] = os.environ.get("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+    app.config["METRICS_DIR"] = os.environ.get("METRICS_DIR", "")
+    app.config["METRICS_FLUSH_INTERVAL"] = float(os.environ.get("METRICS_FLUSH_INTERVAL", 5))
+    app.config["METRICS_TOKEN"] = os.environ.get("METRICS_TOKEN")
+    
+    # Slow log: requests and single SQL statements taking at least this many seconds are logged
+    # (0 disables), with this many of a slow request's slowest statements
+    app.config["SLOW_REQUEST_THRESHOLD"] = float(os.environ.get("SLOW_REQUEST_THRESHOLD", 1))
+    app.config["SLOW_QUERY_THRESHOLD"] = float(os.environ.get("SLOW_QUERY_THRESHOLD", 0.25))
+    app.config["SLOW_REQUEST_STATEMENTS"] = int(os.environ.get("SLOW_REQUEST_STATEMENTS", 5))
+    
     # Mail configuration
     app.config["MAIL_SERVER"] = os.environ.get("MAIL_SERVER", "smtp.gmail.com")
     app.config["MAIL_PORT"] = int(os.environ.get("MAIL_PORT", 587))
-    app.config["MAIL_USE_TLS"] = True
+    app.config["MAIL_USE_TLS"] = os.environ.get("MAIL_USE_TLS", "true").lower() in ("1", "true", "yes")
     app.config["MAIL_USERNAME"] = os.environ.get("MAIL_USERNAME")
     app.config["MAIL_PASSWORD"] = os.environ.get("MAIL_PASSWORD")
     app.config["MAIL_DEFAULT_SENDER"] = os.environ.get("MAIL_DEFAULT_SENDER")
     
+    # Mail outbox: background sender per worker (off = only `flask send-mail` sends), messages
+    # per batch, attempts before giving up, first retry delay (s), SMTP socket timeout (s),
+    # seconds an idle SMTP connection is kept open, and how long a claimed batch is leased (s)
+    app.config["MAIL_OUTBOX_SENDER"] = os.environ.get("MAIL_OUTBOX_SENDER", "true").lower() in ("1", "true", "yes")
+    app.config["MAIL_BATCH_SIZE"] = int(os.environ.get("MAIL_BATCH_SIZE", 50))
+    app.config["MAIL_MAX_ATTEMPTS"] = int(os.environ.get("MAIL_MAX_ATTEMPTS", 5))
+    app.config["MAIL_RETRY_DELAY"] = float(os.environ.get("MAIL_RETRY_DELAY", 30))
+    app.config["MAIL_SMTP_TIMEOUT"] = float(os.environ.get("MAIL_SMTP_TIMEOUT", 30))
+    app.config["MAIL_SMTP_IDLE"] = float(os.environ.get("MAIL_SMTP_IDLE", 30))
+    app.config["MAIL_CLAIM_LEASE"] = float(os.environ.get("MAIL_CLAIM_LEASE", 300))
+    
     # Initialize extensions with app
     db.init_app(app)
+    database.init_app(app)
     login_manager.init_app(app)
     csrf.init_app(app)
     mail.init_app(app)
+    query_budget.init_app(app)
+    metrics.init_app(app)
     
     # Login manager configuration
     login_manager.login_view = 'auth.login'
@@ -60,35 +191,19 @@ def create_app():
     
     @login_manager.user_loader
     def load_user(user_id):
-        from models import User
-        return User.query.get(int(user_id))
+        from user_cache import user_cache
+        return user_cache.get(int(user_id))
     
-    # Create upload folder if it doesn't exist
-    upload_path = os.path.join(app.root_path, app.config["UPLOAD_FOLDER"])
-    os.makedirs(upload_path, exist_ok=True)
+    # Compiled templates survive restarts, so new workers skip compiling them
+    if app.config["JINJA_BYTECODE_CACHE"]:
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config["JINJA_CACHE_DIR"] or None)
     
-    with app.app_context():
-        # Import models to ensure they're registered
-        import models
-        db.create_all()
-        
-        # Create admin user if it doesn't exist
-        from models import User
-        from werkzeug.security import generate_password_hash
-        admin = User.query.filter_by(email='admin@portfolio.com').first()
-        if not admin:
-            admin = User(
-                username='admin',
-                email='admin@portfolio.com',
-                password_hash=generate_password_hash('admin123'),
-                is_admin=True,
-                first_name='Portfolio',
-                last_name='Owner'
-            )
-            db.session.add(admin)
-            db.session.commit()
-            logging.info("Admin user created: admin@portfolio.com / admin123")
+    # With gunicorn --preload the app is imported before forking; workers must not share pooled connections
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=lambda: _drop_inherited_connections(app))
     
+    # Nothing above touches the database: `flask db-init` creates the schema, the first admin
+    # user and the site settings row
     return app
 
 # Create the app instance
@@ -0,0 +1,213 @@
+"""Pure-Python build and delivery of bundled, minified, fingerprinted CSS/JS.
+
+``flask build-assets`` concatenates each bundle's sources, minifies them,
+writes ``static/dist/<name>.<hash>.<ext>`` plus ``.gz`` (and ``.br`` when
+the optional ``brotli`` package is installed) siblings, and records the
+hashed names in ``static/dist/manifest.json``. Templates call
+``asset_urls(bundle)``, which falls back to the unbundled sources when no
+build exists, so development needs no build step.
+"""
+import gzip
+import hashlib
+import json
+import os
+import re
+from flask import abort, current_app, request, send_from_directory, url_for
+
+try:
+    import brotli
+except ImportError:  # optional: only gzip siblings are written without it
+    brotli = None
+
+# Bundle name -> source files (relative to static/), in load order
+ASSET_BUNDLES = {
+    'css/site.css': ['css/modern.css'],
+    'js/site.js': ['js/modern.js'],
+}
+
+DIST_FOLDER = 'dist'
+MANIFEST_NAME = 'manifest.json'
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Precompressed sibling suffix by Content-Encoding, in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+_manifest_cache = {'mtime': None, 'manifest': {}}
+
+def _skip_string(source, i):
+    """Index just past the string/template literal starting at ``source[i]``"""
+    quote = source[i]
+    i += 1
+    while i < len(source) and source[i] != quote:
+        i += 2 if source[i] == '\\' else 1
+    return i + 1
+
+def minify_css(source):
+    out = []
+    i = 0
+    while i < len(source):
+        char = source[i]
+        if char in '"\'':
+            end = _skip_string(source, i)
+            out.append(source[i:end])
+            i = end
+        elif source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            i = len(source) if end == -1 else end + 2
+        elif char.isspace():
+            while i < len(source) and source[i].isspace():
+                i += 1
+            out.append(' ')
+        else:
+            out.append(char)
+            i += 1
+    
+    # Trim around punctuation everywhere except inside quoted strings
+    css = ''.join(out)
+    parts = re.split(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')', css)
+    for index in range(0, len(parts), 2):
+        part = re.sub(r'\s*([{};,>])\s*', r'\1', parts[index])
+        part = re.sub(r':\s+', ':', part)
+        parts[index] = part.replace(';}', '}')
+    return ''.join(parts).strip()
+
+# A "/" after one of these (or at the start) begins a regex literal, not a division
+_REGEX_PRECEDERS = set('(,=:[!&|?{};*%<>~^')
+_REGEX_KEYWORDS = ('return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'void', 'yield')
+
+def minify_js(source):
+    """Strip comments and indentation; newlines are kept so ASI behaves the same"""
+    out = []
+    i = 0
+    last = ''  # previous significant character
+    last_word = ''  # previous identifier/keyword, if it was the last token
+    while i < len(source):
+        char = source[i]
+        if char in '"\'`':
+            end = _skip_string(source, i)
+            out.append(source[i:end])
+            last, last_word = char, ''
+            i = end
+        elif source.startswith('//', i):
+            end = source.find('\n', i)
+            i = len(source) if end == -1 else end
+        elif source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            i = len(source) if end == -1 else end + 2
+            out.append(' ')
+        elif char == '/' and (not last or last in _REGEX_PRECEDERS or last_word in _REGEX_KEYWORDS):
+            # Regex literal: copy verbatim, including character classes
+            j = i + 1
+            in_class = False
+            while j < len(source) and source[j] != '\n':
+                if source[j] == '\\':
+                    j += 2
+                    continue
+                if source[j] == '[':
+                    in_class = True
+                elif source[j] == ']':
+                    in_class = False
+                elif source[j] == '/' and not in_class:
+                    break
+                j += 1
+            out.append(source[i:j + 1])
+            last, last_word = '/', ''
+            i = j + 1
+        elif char == '\n':
+            while out and out[-1] == ' ':
+                out.pop()
+            if out and out[-1] != '\n':
+                out.append('\n')
+            i += 1
+            while i < len(source) and source[i] in ' \t\r\n':
+                i += 1
+        elif char in ' \t\r':
+            while i < len(source) and source[i] in ' \t\r':
+                i += 1
+            if i < len(source) and source[i] != '\n':
+                out.append(' ')
+        elif char.isalnum() or char in '_$':
+            j = i
+            while j < len(source) and (source[j].isalnum() or source[j] in '_$'):
+                j += 1
+            last_word = source[i:j]
+            out.append(last_word)
+            last = source[j - 1]
+            i = j
+        else:
+            out.append(char)
+            last, last_word = char, ''
+            i += 1
+    return ''.join(out).strip()
+
+MINIFIERS = {'.css': minify_css, '.js': minify_js}
+
+def build(static_folder, bundles=ASSET_BUNDLES):
+    """Write every bundle with its compressed siblings; returns the manifest"""
+    dist = os.path.join(static_folder, DIST_FOLDER)
+    manifest = {}
+    for name, sources in bundles.items():
+        stem, ext = os.path.splitext(name)
+        contents = []
+        for source in sources:
+            with open(os.path.join(static_folder, source), encoding='utf-8') as f:
+                contents.append(f.read())
+        data = MINIFIERS[ext]('\n'.join(contents)).encode('utf-8')
+        
+        filename = f'{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+        path = os.path.join(dist, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        # mtime=0 keeps the .gz byte-identical across builds
+        with open(path + '.gz', 'wb') as f:
+            f.write(gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli is not None:
+            with open(path + '.br', 'wb') as f:
+                f.write(brotli.compress(data, quality=11))
+        manifest[name] = filename
+    
+    with open(os.path.join(dist, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+def load_manifest():
+    """The current build manifest (re-read only when the file changes)"""
+    path = os.path.join(current_app.static_folder, DIST_FOLDER, MANIFEST_NAME)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return {}
+    if _manifest_cache['mtime'] != mtime:
+        with open(path, encoding='utf-8') as f:
+            _manifest_cache['manifest'] = json.load(f)
+        _manifest_cache['mtime'] = mtime
+    return _manifest_cache['manifest']
+
+def asset_urls(bundle):
+    """URLs to load ``bundle``: the built file when available, else its sources"""
+    built = load_manifest().get(bundle)
+    if built:
+        return [url_for('asset', filename=built)]
+    return [url_for('static', filename=source) for source in ASSET_BUNDLES[bundle]]
+
+def send_asset(filename):
+    """Serve a built asset, preferring a precompressed sibling the client accepts"""
+    if filename not in load_manifest().values():
+        abort(404)
+    directory = os.path.join(current_app.static_folder, DIST_FOLDER)
+    
+    response = None
+    for encoding, suffix in ENCODINGS:
+        if encoding in request.accept_encodings and os.path.isfile(os.path.join(directory, filename + suffix)):
+            response = send_from_directory(directory, filename + suffix, max_age=IMMUTABLE_MAX_AGE)
+            response.content_encoding = encoding
+            response.mimetype = 'text/css' if filename.endswith('.css') else 'text/javascript'
+            break
+    if response is None:
+        response = send_from_directory(directory, filename, max_age=IMMUTABLE_MAX_AGE)
+    
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
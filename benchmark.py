@@ -0,0 +1,767 @@
+"""Route benchmarks, in-process or over HTTP, saved as JSON to compare commits.
+
+``flask benchmark`` requests every page and API route (anonymous and as an
+admin) a fixed number of times after a warm-up. Per route it reports the
+p50/p95/p99 latency, throughput, response statuses and the SQL statements
+each request ran. Seed the database first with ``flask seed-data``, so
+every commit is measured against the same rows.
+
+In-process runs use the test client, one request at a time. They count
+queries with an engine listener and trace the peak Python allocation of
+one extra request per route. Links to endpoints this tree does not define
+are rendered as ``#``, as in ``flask check-query-plans``.
+
+HTTP runs drive a running server (``--http URL``) or a gunicorn started
+for the run (``--gunicorn``) from several keep-alive connections at once.
+Query counts come from the X-Query-Count header, which the app sends when
+QUERY_BUDGET_MODE is not ``off``; for streamed responses it covers only
+what ran before the body. The started gunicorn always sends it, and the
+peak RSS of its workers is read from /proc.
+
+The page cache is turned off for the run (PAGE_CACHE_TTL=0) unless
+``--page-cache`` is given, so anonymous pages measure the view and its
+templates rather than a dictionary lookup. The like toggle is the one
+write; when a route is done the admin's like is put back as it was.
+
+``flask benchmark-startup`` times a cold start instead: ``import main`` in
+a fresh interpreter, and gunicorn from launch to its first response.
+
+``flask benchmark-scenario NAME`` runs one of the focused measurements in
+SCENARIOS, each comparing a feature's settings on the same routes (e.g.
+``settings-cache``: SiteSettings re-checked on every request vs. cached).
+
+``flask benchmark-mixed`` sends reads and like toggles at the same time
+for a fixed number of seconds. It reports both as one entry each, which
+shows how much writers slow readers down. Settings given with ``--env``
+(e.g. ``SQLITE_JOURNAL_MODE=DELETE``) apply to the server it starts.
+"""
+import contextvars
+import http.client
+import itertools
+import json
+import math
+import os
+import platform
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from datetime import datetime
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode, urlsplit
+from sqlalchemy import event, func
+from app import db
+import datagen
+import query_plans
+from models import Comment, Like, Project, User
+
+try:
+    import resource
+except ImportError:
+    resource = None  # optional: not available on Windows
+
+Route = namedtuple('Route', 'label method path as_admin')
+
+FORMAT_VERSION = 1
+PERCENTILES = (50, 95, 99)
+
+_CSRF_META_RE = re.compile(r'<meta name="csrf-token" content="([^"]+)"')
+_CSRF_INPUT_RE = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+
+class BenchmarkError(RuntimeError):
+    """The benchmark could not run (no admin to sign in as, server did not start, ...)"""
+
+def benchmark_routes():
+    """Every GET page and API route of the check-query-plans set, plus forms, the export and the like toggle"""
+    routes = [Route(label, 'GET', path, as_admin) for label, path, as_admin in query_plans.route_paths()]
+    routes += [
+        Route('login', 'GET', '/login', False),
+        Route('register', 'GET', '/register', False),
+        Route('forgot_password', 'GET', '/forgot-password', False),
+        Route('edit_profile', 'GET', '/profile/edit', True),
+        Route('new_project', 'GET', '/admin/project/new', True),
+        Route('admin_export_projects', 'GET', '/admin/projects/export', True),
+    ]
+    project_id = db.session.execute(db.select(Project.id).where(Project.status == 'published')
+                                    .order_by(Project.created_at.desc()).limit(1)).scalar()
+    if project_id is not None:
+        routes.append(Route('toggle_like', 'POST', f'/project/{project_id}/like', True))
+    return routes
+
+def _liked(user_id, route):
+    # The toggle route is /project/<id>/like
+    project_id = int(route.path.split('/')[2])
+    db.session.rollback()
+    return db.session.execute(db.select(Like.id).where(Like.user_id == user_id,
+                                                       Like.project_id == project_id)).first() is not None
+
+def _percentile(ordered, percent):
+    # Nearest rank
+    return ordered[max(math.ceil(percent / 100 * len(ordered)) - 1, 0)]
+
+def summarize(route, samples, wall):
+    """Result entry for one route from (status, seconds, queries) samples and the wall time they took"""
+    latencies = sorted(seconds * 1000 for _, seconds, _ in samples)
+    queries = [count for _, _, count in samples if count is not None]
+    statuses = Counter(str(status) for status, _, _ in samples)
+    return {
+        'label': route.label,
+        'method': route.method,
+        'path': route.path,
+        'admin': route.as_admin,
+        'requests': len(samples),
+        'statuses': dict(sorted(statuses.items())),
+        'errors': sum(count for status, count in statuses.items() if not status.startswith(('2', '3'))),
+        'latency_ms': {
+            'mean': round(sum(latencies) / len(latencies), 3) if latencies else None,
+            **{f'p{percent}': round(_percentile(latencies, percent), 3) if latencies else None
+               for percent in PERCENTILES},
+            'max': round(latencies[-1], 3) if latencies else None,
+        },
+        'throughput_rps': round(len(samples) / wall, 1) if wall else None,
+        'queries': {
+            'mean': round(sum(queries) / len(queries), 2) if queries else None,
+            'max': max(queries) if queries else None,
+        },
+    }
+
+def _git_revision(root):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=root, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        changes = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=root,
+                                 capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, bool(changes)
+
+def _dataset():
+    count = lambda model: db.session.execute(db.select(func.count()).select_from(model)).scalar()
+    return {'users': count(User), 'projects': count(Project), 'likes': count(Like), 'comments': count(Comment)}
+
+def _meta(app, mode, **options):
+    commit, dirty = _git_revision(app.root_path)
+    return {
+        'format': FORMAT_VERSION,
+        'commit': commit,
+        'dirty': dirty,
+        'created_at': datetime.utcnow().isoformat() + 'Z',
+        'mode': mode,
+        'python': platform.python_version(),
+        'dialect': db.engine.dialect.name,
+        'dataset': _dataset(),
+        **options,
+    }
+
+def _admin_id():
+    admin_id = db.session.execute(db.select(User.id).where(User.email == datagen.ADMIN_EMAIL)).scalar()
+    if admin_id is None:
+        admin_id = db.session.execute(db.select(User.id).where(User.is_admin.is_(True))
+                                      .order_by(User.id).limit(1)).scalar()
+    return admin_id
+
+def _csrf_meta(body):
+    match = _CSRF_META_RE.search(body)
+    if match is None:
+        raise BenchmarkError('No CSRF token in the page; cannot send POST requests')
+    return match.group(1)
+
+def run_in_process(app, requests=200, warmup=20, routes=None, page_cache=False):
+    """Benchmark the routes with the test client; returns the results document"""
+    routes = routes if routes is not None else benchmark_routes()
+    admin_id = _admin_id()
+    if admin_id is None and any(route.as_admin for route in routes):
+        raise BenchmarkError('No admin user to sign in as; run flask seed-data first')
+    db.session.rollback()
+
+    counter = [0]
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        counter[0] += 1
+
+    def send(client, route, headers):
+        # Run outside the caller's app context so each request gets its own g, session and user
+        counter[0] = 0
+        started = time.perf_counter()
+        # Buffered, so streamed bodies are produced (and timed) inside that context too
+        response = contextvars.Context().run(client.open, route.path, method=route.method, headers=headers,
+                                             buffered=True)
+        elapsed = time.perf_counter() - started
+        return response.status_code, elapsed, counter[0]
+
+    results = []
+    cache_ttl = app.config['PAGE_CACHE_TTL']
+    if not page_cache:
+        app.config['PAGE_CACHE_TTL'] = 0
+    engine = db.engine
+    event.listen(engine, 'before_cursor_execute', count)
+    app.url_build_error_handlers.append(query_plans.missing_endpoint)
+    try:
+        for route in routes:
+            client = app.test_client()
+            headers = {}
+            if route.as_admin:
+                contextvars.Context().run(query_plans.log_in, client, admin_id)
+            if route.method == 'POST':
+                page = contextvars.Context().run(client.get, '/about')
+                headers['X-CSRFToken'] = _csrf_meta(page.get_data(as_text=True))
+                liked = _liked(admin_id, route)
+            for _ in range(warmup):
+                send(client, route, headers)
+            started = time.perf_counter()
+            samples = [send(client, route, headers) for _ in range(requests)]
+            wall = time.perf_counter() - started
+
+            tracemalloc.start()
+            try:
+                send(client, route, headers)
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            if route.method == 'POST' and _liked(admin_id, route) != liked:
+                send(client, route, headers)
+
+            result = summarize(route, samples, wall)
+            result['peak_alloc_kib'] = peak // 1024
+            results.append(result)
+    finally:
+        app.url_build_error_handlers.remove(query_plans.missing_endpoint)
+        event.remove(engine, 'before_cursor_execute', count)
+        app.config['PAGE_CACHE_TTL'] = cache_ttl
+
+    meta = _meta(app, 'in-process', requests=requests, warmup=warmup, concurrency=1, page_cache=page_cache)
+    # ru_maxrss is KiB on Linux
+    meta['peak_rss_kib'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None
+    return {'meta': meta, 'routes': results}
+
+# Focused measurements behind individual optimisations, run with ``flask benchmark-scenario NAME``
+SCENARIOS = {}
+
+def scenario(name):
+    """Register ``func(app, requests, warmup)`` (returning result entries) as a named scenario"""
+    def decorator(func):
+        SCENARIOS[name] = func
+        return func
+    return decorator
+
+@contextmanager
+def _config(app, **overrides):
+    saved = {key: app.config[key] for key in overrides}
+    app.config.update(overrides)
+    try:
+        yield
+    finally:
+        app.config.update(saved)
+
+def _variants(app, routes, variants, requests, warmup, reset=None):
+    """In-process results for ``routes`` under each (name, config overrides) variant, labelled 'route [name]'"""
+    entries = []
+    for name, overrides in variants:
+        with _config(app, **overrides):
+            if reset:
+                reset()
+            for entry in run_in_process(app, requests, warmup, routes)['routes']:
+                entry['label'] = f'{entry["label"]} [{name}]'
+                entries.append(entry)
+    return entries
+
+def run_scenario(app, name, requests=200, warmup=20):
+    """Run one registered scenario; returns the results document"""
+    entries = SCENARIOS[name](app, requests, warmup)
+    meta = _meta(app, f'scenario:{name}', requests=requests, warmup=warmup, concurrency=1)
+    meta['peak_rss_kib'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None
+    return {'meta': meta, 'routes': entries}
+
+@scenario('settings-cache')
+def _settings_cache(app, requests, warmup):
+    """Pages that read SiteSettings, re-checking the row on every request (ttl 0) and as configured"""
+    from settings_cache import site_settings_cache
+    routes = [Route('index', 'GET', '/', False), Route('projects', 'GET', '/projects', False),
+              Route('about', 'GET', '/about', False)]
+    return _variants(app, routes, [('ttl 0', {'SITE_SETTINGS_TTL': 0}),
+                                   ('cached', {'SITE_SETTINGS_TTL': app.config['SITE_SETTINGS_TTL']})],
+                     requests, warmup, reset=site_settings_cache.invalidate)
+
+@scenario('uploads')
+def _uploads(app, requests, warmup):
+    """A versioned 8 KB upload sent by Flask, handed to nginx (x-accel) and to X-Sendfile"""
+    import uploads
+    directory = uploads.folder_path('uploads/projects', app)
+    os.makedirs(directory, exist_ok=True)
+    filename = f'benchmark-{os.getpid()}.jpg'
+    path = os.path.join(directory, filename)
+    with open(path, 'wb') as f:
+        f.write(os.urandom(8 * 1024))
+    try:
+        with app.test_request_context():
+            version = uploads.upload_version(f'projects/{filename}')
+        routes = [Route('upload', 'GET', f'/uploads/projects/{filename}?v={version}', False)]
+        return _variants(app, routes, [('flask', {'UPLOADS_SENDFILE': '', 'USE_X_SENDFILE': False}),
+                                       ('x-accel', {'UPLOADS_SENDFILE': 'x-accel', 'USE_X_SENDFILE': False}),
+                                       ('x-sendfile', {'UPLOADS_SENDFILE': 'x-sendfile', 'USE_X_SENDFILE': True})],
+                         requests, warmup)
+    finally:
+        os.remove(path)
+
+@scenario('search')
+def _search(app, requests, warmup):
+    """/search for a common word, ranking only the newest SEARCH_RANK_CANDIDATES matches vs. all of them"""
+    description = db.session.execute(db.select(Project.description).where(Project.status == 'published')
+                                     .order_by(Project.created_at.desc()).limit(1)).scalar()
+    words = re.findall(r'\w{3,}', description or '')
+    if not words:
+        raise BenchmarkError('No published project to take a search word from; run flask seed-data first')
+    routes = [Route('search', 'GET', '/search?' + urlencode({'q': words[0].lower()}), False)]
+    # A negative LIMIT is no limit in SQLite, so -1 ranks every match (as before the candidate cap)
+    return _variants(app, routes, [('all matches', {'SEARCH_RANK_CANDIDATES': -1}),
+                                   ('newest', {'SEARCH_RANK_CANDIDATES': app.config['SEARCH_RANK_CANDIDATES']})],
+                     requests, warmup)
+
+@scenario('user-cache')
+def _user_cache(app, requests, warmup):
+    """Signed-in requests loading the user from the database every time (size 0) and from the worker's cache"""
+    from user_cache import user_cache
+    routes = [Route('about', 'GET', '/about', True)]
+    routes += [route for route in benchmark_routes() if route.label == 'toggle_like']
+    return _variants(app, routes, [('no cache', {'USER_CACHE_SIZE': 0}),
+                                   ('cached', {'USER_CACHE_SIZE': app.config['USER_CACHE_SIZE']})],
+                     requests, warmup, reset=user_cache.invalidate)
+
+def _timed_calls(calls):
+    """(200, seconds, queries) samples for each call, each rolled back, and the wall time they took"""
+    counter = [0]
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        counter[0] += 1
+
+    samples = []
+    event.listen(db.engine, 'before_cursor_execute', count)
+    try:
+        started = time.perf_counter()
+        for call in calls:
+            counter[0] = 0
+            call_started = time.perf_counter()
+            call()
+            samples.append((200, time.perf_counter() - call_started, counter[0]))
+            db.session.rollback()
+        wall = time.perf_counter() - started
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count)
+    return samples, wall
+
+@scenario('related')
+def _related(app, requests, warmup):
+    """A full related-lists rebuild, and the incremental update one saved project costs"""
+    import related
+    if not related.available():
+        raise BenchmarkError('NumPy is not installed; related lists are not precomputed')
+    ids = db.session.execute(db.select(Project.id).where(Project.status == 'published')
+                             .order_by(Project.id)).scalars().all()
+    if len(ids) < 2:
+        raise BenchmarkError('Too few published projects to relate; run flask seed-data first')
+    rebuild = lambda: related.rebuild(db.session.connection())
+    # A rebuild reads every project; a few runs are enough
+    samples, wall = _timed_calls([rebuild] * max(requests // 100, 1))
+    tracemalloc.start()
+    try:
+        _timed_calls([rebuild])
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    entries = [dict(summarize(Route(f'rebuild ({len(ids)} projects)', 'CLI', 'flask build-related', False),
+                              samples, wall), peak_alloc_kib=peak // 1024)]
+
+    # Spread over the catalog; the first rebuild above left the worker's matrix in place
+    saves = [ids[index * len(ids) // (warmup + requests)] for index in range(warmup + requests)]
+    update = lambda project_id: lambda: related.related_index.update(project_id)
+    _timed_calls([update(project_id) for project_id in saves[:warmup]])
+    samples, wall = _timed_calls([update(project_id) for project_id in saves[warmup:]])
+    entries.append(summarize(Route('update per save', 'JOB', 'related.queue_update', False), samples, wall))
+    return entries
+
+class _Connection:
+    """One keep-alive connection to the server under test"""
+
+    def __init__(self, target, timeout=60):
+        parts = urlsplit(target)
+        connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self._connection = connection_class(parts.hostname, parts.port, timeout=timeout)
+        self._prefix = parts.path.rstrip('/')
+
+    def request(self, method, path, headers=None, body=None):
+        """(status, headers, body, seconds) for one request"""
+        started = time.perf_counter()
+        try:
+            self._connection.request(method, self._prefix + path, body=body, headers=headers or {})
+            response = self._connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            # Reconnects on the next request
+            self._connection.close()
+            raise
+        return response.status, response.headers, data, time.perf_counter() - started
+
+    def close(self):
+        self._connection.close()
+
+def _cookies(headers, cookies=None):
+    cookies = dict(cookies or {})
+    for header in headers.get_all('Set-Cookie') or ():
+        for name, morsel in SimpleCookie(header).items():
+            cookies[name] = morsel.value
+    return cookies
+
+def _cookie_header(cookies):
+    return '; '.join(f'{name}={value}' for name, value in cookies.items())
+
+def http_log_in(target, email, password):
+    """Sign in through the login form; returns the headers for admin requests, CSRF token included"""
+    connection = _Connection(target)
+    try:
+        status, headers, body, _ = connection.request('GET', '/login')
+        cookies = _cookies(headers)
+        match = _CSRF_INPUT_RE.search(body.decode('utf-8', 'replace'))
+        if status != 200 or match is None:
+            raise BenchmarkError(f'GET /login answered {status} without a CSRF token')
+        form = urlencode({'csrf_token': match.group(1), 'email': email, 'password': password})
+        status, headers, _, _ = connection.request('POST', '/login', {
+            'Cookie': _cookie_header(cookies), 'Content-Type': 'application/x-www-form-urlencoded'}, form)
+        if status != 302:
+            raise BenchmarkError(f'Could not sign in as {email} (HTTP {status})')
+        # Signing in keeps the session's CSRF secret, so the login form's token stays valid
+        cookies = _cookies(headers, cookies)
+        return {'Cookie': _cookie_header(cookies), 'X-CSRFToken': match.group(1)}
+    finally:
+        connection.close()
+
+def _send_all(connections, route, count, headers):
+    """Send ``count`` requests spread over the connections; returns (samples, wall seconds)"""
+    remaining = [count]
+    lock = threading.Lock()
+    samples = []
+
+    def work(connection):
+        while True:
+            with lock:
+                if not remaining[0]:
+                    return
+                remaining[0] -= 1
+            try:
+                status, response_headers, _, elapsed = connection.request(route.method, route.path, headers)
+            except (OSError, http.client.HTTPException):
+                samples.append(('error', 0.0, None))
+                continue
+            queries = response_headers.get('X-Query-Count')
+            samples.append((status, elapsed, int(queries) if queries else None))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(len(connections)) as pool:
+        list(pool.map(work, connections))
+    return samples, time.perf_counter() - started
+
+def _proc_status(pid, field):
+    """A /proc/<pid>/status memory field in KiB, or None"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def _children(pid):
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+def run_http(app, target, requests=200, warmup=20, concurrency=8, routes=None,
+             email=datagen.ADMIN_EMAIL, password=datagen.PASSWORD, server_pid=None, **options):
+    """Benchmark the routes against a server at ``target``; returns the results document"""
+    target = target.rstrip('/')
+    routes = routes if routes is not None else benchmark_routes()
+    db.session.rollback()
+    admin_headers = http_log_in(target, email, password) if any(route.as_admin for route in routes) else {}
+    admin_id = db.session.execute(db.select(User.id).where(User.email == email)).scalar()
+    workers = _children(server_pid) if server_pid else []
+
+    results = []
+    connections = [_Connection(target) for _ in range(concurrency)]
+    try:
+        for route in routes:
+            headers = dict(admin_headers) if route.as_admin else {}
+            if route.method == 'POST':
+                headers['Accept'] = 'application/json'
+                liked = _liked(admin_id, route)
+            _send_all(connections, route, warmup, headers)
+            samples, wall = _send_all(connections, route, requests, headers)
+            if route.method == 'POST' and _liked(admin_id, route) != liked:
+                _send_all(connections[:1], route, 1, headers)
+            result = summarize(route, samples, wall)
+            if workers:
+                result['worker_rss_kib'] = max(_proc_status(pid, 'VmRSS') or 0 for pid in workers)
+            results.append(result)
+    finally:
+        for connection in connections:
+            connection.close()
+
+    meta = _meta(app, 'http', target=target, requests=requests, warmup=warmup, concurrency=concurrency, **options)
+    if workers:
+        meta['workers'] = len(workers)
+        meta['peak_rss_kib'] = max(_proc_status(pid, 'VmHWM') or 0 for pid in workers)
+    return {'meta': meta, 'routes': results}
+
+def _release_connections():
+    # Leave the database file to the server: with SQLite, a journal mode it is told to use can
+    # only be set while no other process has the file open
+    db.session.remove()
+    for engine in db.engines.values():
+        engine.dispose()
+
+def _record(connection, method, path, headers, samples):
+    try:
+        status, response_headers, _, elapsed = connection.request(method, path, headers)
+    except (OSError, http.client.HTTPException):
+        samples.append(('error', 0.0, None))
+        return
+    queries = response_headers.get('X-Query-Count')
+    samples.append((status, elapsed, int(queries) if queries else None))
+
+def _reads(target, deadline, paths):
+    """GET ``paths`` in turn from one connection until ``deadline``; returns the samples"""
+    connection = _Connection(target)
+    samples = []
+    try:
+        for index in itertools.count():
+            if time.monotonic() >= deadline:
+                return samples
+            _record(connection, 'GET', paths[index % len(paths)], {}, samples)
+    finally:
+        connection.close()
+
+def _toggles(target, deadline, headers, path):
+    """POST to ``path`` in pairs from one connection until ``deadline``; returns the samples"""
+    connection = _Connection(target)
+    samples = []
+    try:
+        # Pairs, so the like ends as it started; the last one may finish after the deadline
+        while time.monotonic() < deadline:
+            _record(connection, 'POST', path, headers, samples)
+            _record(connection, 'POST', path, headers, samples)
+    finally:
+        connection.close()
+    return samples
+
+def run_mixed(app, target=None, seconds=10, readers=8, writers=2, workers=4, env=None):
+    """Read pages while toggling likes at the same time; returns the results document.
+
+    ``readers`` connections request the anonymous page and API routes in
+    turn. ``writers`` other connections, each signed in as a different
+    seeded user, toggle their like on the newest project (the one the
+    read routes show) twice in a row, so every like is put back. Without
+    ``target`` a gunicorn with ``workers`` workers and the ``env``
+    overrides is started for the run.
+    """
+    db.session.rollback()
+    reads = [path for _, path, as_admin in query_plans.route_paths() if not as_admin]
+    project_id = db.session.execute(db.select(Project.id).where(Project.status == 'published')
+                                    .order_by(Project.created_at.desc()).limit(1)).scalar()
+    emails = db.session.execute(db.select(User.email).where(User.email.like('user%@bench.example.com'))
+                                .order_by(User.id).limit(writers)).scalars().all()
+    if project_id is None or len(emails) < writers:
+        raise BenchmarkError('Not enough seeded users or projects; run flask seed-data first')
+    meta = _meta(app, 'mixed', seconds=seconds, readers=readers, writers=writers, concurrency=readers + writers,
+                 page_cache=False, env=dict(env or {}))
+    _release_connections()
+
+    with ExitStack() as stack:
+        server_pid = None
+        if target is None:
+            target, server_pid = stack.enter_context(gunicorn_server(app, workers, env=env))
+            meta['workers'] = workers
+        target = target.rstrip('/')
+        meta['target'] = target
+        # Routes that fail without any load (templates this tree cannot render) would only add noise
+        probe = _Connection(target)
+        try:
+            meta['skipped'] = [path for path in reads if probe.request('GET', path)[0] != 200]
+        finally:
+            probe.close()
+        reads = [path for path in reads if path not in meta['skipped']]
+        toggle = f'/project/{project_id}/like'
+        writer_headers = [dict(http_log_in(target, email, datagen.PASSWORD), Accept='application/json')
+                          for email in emails]
+
+        deadline = time.monotonic() + seconds
+        started = time.perf_counter()
+        with ThreadPoolExecutor(readers + writers) as pool:
+            # Each reader starts at a different route
+            read_jobs = [pool.submit(_reads, target, deadline, reads[index % len(reads):] + reads[:index % len(reads)])
+                         for index in range(readers)]
+            write_jobs = [pool.submit(_toggles, target, deadline, headers, toggle) for headers in writer_headers]
+            read_samples = [sample for job in read_jobs for sample in job.result()]
+            write_samples = [sample for job in write_jobs for sample in job.result()]
+        wall = time.perf_counter() - started
+        if server_pid:
+            meta['peak_rss_kib'] = max(_proc_status(pid, 'VmHWM') or 0 for pid in _children(server_pid))
+
+    return {'meta': meta, 'routes': [
+        summarize(Route('reads', 'GET', ' '.join(reads), False), read_samples, wall),
+        summarize(Route('writes', 'POST', toggle, False), write_samples, wall),
+    ]}
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def _server_env(app, **overrides):
+    return dict(os.environ, DATABASE_URL=app.config['SQLALCHEMY_DATABASE_URI'], MAIL_OUTBOX_SENDER='false',
+                **overrides)
+
+def _start_gunicorn(app, port, workers, env, preload=False):
+    command = [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--bind', f'127.0.0.1:{port}',
+               '--log-level', 'warning']
+    if preload:
+        command.append('--preload')
+    return subprocess.Popen(command + ['main:app'], cwd=app.root_path, env=env)
+
+@contextmanager
+def gunicorn_server(app, workers=4, page_cache=False, timeout=60, env=None):
+    """Start gunicorn on this app's database (``env`` adding settings) for the block; yields (url, pid)"""
+    port = _free_port()
+    env = _server_env(app, **{'QUERY_BUDGET_MODE': 'warn', **(env or {})})
+    if not page_cache:
+        env['PAGE_CACHE_TTL'] = '0'
+    process = _start_gunicorn(app, port, workers, env)
+    url = f'http://127.0.0.1:{port}'
+    try:
+        deadline = time.monotonic() + timeout
+        while len(_children(process.pid)) < workers or not _responds(url):
+            if process.poll() is not None:
+                raise BenchmarkError(f'gunicorn exited with status {process.returncode}')
+            if time.monotonic() > deadline:
+                raise BenchmarkError(f'gunicorn did not answer on {url} within {timeout}s')
+            time.sleep(0.2)
+        yield url, process.pid
+    finally:
+        process.terminate()
+        try:
+            process.wait(30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+def _responds(url):
+    connection = _Connection(url, timeout=5)
+    try:
+        connection.request('GET', '/about')
+        return True
+    except (OSError, http.client.HTTPException):
+        return False
+    finally:
+        connection.close()
+
+# Results only compare when these match
+COMPARABLE = ('mode', 'dialect', 'dataset', 'concurrency', 'page_cache', 'workers', 'readers', 'writers')
+
+def mismatches(baseline, current):
+    """Run settings that differ between two result documents"""
+    return [key for key in COMPARABLE if baseline['meta'].get(key) != current['meta'].get(key)]
+
+def _import_seconds(app, env):
+    code = 'import time; started = time.perf_counter(); import main; print(time.perf_counter() - started)'
+    result = subprocess.run([sys.executable, '-c', code], cwd=app.root_path, env=env,
+                            capture_output=True, text=True, check=True)
+    return float(result.stdout.split()[-1])
+
+def _first_response(app, env, workers, preload, path, timeout):
+    """Seconds from starting gunicorn until ``path`` answers, and that answer's status"""
+    port = _free_port()
+    started = time.perf_counter()
+    process = _start_gunicorn(app, port, workers, env, preload)
+    try:
+        while True:
+            connection = _Connection(f'http://127.0.0.1:{port}', timeout=timeout)
+            try:
+                status, _, _, _ = connection.request('GET', path)
+                return time.perf_counter() - started, status
+            except (OSError, http.client.HTTPException):
+                pass
+            finally:
+                connection.close()
+            if process.poll() is not None:
+                raise BenchmarkError(f'gunicorn exited with status {process.returncode}')
+            if time.perf_counter() - started > timeout:
+                raise BenchmarkError(f'gunicorn did not answer {path} within {timeout}s')
+            time.sleep(0.005)
+    finally:
+        process.terminate()
+        try:
+            process.wait(30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+def run_startup(app, runs=5, workers=1, preload=False, path='/', timeout=60):
+    """Time ``import main`` and gunicorn's first response, ``runs`` times each; returns the results document.
+
+    All runs share a fresh Jinja bytecode cache, so the first one compiles the
+    templates and the others show what a restarted worker pays.
+    """
+    with tempfile.TemporaryDirectory(prefix='portfolio-startup-') as cache_dir:
+        env = _server_env(app, JINJA_CACHE_DIR=cache_dir)
+        imports = [_import_seconds(app, env) for _ in range(runs)]
+        responses = [_first_response(app, env, workers, preload, path, timeout) for _ in range(runs)]
+    first = [seconds for seconds, _ in responses]
+
+    def summary(values):
+        ordered = sorted(values)
+        return {'runs': [round(value * 1000, 1) for value in values],
+                'min': round(ordered[0] * 1000, 1), 'median': round(ordered[len(ordered) // 2] * 1000, 1)}
+
+    return {
+        'meta': _meta(app, 'startup', runs=runs, workers=workers, preload=preload, path=path),
+        'import_ms': summary(imports),
+        'first_response_ms': summary(first),
+        'statuses': sorted({status for _, status in responses}),
+    }
+
+def compare(baseline, current):
+    """(label, metric, before, after, change %) for every route measured in both result documents"""
+    before = {route['label']: route for route in baseline['routes']}
+    rows = []
+    for route in current['routes']:
+        previous = before.get(route['label'])
+        if previous is None:
+            continue
+        for metric, old, new in (
+                *((f'p{percent}', previous['latency_ms'][f'p{percent}'], route['latency_ms'][f'p{percent}'])
+                  for percent in PERCENTILES),
+                ('rps', previous['throughput_rps'], route['throughput_rps']),
+                ('queries', previous['queries']['mean'], route['queries']['mean'])):
+            change = round((new - old) / old * 100, 1) if old and new is not None else None
+            rows.append((route['label'], metric, old, new, change))
+    return rows
+
+def regressions(rows, max_regression):
+    """Rows where p95 latency grew by more than ``max_regression`` percent or a route runs more queries"""
+    return [row for row in rows
+            if (row[1] == 'p95' and row[4] is not None and row[4] > max_regression)
+            or (row[1] == 'queries' and row[2] is not None and row[3] is not None and row[3] > row[2])]
+
+def save(results, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+        f.write('\n')
+
+def load(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
@@ -0,0 +1,380 @@
+import os
+from datetime import datetime
+import click
+from werkzeug.security import generate_password_hash
+from app import app, db
+import assets
+import benchmark
+import datagen
+import mail_outbox
+import migrations
+import project_io
+import query_plans
+import related
+import search
+import site_stats
+import static_export
+from models import Project, SiteSettings, UploadedImage, User
+from image_processing import UPLOAD_SIZES, build_variants, process_image
+from uploads import folder_path
+
+@app.cli.command('recount')
+def recount_command():
+    """Recompute the stored like/comment counters and the dashboard's daily rollups."""
+    updated = Project.recalculate_counters()
+    days = site_stats.rebuild(db.session.connection())
+    db.session.commit()
+    click.echo(f'Recounted engagement counters for {updated} projects and rollups for {days} days.')
+
+@app.cli.command('process-images')
+@click.option('--include-failed', is_flag=True, help='Also retry images that exhausted their attempts.')
+def process_images_command(include_failed):
+    """Process uploads still waiting in the incoming folder."""
+    statuses = ['pending', 'failed'] if include_failed else ['pending']
+    filenames = [image.filename for image in
+                 UploadedImage.query.filter(UploadedImage.status.in_(statuses)).all()]
+    if include_failed:
+        UploadedImage.query.filter_by(status='failed').update({'attempts': 0, 'status': 'pending'})
+        db.session.commit()
+    
+    ready = 0
+    for filename in filenames:
+        image = process_image(filename, retry=False)
+        if image is not None and image.status == 'ready':
+            ready += 1
+    click.echo(f'Processed {ready} of {len(filenames)} images.')
+
+@app.cli.command('build-image-variants')
+@click.option('--force', is_flag=True, help='Rebuild variants that already exist.')
+def build_image_variants_command(force):
+    """Backfill responsive variants for images already in UPLOAD_FOLDER."""
+    built = 0
+    for folder, (max_width, max_height) in UPLOAD_SIZES.items():
+        directory = folder_path(folder)
+        if not os.path.isdir(directory):
+            continue
+        
+        images = {image.filename: image for image in UploadedImage.query.filter_by(folder=folder)}
+        variant_files = {variant['filename'] for image in images.values()
+                         for variant in image.variants or [] if variant['filename'] != image.filename}
+        for filename in sorted(os.listdir(directory)):
+            if filename in variant_files or filename.endswith('.tmp') or not os.path.isfile(os.path.join(directory, filename)):
+                continue
+            
+            image = images.get(filename)
+            if image is None:
+                # Uploaded before background processing existed; the file is already resized
+                image = UploadedImage(filename=filename, folder=folder, max_width=max_width,
+                                      max_height=max_height, status='ready', processed_at=datetime.utcnow())
+                db.session.add(image)
+            elif image.status != 'ready' or (image.variants and not force):
+                continue
+            
+            try:
+                image.variants = build_variants(image)
+            except Exception as e:
+                db.session.rollback()
+                click.echo(f'Skipped {folder}/{filename}: {e}', err=True)
+                continue
+            db.session.commit()
+            built += 1
+    click.echo(f'Built variants for {built} images.')
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Bundle, minify, fingerprint and precompress the CSS/JS bundles."""
+    manifest = assets.build(app.static_folder)
+    for name, filename in sorted(manifest.items()):
+        click.echo(f'{name} -> {assets.DIST_FOLDER}/{filename}')
+
+@app.cli.command('reindex-search')
+def reindex_search_command():
+    """Rebuild the full-text search index for every published project."""
+    search.create_index()
+    search.reindex(db.session)
+    db.session.commit()
+    click.echo('Search index rebuilt.')
+
+@app.cli.command('db-init')
+@click.option('--admin-email', envvar='ADMIN_EMAIL', default='admin@portfolio.com', show_default=True,
+              help='E-mail of the admin user created when there is no admin yet (or ADMIN_EMAIL).')
+@click.option('--admin-password', envvar='ADMIN_PASSWORD', default='admin123',
+              help='Password for that user (or ADMIN_PASSWORD); change the default right away.')
+def db_init_command(admin_email, admin_password):
+    """Create the schema, apply pending migrations, and add the first admin user and the site settings row."""
+    db.create_all()
+    # Full-text search table (FTS5 on SQLite, tsvector + GIN on PostgreSQL)
+    search.create_index()
+    db.session.commit()
+    for m in migrations.upgrade():
+        click.echo(f'Applied {m.version}: {m.name}')
+
+    if not User.query.filter_by(is_admin=True).first():
+        db.session.add(User(username=admin_email.split('@')[0], email=admin_email,
+                            password_hash=generate_password_hash(admin_password), is_admin=True,
+                            first_name='Portfolio', last_name='Owner'))
+        click.echo(f'Admin user created: {admin_email}')
+    # Created up front so requests never have to write it
+    if not SiteSettings.query.first():
+        db.session.add(SiteSettings())
+    db.session.commit()
+    click.echo('Database ready.')
+
+@app.cli.command('db-upgrade')
+@click.option('--target', type=int, help='Stop after this migration version.')
+def db_upgrade_command(target):
+    """Apply pending schema migrations."""
+    applied = migrations.upgrade(target, on_applied=lambda m: click.echo(f'Applied {m.version}: {m.name}'))
+    if not applied:
+        click.echo('Database schema is up to date.')
+
+@app.cli.command('db-status')
+def db_status_command():
+    """List schema migrations and whether each has been applied."""
+    pending = {m.version for m in migrations.pending()}
+    for m in migrations.MIGRATIONS:
+        state = 'pending' if m.version in pending else 'applied'
+        click.echo(f'{m.version:>4}  {state:<8} {m.name}')
+
+@app.cli.command('check-query-plans')
+@click.option('--verbose', is_flag=True, help='Print the full plan of each offending statement.')
+def check_query_plans_command(verbose):
+    """EXPLAIN every query the hot routes run and fail on full table scans or error responses."""
+    failures = 0
+    for label, path, status, statement, plan, tables in query_plans.check(app):
+        failures += 1
+        if statement is None:
+            click.echo(f'{label} ({path}): HTTP {status}', err=True)
+            continue
+        click.echo(f'{label} ({path}, HTTP {status}): full scan of {", ".join(sorted(tables))}', err=True)
+        click.echo('    ' + ' '.join(statement.split()), err=True)
+        if verbose:
+            for line in plan:
+                click.echo('      ' + line, err=True)
+    if failures:
+        raise click.ClickException(f'{failures} routes or statements failed the check.')
+    click.echo('Every hot-route query uses an index.')
+
+@app.cli.command('export-projects')
+@click.argument('output', type=click.File('w', encoding='utf-8'), default='-')
+@click.option('--batch-size', default=500, show_default=True, help='Rows read per query.')
+def export_projects_command(output, batch_size):
+    """Write categories, tags and projects (with media references) as JSONL."""
+    for line in project_io.export_lines(batch_size):
+        output.write(line)
+
+@app.cli.command('import-projects')
+@click.argument('source', type=click.File('r', encoding='utf-8'))
+@click.option('--job', help='Checkpoint name (default: the file path); rerun with it to resume.')
+@click.option('--batch-size', default=500, show_default=True, help='Records written per transaction.')
+@click.option('--restart', is_flag=True, help='Ignore the checkpoint and import from the first line.')
+def import_projects_command(source, job, batch_size, restart):
+    """Import a JSONL export in batches, resuming after the last committed batch."""
+    job = job or os.path.abspath(source.name)
+    progress = lambda line, projects: click.echo(f'  line {line}: {projects} projects imported', err=True)
+    try:
+        result = project_io.import_lines(source, job, batch_size, restart, progress)
+    except project_io.ImportFormatError as e:
+        raise click.ClickException(f'{e} (rerun to resume after the last committed batch)')
+    if related.available():
+        click.echo(f'Rebuilt related projects for {related.rebuild(db.session.connection())} projects.')
+        db.session.commit()
+    if result.resumed_from:
+        click.echo(f'Resumed job {job} after line {result.resumed_from}.')
+    click.echo(f'Imported {result.projects} projects, {result.media} media references, '
+               f'{result.categories} new categories and {result.tags} new tags ({result.lines} lines).')
+
+@app.cli.command('send-mail')
+@click.option('--retry-failed', is_flag=True, help='Queue messages that ran out of attempts again first.')
+def send_mail_command(retry_failed):
+    """Send every due message in the mail outbox over one SMTP connection."""
+    if retry_failed:
+        requeued = mail_outbox.requeue_failed()
+        click.echo(f'Queued {requeued} failed messages again.')
+    smtp = mail_outbox.SMTPConnection()
+    sent = failed = 0
+    try:
+        while True:
+            batch_sent, batch_failed = mail_outbox.send_batch(smtp)
+            if not batch_sent and not batch_failed:
+                break
+            sent, failed = sent + batch_sent, failed + batch_failed
+    finally:
+        smtp.close()
+    click.echo(f'Sent {sent} messages; {failed} failed and were rescheduled or given up.')
+
+@app.cli.command('build-related')
+def build_related_command():
+    """Recompute every published project's related projects from scratch."""
+    if not related.available():
+        raise click.ClickException('NumPy is not installed; project pages use same-category projects.')
+    started = datetime.utcnow()
+    indexed = related.rebuild(db.session.connection())
+    db.session.commit()
+    click.echo(f'Indexed {indexed} projects in {(datetime.utcnow() - started).total_seconds():.1f}s.')
+
+@app.cli.command('export-static')
+@click.argument('output', required=False)
+@click.option('--full', is_flag=True, help='Re-render every page, not only the ones whose data changed.')
+def export_static_command(output, full):
+    """Bring the static copy of the public pages up to date (STATIC_EXPORT_DIR by default)."""
+    output = output or app.config['STATIC_EXPORT_DIR']
+    if not output:
+        raise click.ClickException('Pass an output directory or set STATIC_EXPORT_DIR.')
+    started = datetime.utcnow()
+    rendered, written, removed = static_export.export_site(output, full=full)
+    click.echo(f'Rendered {rendered} pages, wrote {written} files and removed {removed} '
+               f'in {(datetime.utcnow() - started).total_seconds():.1f}s.')
+
+@app.cli.command('seed-data')
+@click.option('--preset', type=click.Choice(sorted(datagen.PRESETS)), default='small', show_default=True,
+              help='Dataset size; the options below override single counts.')
+@click.option('--users', type=int, help='Users to create.')
+@click.option('--projects', type=int, help='Projects to create.')
+@click.option('--likes', type=int, help='Likes to create (spread over published projects).')
+@click.option('--comments', type=int, help='Comments to create.')
+@click.option('--seed', default=1, show_default=True, help='Random seed; the same seed gives the same rows.')
+@click.option('--end-date', type=click.DateTime(formats=['%Y-%m-%d']),
+              help='Last day of the generated history (default: today).')
+def seed_data_command(preset, users, projects, likes, comments, seed, end_date):
+    """Fill an empty database (after flask db-init) with a reproducible synthetic dataset for benchmarks."""
+    sizes = dict(datagen.PRESETS[preset])
+    for name, value in (('users', users), ('projects', projects), ('likes', likes), ('comments', comments)):
+        if value is not None:
+            sizes[name] = value
+    try:
+        dataset = datagen.generate(**sizes, seed=seed, end=end_date,
+                                   progress=lambda message: click.echo(f'  {message}', err=True))
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f'Seeded {dataset.users} users, {dataset.projects} projects ({dataset.published} published), '
+               f'{dataset.likes} likes and {dataset.comments} comments in {dataset.seconds}s '
+               f'(seed {dataset.seed}, history up to {dataset.end:%Y-%m-%d}).')
+    click.echo(f'Admin: {datagen.ADMIN_EMAIL} / {datagen.PASSWORD}')
+
+def _report_benchmark(results, output, baseline, max_regression):
+    click.echo(f'{"route":<32} {"p50":>8} {"p95":>8} {"p99":>8} {"req/s":>8} {"queries":>7} {"errors":>6}')
+    for route in results['routes']:
+        latency = route['latency_ms']
+        queries = route['queries']['mean']
+        click.echo(f'{route["label"]:<32} {latency["p50"]:>8.2f} {latency["p95"]:>8.2f} {latency["p99"]:>8.2f} '
+                   f'{route["throughput_rps"] or 0:>8.1f} {"-" if queries is None else queries:>7} '
+                   f'{route["errors"]:>6}')
+    if results['meta'].get('peak_rss_kib'):
+        click.echo(f'Peak RSS: {results["meta"]["peak_rss_kib"] / 1024:.1f} MiB')
+    if output:
+        benchmark.save(results, output)
+        click.echo(f'Results written to {output}.')
+
+    if baseline:
+        previous = benchmark.load(baseline)
+        differing = benchmark.mismatches(previous, results)
+        if differing:
+            click.echo(f'Warning: the baseline was run with a different {", ".join(differing)}.', err=True)
+        rows = benchmark.compare(previous, results)
+        for label, metric, before, after, change in rows:
+            if metric in ('p95', 'queries'):
+                shown = '' if change is None else f' ({change:+.1f}%)'
+                click.echo(f'{label:<32} {metric:<8} {before} -> {after}{shown}')
+        if max_regression is not None:
+            worse = benchmark.regressions(rows, max_regression)
+            if worse:
+                raise click.ClickException(f'{len(worse)} regressions against {baseline}.')
+
+@app.cli.command('benchmark')
+@click.argument('output', required=False)
+@click.option('--requests', 'count', type=click.IntRange(1), default=200, show_default=True, help='Timed requests per route.')
+@click.option('--warmup', default=20, show_default=True, help='Untimed requests per route first.')
+@click.option('--http', 'target', help='Benchmark a running server at this URL instead of in-process.')
+@click.option('--gunicorn', is_flag=True, help='Start gunicorn on this database and benchmark it over HTTP.')
+@click.option('--workers', default=4, show_default=True, help='gunicorn workers (with --gunicorn).')
+@click.option('--concurrency', default=8, show_default=True, help='Parallel connections over HTTP.')
+@click.option('--only', multiple=True, help='Only routes with this label (repeatable).')
+@click.option('--skip', multiple=True, help='Leave out routes with this label (repeatable).')
+@click.option('--page-cache', is_flag=True, help='Keep the anonymous page cache on.')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False), help='Earlier results to compare with.')
+@click.option('--max-regression', type=float,
+              help='With --baseline, fail if a p95 grew by more than this percent or a route runs more queries.')
+def benchmark_command(output, count, warmup, target, gunicorn, workers, concurrency, only, skip, page_cache,
+                      baseline, max_regression):
+    """Measure latency, throughput, SQL queries and memory of every route; optionally save JSON to OUTPUT."""
+    routes = [route for route in benchmark.benchmark_routes()
+              if (not only or route.label in only) and route.label not in skip]
+    try:
+        if gunicorn:
+            with benchmark.gunicorn_server(app, workers, page_cache) as (url, pid):
+                results = benchmark.run_http(app, url, count, warmup, concurrency, routes, server_pid=pid,
+                                             page_cache=page_cache)
+        elif target:
+            results = benchmark.run_http(app, target, count, warmup, concurrency, routes)
+        else:
+            results = benchmark.run_in_process(app, count, warmup, routes, page_cache)
+    except benchmark.BenchmarkError as e:
+        raise click.ClickException(str(e))
+
+    _report_benchmark(results, output, baseline, max_regression)
+
+@app.cli.command('benchmark-scenario')
+@click.argument('name', type=click.Choice(sorted(benchmark.SCENARIOS)))
+@click.argument('output', required=False)
+@click.option('--requests', 'count', type=click.IntRange(1), default=200, show_default=True, help='Timed requests per route.')
+@click.option('--warmup', default=20, show_default=True, help='Untimed requests per route first.')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False), help='Earlier results to compare with.')
+@click.option('--max-regression', type=float,
+              help='With --baseline, fail if a p95 grew by more than this percent or a route runs more queries.')
+def benchmark_scenario_command(name, output, count, warmup, baseline, max_regression):
+    """Run the focused benchmark NAME (each variant of a feature on the same routes); optionally save JSON to OUTPUT."""
+    try:
+        results = benchmark.run_scenario(app, name, count, warmup)
+    except benchmark.BenchmarkError as e:
+        raise click.ClickException(str(e))
+    _report_benchmark(results, output, baseline, max_regression)
+
+@app.cli.command('benchmark-mixed')
+@click.argument('output', required=False)
+@click.option('--seconds', type=click.IntRange(1), default=10, show_default=True, help='How long to send traffic.')
+@click.option('--readers', type=click.IntRange(1), default=8, show_default=True, help='Connections reading pages.')
+@click.option('--writers', type=click.IntRange(1), default=2, show_default=True, help='Connections toggling likes.')
+@click.option('--http', 'target', help='Drive a running server at this URL instead of starting gunicorn.')
+@click.option('--workers', default=4, show_default=True, help='gunicorn workers.')
+@click.option('--env', 'settings', multiple=True, metavar='NAME=VALUE',
+              help='Setting for the started gunicorn, e.g. SQLITE_JOURNAL_MODE=DELETE (repeatable).')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False), help='Earlier results to compare with.')
+@click.option('--max-regression', type=float,
+              help='With --baseline, fail if a p95 grew by more than this percent or a route runs more queries.')
+def benchmark_mixed_command(output, seconds, readers, writers, target, workers, settings, baseline, max_regression):
+    """Measure reads and like toggles running at the same time; optionally save JSON to OUTPUT."""
+    env = {}
+    for setting in settings:
+        name, sep, value = setting.partition('=')
+        if not sep:
+            raise click.BadParameter(f'{setting!r} is not NAME=VALUE', param_hint='--env')
+        env[name] = value
+    try:
+        results = benchmark.run_mixed(app, target, seconds, readers, writers, workers, env)
+    except benchmark.BenchmarkError as e:
+        raise click.ClickException(str(e))
+    if results['meta']['skipped']:
+        click.echo(f'Not answering 200 without load, left out: {", ".join(results["meta"]["skipped"])}', err=True)
+    _report_benchmark(results, output, baseline, max_regression)
+
+@app.cli.command('benchmark-startup')
+@click.argument('output', required=False)
+@click.option('--runs', type=click.IntRange(1), default=5, show_default=True, help='Cold starts to time.')
+@click.option('--workers', default=1, show_default=True, help='gunicorn workers.')
+@click.option('--preload', is_flag=True, help='Start gunicorn with --preload.')
+@click.option('--path', default='/', show_default=True, help='Page requested as the first response.')
+def benchmark_startup_command(output, runs, workers, preload, path):
+    """Time importing the app and gunicorn's first response; optionally save JSON to OUTPUT."""
+    try:
+        results = benchmark.run_startup(app, runs, workers, preload, path)
+    except benchmark.BenchmarkError as e:
+        raise click.ClickException(str(e))
+    for name in ('import_ms', 'first_response_ms'):
+        timings = results[name]
+        click.echo(f'{name:<18} median {timings["median"]:>7.1f}  min {timings["min"]:>7.1f}  '
+                   f'runs {", ".join(f"{value:.1f}" for value in timings["runs"])}')
+    click.echo(f'First response status: {", ".join(map(str, results["statuses"]))}')
+    if output:
+        benchmark.save(results, output)
+        click.echo(f'Results written to {output}.')
@@ -0,0 +1,142 @@
+"""Engine options, SQLite pragmas and read-replica routing.
+
+``engine_options`` builds the pool settings from the DB_POOL_* config.
+Pre-ping is off by default: it costs a round-trip on every checkout.
+POOL_RECYCLE replaces connections before servers drop them for being
+idle, and a connection that dies anyway is discarded with the rest of
+the pool when it raises.
+
+SQLite connections get the SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS and
+SQLITE_BUSY_TIMEOUT pragmas, and foreign key enforcement. In WAL mode readers do not wait for a
+writer, and a writer does not wait for readers. Only the journal mode is
+stored in the database file. It is changed only when it differs, since
+leaving WAL needs the only open connection.
+
+With DATABASE_REPLICA_URL set, GET and HEAD requests read from the
+replica. Writes, ``SELECT ... FOR UPDATE`` and reads after a write in
+the same request go to the primary, as does work outside requests. So do
+views marked ``@primary_database`` and pages rendered by the static
+exporter. A visitor whose request committed a write reads from the
+primary for the next DATABASE_REPLICA_STICKY_SECONDS, so they see their
+own changes whatever the replica lag. This is recorded in their session
+cookie, so it holds on every worker. Anonymous pages cached from the
+replica can be behind the primary by the replica lag, on top of
+PAGE_CACHE_TTL.
+"""
+import logging
+import sqlite3
+import time
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy.session import Session as FlaskSession
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session, scoped_session
+
+REPLICA = 'replica'
+# WSGI environ key that keeps a request on the primary (the static exporter sets it)
+PRIMARY_KEY = 'portfolio.db_primary'
+STICKY_KEY = 'db_primary_until'
+
+_INSERT_CONSTRUCTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+logger = logging.getLogger(__name__)
+
+def primary_database(view):
+    """Always read from the primary in this view (e.g. a link that follows a write made elsewhere)"""
+    view.primary_database = True
+    return view
+
+def dialect_insert(bind, table):
+    """INSERT into ``table`` with ON CONFLICT support for ``bind``'s dialect (a session or connection)
+
+    Only SQLite and PostgreSQL are supported; other dialects raise NotImplementedError.
+    """
+    connection = bind.connection() if isinstance(bind, (Session, scoped_session)) else bind
+    construct = _INSERT_CONSTRUCTS.get(connection.dialect.name)
+    if construct is None:
+        raise NotImplementedError(f'INSERT ... ON CONFLICT is not supported on {connection.dialect.name}; '
+                                  'use SQLite or PostgreSQL')
+    return construct(table)
+
+def engine_options(uri, config):
+    """SQLALCHEMY_ENGINE_OPTIONS (or a bind's options) for ``uri``"""
+    url = make_url(uri)
+    options = {'pool_pre_ping': config['DB_POOL_PRE_PING']}
+    # In-memory SQLite uses a single static connection; there is no pool to size
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        return options
+    options.update(pool_size=config['DB_POOL_SIZE'], max_overflow=config['DB_MAX_OVERFLOW'],
+                   pool_timeout=config['DB_POOL_TIMEOUT'], pool_recycle=config['DB_POOL_RECYCLE'])
+    return options
+
+def _sqlite_pragmas(journal_mode, synchronous, busy_timeout):
+    def apply(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            # First, so a journal mode change waits for other connections like any statement
+            cursor.execute(f'PRAGMA busy_timeout = {int(busy_timeout)}')
+            # Off by default in SQLite, so ON DELETE CASCADE (related_projects) would not run
+            cursor.execute('PRAGMA foreign_keys = ON')
+            if journal_mode:
+                current = cursor.execute('PRAGMA journal_mode').fetchone()[0]
+                if current.lower() not in (journal_mode.lower(), 'memory'):
+                    try:
+                        cursor.execute(f'PRAGMA journal_mode = {journal_mode}')
+                    except sqlite3.OperationalError as e:
+                        logger.warning('Could not switch SQLite from %s to %s journal mode: %s',
+                                       current, journal_mode, e)
+            if synchronous:
+                cursor.execute(f'PRAGMA synchronous = {synchronous}')
+        finally:
+            cursor.close()
+    return apply
+
+class RoutingSession(FlaskSession):
+    """Flask-SQLAlchemy session that sends the reads of replica requests to the replica bind"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and getattr(clause, 'is_select', False) and getattr(clause, '_for_update_arg', None) is None
+                and not self._flushing and not self.info.get('db_wrote')
+                and has_request_context() and g.get('db_replica')):
+            return self._db.engines[REPLICA]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+@event.listens_for(Session, 'after_flush')
+def _flushed(db_session, flush_context):
+    db_session.info['db_wrote'] = True
+
+@event.listens_for(Session, 'do_orm_execute')
+def _executed(state):
+    if state.is_insert or state.is_update or state.is_delete:
+        state.session.info['db_wrote'] = True
+
+@event.listens_for(Session, 'after_commit')
+def _stick_to_primary(db_session):
+    if (db_session.info.pop('db_wrote', False) and has_request_context()
+            and current_app.config['DATABASE_REPLICA_URL']):
+        session[STICKY_KEY] = int(time.time() + current_app.config['DATABASE_REPLICA_STICKY_SECONDS']) + 1
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_writes(db_session):
+    db_session.info.pop('db_wrote', None)
+
+def _choose_database():
+    view = current_app.view_functions.get(request.endpoint)
+    g.db_replica = (request.method in ('GET', 'HEAD')
+                    and not getattr(view, 'primary_database', False)
+                    and PRIMARY_KEY not in request.environ
+                    and session.get(STICKY_KEY, 0) <= time.time())
+
+def init_app(app):
+    """Set the SQLite pragmas on every new connection and route replica reads (with DATABASE_REPLICA_URL)"""
+    with app.app_context():
+        engines = app.extensions['sqlalchemy'].engines
+        for key, engine in engines.items():
+            if engine.dialect.name == 'sqlite':
+                # The replica is someone else's copy; only the primary's journal mode is ours to set
+                journal_mode = app.config['SQLITE_JOURNAL_MODE'] if key is None else ''
+                event.listen(engine, 'connect', _sqlite_pragmas(
+                    journal_mode, app.config['SQLITE_SYNCHRONOUS'], app.config['SQLITE_BUSY_TIMEOUT']))
+    if app.config['DATABASE_REPLICA_URL']:
+        app.before_request(_choose_database)
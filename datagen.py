@@ -0,0 +1,183 @@
+"""Seeded synthetic datasets for benchmarks and load tests.
+
+``flask seed-data`` fills an empty database with users, categories, tags,
+projects, likes and comments. The same seed, sizes and end date always
+produce the same rows. Popularity is skewed like a real site: a few tags,
+projects and commenters get most of the attention (Zipf weights). Every
+like and comment is dated after its project.
+
+Rows are written with Core executemany in batches, so mapper events do not
+run. The derived data (engagement counters, daily rollups, search index and,
+with NumPy, related projects) is rebuilt once at the end.
+"""
+import random
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+from itertools import accumulate
+from werkzeug.security import generate_password_hash
+from app import db
+import related
+import search
+import site_stats
+from models import Category, Comment, Like, Project, Tag, User, project_tags
+
+PRESETS = {
+    'small': {'users': 200, 'projects': 500, 'likes': 5_000, 'comments': 2_000},
+    'medium': {'users': 10_000, 'projects': 2_000, 'likes': 100_000, 'comments': 50_000},
+    'large': {'users': 100_000, 'projects': 10_000, 'likes': 1_000_000, 'comments': 500_000},
+}
+CATEGORIES = ('Web Development', 'Mobile Apps', 'UI/UX Design', 'Data Science', 'Machine Learning',
+              'DevOps', 'Game Development', 'Branding', 'Photography', 'Illustration',
+              'Open Source', 'Embedded Systems')
+TAG_COUNT = 200
+# Dataset spans this many days up to the end date
+HISTORY_DAYS = 3 * 365
+PUBLISHED_SHARE = 0.9
+FEATURED_SHARE = 0.05
+BATCH_SIZE = 5_000
+
+# Shared by every generated user (hashing 100k passwords would dominate the run)
+ADMIN_EMAIL = 'admin@bench.example.com'
+PASSWORD = 'benchmark'
+
+Dataset = namedtuple('Dataset', 'seed end users projects published likes comments seconds')
+
+_SYLLABLES = ('ka', 'lo', 'mi', 'ra', 'te', 'vo', 'su', 'ne', 'di', 'pa', 'zo', 'ri', 'an',
+              'el', 'or', 'us', 'ti', 'ma', 'be', 'co', 'fu', 'ga', 'hi', 'ju', 'ly')
+
+def _zipf_weights(count, exponent=1.1):
+    return list(accumulate(1 / (rank ** exponent) for rank in range(1, count + 1)))
+
+class _Words:
+    """Deterministic pseudo-words; common ones are picked far more often"""
+
+    def __init__(self, rng, size=5_000):
+        self.rng = rng
+        self.words = sorted({''.join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 4)))
+                             for _ in range(size)})
+        rng.shuffle(self.words)
+        self._weights = _zipf_weights(len(self.words), 1.0)
+
+    def text(self, low, high):
+        count = self.rng.randint(low, high)
+        return ' '.join(self.rng.choices(self.words, cum_weights=self._weights, k=count))
+
+    def title(self):
+        return self.text(2, 5).title()
+
+def _insert(table, rows):
+    """Insert ``rows`` (an iterable of dicts) in executemany batches; returns how many"""
+    total, batch = 0, []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            db.session.execute(table.insert(), batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        db.session.execute(table.insert(), batch)
+        total += len(batch)
+    return total
+
+def _ids(model):
+    return db.session.execute(db.select(model.id).order_by(model.id)).scalars().all()
+
+def _after(rng, start, end):
+    return start + timedelta(seconds=rng.random() * max((end - start).total_seconds(), 0))
+
+def generate(users, projects, likes, comments, seed=1, end=None, progress=None):
+    """Fill an empty database; returns a Dataset describing what was written"""
+    if db.session.execute(db.select(Project.id).limit(1)).first() is not None:
+        raise ValueError('The database already has projects; seed an empty one')
+    started = time.perf_counter()
+    end = end or datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    start = end - timedelta(days=HISTORY_DAYS)
+    rng = random.Random(seed)
+    words = _Words(rng)
+    report = progress or (lambda message: None)
+
+    password_hash = generate_password_hash(PASSWORD)
+    _insert(User.__table__, (
+        {'username': 'bench-admin' if i == 0 else f'user{i:06d}',
+         'email': ADMIN_EMAIL if i == 0 else f'user{i:06d}@bench.example.com',
+         'first_name': words.title(), 'last_name': words.title(),
+         'password_hash': password_hash, 'is_admin': i == 0, 'bio': words.text(5, 30),
+         'created_at': _after(rng, start, end), 'session_version': 1}
+        for i in range(users)))
+    user_ids = _ids(User)
+    report(f'{len(user_ids)} users')
+
+    _insert(Category.__table__, ({'name': name, 'description': words.text(5, 15), 'created_at': start}
+                                 for name in CATEGORIES))
+    _insert(Tag.__table__, ({'name': f'{word}-{i}', 'created_at': start}
+                            for i, word in enumerate(rng.sample(words.words, TAG_COUNT))))
+    category_ids, tag_ids = _ids(Category), _ids(Tag)
+    category_weights, tag_weights = _zipf_weights(len(category_ids), 0.8), _zipf_weights(len(tag_ids))
+
+    created = sorted(_after(rng, start, end) for _ in range(projects))
+    _insert(Project.__table__, (
+        {'title': words.title(), 'description': words.text(15, 40), 'content': words.text(80, 400),
+         'status': 'published' if rng.random() < PUBLISHED_SHARE else 'draft',
+         'featured': rng.random() < FEATURED_SHARE,
+         'category_id': rng.choices(category_ids, cum_weights=category_weights)[0],
+         'github_url': f'https://github.com/bench/project-{i}' if rng.random() < 0.5 else None,
+         'created_at': created_at, 'updated_at': created_at, 'like_count': 0, 'comment_count': 0}
+        for i, created_at in enumerate(created)))
+    project_rows = db.session.execute(
+        db.select(Project.id, Project.created_at).where(Project.status == 'published').order_by(Project.id)).all()
+    project_ids = _ids(Project)
+    _insert(project_tags, (
+        {'project_id': project_id, 'tag_id': tag_id}
+        for project_id in project_ids
+        for tag_id in set(rng.choices(tag_ids, cum_weights=tag_weights, k=rng.randint(1, 6)))))
+    report(f'{len(project_ids)} projects ({len(project_rows)} published)')
+
+    # Engagement goes to published projects only, the popular ones (a random order) getting most
+    popularity = list(range(len(project_rows)))
+    rng.shuffle(popularity)
+    weights = _zipf_weights(len(project_rows))
+    shares = [b - a for a, b in zip([0] + weights, weights)]
+
+    def like_counts():
+        # A project has at most one like per user; what the top projects cannot take moves down the list
+        remaining, remaining_weight = likes, weights[-1] if weights else 0
+        for share in shares:
+            count = min(len(user_ids), round(remaining * share / remaining_weight)) if remaining_weight else 0
+            remaining, remaining_weight = remaining - count, remaining_weight - share
+            yield count
+
+    like_count = _insert(Like.__table__, (
+        {'user_id': user_id, 'project_id': project_rows[index].id,
+         'created_at': _after(rng, project_rows[index].created_at, end)}
+        for index, count in zip(popularity, like_counts())
+        for user_id in rng.sample(user_ids, count)))
+    report(f'{like_count} likes')
+
+    def comment_rows():
+        project_weights = [0] * len(project_rows)
+        for index, share in zip(popularity, shares):
+            project_weights[index] = share
+        if not project_rows:
+            return
+        commented = rng.choices(project_rows, cum_weights=list(accumulate(project_weights)), k=comments)
+        authors = rng.choices(user_ids, cum_weights=_zipf_weights(len(user_ids), 0.9), k=comments)
+        for row, user_id in zip(commented, authors):
+            created_at = _after(rng, row.created_at, end)
+            yield {'user_id': user_id, 'project_id': row.id, 'content': words.text(3, 60),
+                   'created_at': created_at, 'updated_at': created_at}
+
+    comment_count = _insert(Comment.__table__, comment_rows())
+    report(f'{comment_count} comments')
+
+    Project.recalculate_counters()
+    site_stats.rebuild(db.session.connection())
+    search.create_index(db.session.connection())
+    search.reindex(db.session)
+    if related.available():
+        related.rebuild(db.session.connection())
+    db.session.commit()
+    report('counters, daily rollups, search index and related projects rebuilt')
+
+    return Dataset(seed, end, len(user_ids), len(project_ids), len(project_rows), like_count, comment_count,
+                   round(time.perf_counter() - started, 1))
@@ -0,0 +1,182 @@
+"""Background resizing of uploaded images.
+
+Uploads are written untouched to the incoming folder and recorded as an
+UploadedImage row. Once the request's transaction commits, a bounded thread
+pool resizes each image into its final folder and writes smaller widths and
+modern formats next to it (recorded in ``UploadedImage.variants``); failures
+are retried with exponential backoff and ``flask process-images`` re-runs
+anything left over. Pillow is imported by the functions that use it, so
+workers that never process an image do not load it.
+"""
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app import db
+import metrics
+from models import UploadedImage
+from page_cache import page_cache
+from uploads import folder_path
+
+INCOMING_FOLDER = 'uploads/incoming'
+
+# Bounding box each upload folder is resized to (matches the save_picture call sites)
+UPLOAD_SIZES = {
+    'uploads/projects': (800, 600),
+    'uploads/profiles': (300, 300),
+}
+
+VARIANT_EXTENSIONS = {'AVIF': '.avif', 'WEBP': '.webp'}
+VARIANT_QUALITY = {'AVIF': 60, 'WEBP': 80}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor(app):
+    # Created lazily so every gunicorn worker builds its own pool after forking
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=app.config['IMAGE_WORKERS'],
+                                           thread_name_prefix='image-worker')
+        return _executor
+
+def _incoming_path(app, filename):
+    return os.path.join(folder_path(INCOMING_FOLDER, app), filename)
+
+def queue_picture(form_picture, folder, size):
+    """Store an upload as-is and schedule its resize; returns the final filename"""
+    random_hex = secrets.token_hex(8)
+    _, f_ext = os.path.splitext(form_picture.filename)
+    picture_fn = random_hex + f_ext
+    
+    started = time.perf_counter()
+    path = _incoming_path(current_app, picture_fn)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    form_picture.save(path)
+    metrics.upload_seconds.observe(time.perf_counter() - started, folder=folder)
+    
+    db.session.add(UploadedImage(filename=picture_fn, folder=folder,
+                                 max_width=size[0], max_height=size[1]))
+    db.session.info.setdefault('queued_images', []).append(picture_fn)
+    return picture_fn
+
+@event.listens_for(Session, 'after_commit')
+def _submit_queued_images(session):
+    filenames = session.info.pop('queued_images', None)
+    if filenames:
+        app = current_app._get_current_object()
+        for filename in filenames:
+            submit(app, filename)
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_queued_images(session):
+    session.info.pop('queued_images', None)
+
+def submit(app, filename, delay=0):
+    """Hand an image to the worker pool, optionally after ``delay`` seconds"""
+    if delay:
+        timer = threading.Timer(delay, submit, (app, filename))
+        timer.daemon = True
+        timer.start()
+        return
+    _get_executor(app).submit(_run_job, app, filename)
+
+def _run_job(app, filename):
+    with app.app_context():
+        try:
+            process_image(filename)
+        except Exception:
+            app.logger.exception(f'Image processing crashed for {filename}')
+
+def process_image(filename, retry=True):
+    """Resize one pending upload into its final folder and record the outcome"""
+    from PIL import Image
+    image = UploadedImage.query.filter_by(filename=filename).first()
+    if image is None or image.status == 'ready':
+        return image
+    
+    started = time.perf_counter()
+    source = _incoming_path(current_app, filename)
+    target = os.path.join(folder_path(image.folder), filename)
+    try:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with Image.open(source) as img:
+            image_format = img.format
+            img.thumbnail((image.max_width, image.max_height), Image.Resampling.LANCZOS)
+            img.save(target + '.tmp', format=image_format)
+        os.replace(target + '.tmp', target)
+        image.variants = build_variants(image)
+        os.remove(source)
+    except Exception as e:
+        image.attempts += 1
+        image.last_error = f'{type(e).__name__}: {e}'
+        max_attempts = current_app.config['IMAGE_MAX_ATTEMPTS']
+        image.status = 'pending' if image.attempts < max_attempts else 'failed'
+        db.session.commit()
+        metrics.image_seconds.observe(time.perf_counter() - started, folder=image.folder, status='error')
+        if retry and image.status == 'pending':
+            delay = current_app.config['IMAGE_RETRY_DELAY'] * 2 ** (image.attempts - 1)
+            submit(current_app._get_current_object(), filename, delay=delay)
+        else:
+            current_app.logger.warning(f'Image processing failed for {filename}: {image.last_error}')
+        return image
+    
+    image.status = 'ready'
+    image.last_error = None
+    image.processed_at = datetime.utcnow()
+    db.session.commit()
+    metrics.image_seconds.observe(time.perf_counter() - started, folder=image.folder, status='ready')
+    page_cache.invalidate(f'image:{filename}')
+    return image
+
+def _variant_formats(fallback_format):
+    from PIL import features
+    formats = [f for f in current_app.config['IMAGE_VARIANT_FORMATS'] if features.check(f.lower())]
+    if fallback_format not in formats:
+        formats.append(fallback_format)
+    return formats
+
+def _for_modern_format(img):
+    # AVIF/WebP encoders only take RGB(A); palette and grey images need converting
+    if img.mode in ('RGB', 'RGBA'):
+        return img
+    has_alpha = img.mode in ('LA', 'PA') or 'transparency' in img.info
+    return img.convert('RGBA' if has_alpha else 'RGB')
+
+def build_variants(image):
+    """Write every width/format variant of a processed image; returns their descriptions"""
+    from PIL import Image
+    directory = folder_path(image.folder)
+    stem, ext = os.path.splitext(image.filename)
+    variants = []
+    
+    with Image.open(os.path.join(directory, image.filename)) as img:
+        fallback_format = img.format
+        img.load()
+        widths = sorted({w for w in current_app.config['IMAGE_VARIANT_WIDTHS'] if w < img.width} | {img.width})
+        for width in widths:
+            if width == img.width:
+                resized = img
+            else:
+                resized = img.resize((width, max(1, round(img.height * width / img.width))),
+                                     Image.Resampling.LANCZOS)
+            for image_format in _variant_formats(fallback_format):
+                if image_format == fallback_format and width == img.width:
+                    # The full-size fallback is the processed file itself
+                    filename = image.filename
+                elif image_format == fallback_format:
+                    filename = f'{stem}-{width}w{ext}'
+                    resized.save(os.path.join(directory, filename), format=image_format)
+                else:
+                    extension = VARIANT_EXTENSIONS.get(image_format, '.' + image_format.lower())
+                    filename = f'{stem}-{width}w{extension}'
+                    _for_modern_format(resized).save(os.path.join(directory, filename), format=image_format,
+                                                     quality=VARIANT_QUALITY.get(image_format, 80))
+                variants.append({'filename': filename, 'width': width, 'format': image_format})
+    return variants
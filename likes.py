@@ -0,0 +1,207 @@
+"""Like toggling.
+
+By default every toggle is one short transaction. DELETE ... RETURNING
+removes an existing like. Otherwise INSERT ... ON CONFLICT DO NOTHING
+RETURNING adds one, and a counter UPDATE ... RETURNING hands back the new
+count. Concurrent toggles therefore never hit the unique constraint, and
+the counter only moves when a row really changed.
+
+With LIKES_WRITE_BEHIND enabled, toggles are recorded in a per-worker
+buffer instead. A background thread writes the buffer every
+LIKES_FLUSH_INTERVAL seconds, or as soon as it holds LIKES_FLUSH_SIZE
+users' changes. A toggle then costs a single read. Until a flush,
+rendered pages show the last written count.
+"""
+import atexit
+import logging
+import threading
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import tuple_
+from app import db
+from database import dialect_insert
+from models import Like, Project
+from page_cache import page_cache
+import site_stats
+
+_projects = Project.__table__
+_likes = Like.__table__
+
+def _published(project_id):
+    return db.and_(_projects.c.id == project_id, _projects.c.status == 'published')
+
+def _insert_ignoring_duplicates(bind):
+    return dialect_insert(bind, _likes).on_conflict_do_nothing(index_elements=['user_id', 'project_id'])
+
+def _bump(project_id, delta):
+    # Engagement is not a content change, so updated_at stays as it is
+    return db.session.execute(
+        _projects.update().where(_projects.c.id == project_id)
+        .values(like_count=_projects.c.like_count + delta, updated_at=_projects.c.updated_at)
+        .returning(_projects.c.like_count)
+    ).scalar()
+
+def _toggle_now(user_id, project_id):
+    if db.session.execute(db.select(_projects.c.id).where(_published(project_id))).first() is None:
+        return None
+
+    removed = db.session.execute(
+        _likes.delete()
+        .where(_likes.c.user_id == user_id, _likes.c.project_id == project_id)
+        .returning(_likes.c.created_at)
+    ).first()
+    if removed is not None:
+        liked, delta, created_at = False, -1, removed.created_at
+    else:
+        created_at = datetime.utcnow()
+        added = db.session.execute(
+            _insert_ignoring_duplicates(db.session)
+            .values(user_id=user_id, project_id=project_id, created_at=created_at)
+            .returning(_likes.c.id)
+        ).first()
+        # No row means a concurrent request liked it first; the end state is the same
+        liked, delta = True, 1 if added is not None else 0
+
+    if delta:
+        like_count = _bump(project_id, delta)
+        site_stats.bump(db.session.connection(), site_stats.add({}, created_at, likes=delta))
+    else:
+        like_count = db.session.execute(
+            db.select(_projects.c.like_count).where(_projects.c.id == project_id)).scalar()
+    db.session.commit()
+    return liked, like_count
+
+class LikeBuffer:
+    """Per-worker write-behind buffer of like toggles.
+
+    ``_wanted`` maps (user_id, project_id) to the final liked state and
+    ``_deltas`` holds each project's unflushed change to its count. A flush
+    applies the wanted states with one multi-row INSERT and one DELETE. It
+    then adjusts the counters by the rows that actually changed, so
+    duplicate toggles from several workers cannot make the counts drift.
+    Each flush bumps ``_generation``; a toggle whose read raced a flush
+    retries the read so it never counts a change twice.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timer_lock = threading.Lock()
+        self._wanted = {}
+        self._deltas = {}
+        self._generation = 0
+        self._timer = None
+        self._timer_delay = None
+        self._app = None
+
+    def toggle(self, user_id, project_id):
+        key = (user_id, project_id)
+        while True:
+            generation = self._generation
+            row = db.session.execute(
+                db.select(
+                    _projects.c.like_count,
+                    db.select(_likes.c.id).where(_likes.c.user_id == user_id,
+                                                 _likes.c.project_id == _projects.c.id).exists(),
+                ).where(_published(project_id))
+            ).first()
+            if row is None:
+                return None
+            stored_count, stored_liked = row
+            with self._lock:
+                if generation != self._generation:
+                    continue
+                liked = not self._wanted.get(key, stored_liked)
+                if liked == stored_liked:
+                    self._wanted.pop(key, None)
+                else:
+                    self._wanted[key] = liked
+                delta = self._deltas.get(project_id, 0) + (1 if liked else -1)
+                self._deltas[project_id] = delta
+                size = len(self._wanted)
+                break
+
+        self._app = current_app._get_current_object()
+        self._schedule(size >= self._app.config['LIKES_FLUSH_SIZE'])
+        return liked, stored_count + delta
+
+    def _schedule(self, now=False):
+        delay = 0 if now else self._app.config['LIKES_FLUSH_INTERVAL']
+        with self._timer_lock:
+            if self._timer is not None and (self._timer_delay == 0 or delay):
+                return
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(delay, self.flush)
+            self._timer.daemon = True
+            self._timer_delay = delay
+            self._timer.start()
+
+    def flush(self):
+        """Write buffered toggles to the database; returns the number of users' changes written"""
+        if self._app is None:
+            return 0
+        with self._timer_lock:
+            self._timer = None
+        # Unlocked peek, so idle workers exit without connecting; a toggle racing it schedules another flush
+        if not self._wanted:
+            return 0
+        # Check out the connection before taking the lock: toggles waiting on the lock hold
+        # pooled connections of their own, so waiting for one under the lock could deadlock
+        with self._app.app_context(), db.engine.connect() as connection, self._lock:
+            if not self._wanted:
+                return 0
+            written = len(self._wanted)
+            try:
+                changed = self._write(connection, self._wanted)
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                logging.exception('Could not flush %d buffered likes; will retry', written)
+                self._schedule()
+                return 0
+            self._wanted.clear()
+            self._deltas.clear()
+            self._generation += 1
+        page_cache.invalidate(*(f'project:{project_id}' for project_id in changed))
+        return written
+
+    @staticmethod
+    def _write(connection, wanted):
+        now = datetime.utcnow()
+        likes = [{'user_id': user_id, 'project_id': project_id, 'created_at': now}
+                 for (user_id, project_id), liked in wanted.items() if liked]
+        unlikes = [key for key, liked in wanted.items() if not liked]
+        changed, daily = {}, {}
+        if likes:
+            for (project_id,) in connection.execute(
+                    _insert_ignoring_duplicates(connection).values(likes).returning(_likes.c.project_id)):
+                changed[project_id] = changed.get(project_id, 0) + 1
+                site_stats.add(daily, now, likes=1)
+        if unlikes:
+            for project_id, created_at in connection.execute(
+                    _likes.delete().where(tuple_(_likes.c.user_id, _likes.c.project_id).in_(unlikes))
+                    .returning(_likes.c.project_id, _likes.c.created_at)):
+                changed[project_id] = changed.get(project_id, 0) - 1
+                site_stats.add(daily, created_at, likes=-1)
+        site_stats.bump(connection, daily)
+        deltas = [{'project_id': project_id, 'delta': delta} for project_id, delta in changed.items() if delta]
+        if deltas:
+            connection.execute(
+                _projects.update().where(_projects.c.id == db.bindparam('project_id'))
+                .values(like_count=_projects.c.like_count + db.bindparam('delta'),
+                        updated_at=_projects.c.updated_at),
+                deltas,
+            )
+        return changed
+
+like_buffer = LikeBuffer()
+atexit.register(like_buffer.flush)
+
+def toggle_like(user_id, project_id):
+    """Flip ``user_id``'s like on a published project.
+
+    Returns (liked, like_count), or None when the project is not published.
+    """
+    if current_app.config.get('LIKES_WRITE_BEHIND'):
+        return like_buffer.toggle(user_id, project_id)
+    return _toggle_now(user_id, project_id)
@@ -0,0 +1,231 @@
+"""Persistent mail outbox drained by a background sender.
+
+queue_mail() only adds an OutgoingEmail row to the current transaction.
+A per-worker sender thread sends the message after commit, so a slow or
+unreachable SMTP server never holds up a request. The sender claims due
+messages in batches. Each claim is an UPDATE ... RETURNING lease, so
+several workers can share one outbox. Messages go out over one SMTP
+connection, which stays open while there is work. Failures are retried
+with exponential backoff. ``flask send-mail`` drains the outbox from the
+command line.
+"""
+import smtplib
+import threading
+from datetime import datetime, timedelta
+from flask import current_app
+from flask_mail import BadHeaderError, Message
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app import db, mail
+from models import OutgoingEmail
+
+_outbox = OutgoingEmail.__table__
+
+# Failures of the SMTP session itself rather than of one message
+_CONNECTION_ERRORS = (smtplib.SMTPConnectError, smtplib.SMTPServerDisconnected, smtplib.SMTPHeloError,
+                      smtplib.SMTPAuthenticationError, smtplib.SMTPNotSupportedError, OSError)
+
+def queue_mail(subject, recipients, body=None, html=None, sender=None):
+    """Add a message to the outbox; it is sent once the session commits"""
+    config = current_app.config
+    email = OutgoingEmail(subject=subject, recipients=list(recipients), body=body, html=html,
+                          sender=sender or config.get('MAIL_DEFAULT_SENDER') or config.get('MAIL_USERNAME'))
+    db.session.add(email)
+    db.session.info['mail_queued'] = True
+    return email
+
+@event.listens_for(Session, 'after_commit')
+def _wake_sender(session):
+    if session.info.pop('mail_queued', None) and current_app.config['MAIL_OUTBOX_SENDER']:
+        mail_sender.wake(current_app._get_current_object())
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_queued_mail(session):
+    session.info.pop('mail_queued', None)
+
+class SMTPConnection:
+    """One SMTP session reused across messages and reopened after errors"""
+
+    def __init__(self):
+        self._connection = None
+
+    @staticmethod
+    def _open_host(state):
+        # Same steps as flask_mail.Connection.configure_host, plus a socket timeout
+        timeout = current_app.config['MAIL_SMTP_TIMEOUT']
+        smtp_class = smtplib.SMTP_SSL if state.use_ssl else smtplib.SMTP
+        host = smtp_class(state.server, state.port, timeout=timeout)
+        try:
+            if state.use_tls:
+                host.starttls()
+            if state.username and state.password:
+                host.login(state.username, state.password)
+        except Exception:
+            host.close()
+            raise
+        return host
+
+    def send(self, message):
+        if self._connection is None:
+            # The settings Mail.init_app registered for this app (the Mail object has no state of its own)
+            state = current_app.extensions['mail']
+            connection = mail.connect()
+            connection.host = None if state.suppress else self._open_host(state)
+            self._connection = connection
+        self._connection.send(message)
+
+    def close(self):
+        connection, self._connection = self._connection, None
+        if connection is not None and connection.host is not None:
+            try:
+                connection.host.quit()
+            except (smtplib.SMTPException, OSError):
+                connection.host.close()
+
+def claim_batch(limit):
+    """Lease up to ``limit`` due messages to this sender and return their rows"""
+    now = datetime.utcnow()
+    due = (db.select(_outbox.c.id)
+           .where(_outbox.c.status.in_(('pending', 'sending')), _outbox.c.next_attempt_at <= now)
+           .order_by(_outbox.c.next_attempt_at, _outbox.c.id)
+           .limit(limit))
+    if db.session.connection().dialect.name == 'postgresql':
+        due = due.with_for_update(skip_locked=True)
+    lease = timedelta(seconds=current_app.config['MAIL_CLAIM_LEASE'])
+    rows = db.session.execute(
+        _outbox.update().where(_outbox.c.id.in_(due.scalar_subquery()))
+        .values(status='sending', next_attempt_at=now + lease)
+        .returning(*_outbox.c)
+    ).all()
+    db.session.commit()
+    return sorted(rows, key=lambda row: row.id)
+
+def _record(email_id, **values):
+    db.session.execute(_outbox.update().where(_outbox.c.id == email_id).values(**values))
+    db.session.commit()
+
+def _record_failure(row, error, permanent=False):
+    attempts = row.attempts + 1
+    values = {'attempts': attempts, 'last_error': f'{type(error).__name__}: {error}'}
+    if permanent or attempts >= current_app.config['MAIL_MAX_ATTEMPTS']:
+        values['status'] = 'failed'
+        current_app.logger.warning(f'Giving up on email {row.id}: {values["last_error"]}')
+    else:
+        delay = current_app.config['MAIL_RETRY_DELAY'] * 2 ** (attempts - 1)
+        values.update(status='pending', next_attempt_at=datetime.utcnow() + timedelta(seconds=delay))
+    _record(row.id, **values)
+
+def send_batch(smtp, limit=None):
+    """Claim and send one batch; returns (sent, failed) counts"""
+    rows = claim_batch(limit or current_app.config['MAIL_BATCH_SIZE'])
+    sent = failed = 0
+    for index, row in enumerate(rows):
+        message = Message(subject=row.subject, recipients=row.recipients, body=row.body,
+                          html=row.html, sender=row.sender)
+        try:
+            smtp.send(message)
+        except (smtplib.SMTPRecipientsRefused, BadHeaderError, AssertionError) as e:
+            # Rejected recipients or a malformed message; retrying will not change that
+            _record_failure(row, e, permanent=True)
+            failed += 1
+        except (smtplib.SMTPException, OSError) as e:
+            smtp.close()
+            if isinstance(e, _CONNECTION_ERRORS):
+                # The server is unreachable: back off the rest of the batch instead of
+                # waiting out a connection timeout for every message
+                for pending in rows[index:]:
+                    _record_failure(pending, e)
+                return sent, failed + len(rows) - index
+            _record_failure(row, e)
+            failed += 1
+        else:
+            _record(row.id, status='sent', sent_at=datetime.utcnow(), last_error=None)
+            sent += 1
+    return sent, failed
+
+def requeue_failed():
+    """Give every failed message a fresh set of attempts; returns how many"""
+    count = db.session.execute(
+        _outbox.update().where(_outbox.c.status == 'failed')
+        .values(status='pending', attempts=0, next_attempt_at=datetime.utcnow())
+    ).rowcount
+    db.session.commit()
+    return count
+
+def _next_due_in():
+    next_at = db.session.execute(
+        db.select(db.func.min(_outbox.c.next_attempt_at)).where(_outbox.c.status.in_(('pending', 'sending')))
+    ).scalar()
+    db.session.rollback()
+    if next_at is None:
+        return None
+    return max((next_at - datetime.utcnow()).total_seconds(), 0)
+
+class MailSender:
+    """Background thread that drains the outbox for this worker"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._app = None
+        self._stopping = False
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def wake(self, app):
+        """Start the sender if needed and have it look for due messages now"""
+        if not self.running:
+            with self._lock:
+                if not self.running:
+                    # Started lazily so every gunicorn worker runs its own thread after forking
+                    self._app = app
+                    self._thread = threading.Thread(target=self._run, name='mail-sender', daemon=True)
+                    self._thread.start()
+        self._wake.set()
+
+    def stop(self, timeout=None):
+        """Stop the thread after its current batch and close its SMTP connection"""
+        thread = self._thread
+        if thread is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        thread.join(timeout)
+        self._stopping = False
+
+    def _run(self):
+        smtp = SMTPConnection()
+        with self._app.app_context():
+            while not self._stopping:
+                self._wake.clear()
+                try:
+                    sent, failed = send_batch(smtp)
+                    if sent or failed:
+                        continue
+                    wait = _next_due_in()
+                except Exception:
+                    db.session.rollback()
+                    current_app.logger.exception('Mail sender crashed; retrying')
+                    smtp.close()
+                    wait = current_app.config['MAIL_RETRY_DELAY']
+                finally:
+                    db.session.remove()
+
+                idle = current_app.config['MAIL_SMTP_IDLE']
+                if not self._wake.wait(idle if wait is None else min(wait, idle)):
+                    if wait is None or wait >= idle:
+                        # Nothing due soon: do not hold the SMTP connection open
+                        smtp.close()
+            smtp.close()
+
+mail_sender = MailSender()
+
+def init_app(app):
+    """Start the sender on the first request so mail left over from a restart goes out"""
+    @app.before_request
+    def _start_mail_sender():
+        if not mail_sender.running and app.config['MAIL_OUTBOX_SENDER']:
+            mail_sender.wake(app)
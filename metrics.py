@@ -0,0 +1,348 @@
+"""Request, SQL, template and image-processing metrics, exposed for Prometheus at /metrics.
+
+Every request records its latency, the number of SQL statements it ran
+and their total time per endpoint, and every ``render_template`` its
+render time. Uploads record how long saving the file took, and the image
+workers how long each image took to process. All of these are histograms.
+
+Each worker keeps its own counts in memory and writes them to a file in
+METRICS_DIR every METRICS_FLUSH_INTERVAL seconds. ``/metrics`` adds up the
+files of all workers with the answering worker's live counts, so a scrape
+sees the whole server whichever worker it reaches. Files of workers that
+have exited are kept so the totals never go down. A worker that gets the
+pid of an earlier one continues from its file. By default METRICS_DIR is
+a temporary directory named after the parent process (the gunicorn
+master), so a restarted server starts from zero.
+
+``/metrics`` answers 404 until METRICS_TOKEN is set, and then only to
+requests that send it as a bearer token.
+
+Requests that take at least SLOW_REQUEST_THRESHOLD seconds are logged
+with their slowest SQL statements and the templates they rendered.
+Statements that take at least SLOW_QUERY_THRESHOLD seconds are logged
+on their own, including those run outside requests.
+"""
+import atexit
+import hmac
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from flask import abort, current_app, g, has_app_context, has_request_context, request, template_rendered
+from flask import before_render_template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from query_budget import query_budget
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+PREFIX = 'portfolio_'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SQL_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+TEMPLATE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+FILE_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_lock = threading.Lock()
+
+class Metric:
+    """A named family of series, one per combination of label values"""
+
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.series = {}
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def merge(self, key, values):
+        """Add another worker's values for one series"""
+        series = self.series.get(key)
+        if series is None:
+            self.series[key] = list(values)
+        elif len(series) == len(values):
+            for index, value in enumerate(values):
+                series[index] += value
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            series = self.series.setdefault(key, [0])
+            series[0] += amount
+
+    def samples(self, values):
+        yield '_total', '', values[0]
+
+class Histogram(Metric):
+    """Bucket counts (not cumulative; the last one is +Inf), then the sum and the count"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(float(bound) for bound in buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * (len(self.buckets) + 3)
+            series[bisect_left(self.buckets, value)] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self, values):
+        """(suffix, extra label, value) lines for one series"""
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), values):
+            cumulative += count
+            yield '_bucket', f'le="{_format_value(bound)}"', cumulative
+        yield '_sum', '', values[-2]
+        yield '_count', '', values[-1]
+
+request_seconds = Histogram('request_duration_seconds', 'Time to build the response, by endpoint',
+                            ('endpoint', 'method', 'status'))
+request_queries = Histogram('request_sql_queries', 'SQL statements run per request', ('endpoint',),
+                            QUERY_COUNT_BUCKETS)
+request_sql_seconds = Histogram('request_sql_seconds', 'Time spent in SQL per request', ('endpoint',),
+                                SQL_BUCKETS)
+template_seconds = Histogram('template_render_seconds', 'render_template time, by template', ('template',),
+                             TEMPLATE_BUCKETS)
+upload_seconds = Histogram('upload_save_seconds', 'Time to store an uploaded image', ('folder',), FILE_BUCKETS)
+image_seconds = Histogram('image_processing_seconds', 'Time to resize an image and write its variants',
+                          ('folder', 'status'), FILE_BUCKETS)
+slow_requests = Counter('slow_requests', 'Requests at or over SLOW_REQUEST_THRESHOLD', ('endpoint',))
+slow_queries = Counter('slow_queries', 'SQL statements at or over SLOW_QUERY_THRESHOLD', ('endpoint',))
+
+METRICS = (request_seconds, request_queries, request_sql_seconds, template_seconds, upload_seconds,
+           image_seconds, slow_requests, slow_queries)
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(value)
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def snapshot():
+    """This worker's series, as written to its file"""
+    with _lock:
+        return {metric.name: [[list(key), list(values)] for key, values in metric.series.items()]
+                for metric in METRICS if metric.series}
+
+def render(snapshots):
+    """Prometheus text format for the sum of several snapshots"""
+    lines = []
+    for metric in METRICS:
+        total = Metric(metric.name, metric.documentation)
+        for data in snapshots:
+            for key, values in data.get(metric.name, ()):
+                total.merge(tuple(key), values)
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        for key, values in sorted(total.series.items()):
+            labels = [f'{name}="{_escape(label)}"' for name, label in zip(metric.labels, key)]
+            for suffix, extra, value in metric.samples(values):
+                rendered = ','.join(labels + [extra] if extra else labels)
+                rendered = f'{{{rendered}}}' if rendered else ''
+                lines.append(f'{metric.name}{suffix}{rendered} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+class WorkerFiles:
+    """Publishes this worker's snapshot to METRICS_DIR and reads everyone else's"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._directory = None
+        self._interval = None
+        self._thread = None
+
+    @staticmethod
+    def directory(app):
+        return app.config['METRICS_DIR'] or os.path.join(tempfile.gettempdir(), f'portfolio-metrics-{os.getppid()}')
+
+    def _path(self, pid):
+        return os.path.join(self._directory, f'worker-{pid}.json')
+
+    def start(self, app):
+        """Start publishing for this process (once per worker, after forking)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._directory = self.directory(app)
+            self._interval = app.config['METRICS_FLUSH_INTERVAL']
+            os.makedirs(self._directory, exist_ok=True)
+            # Forked from a process that already counted (gunicorn --preload), or reusing an old pid
+            with _lock:
+                for metric in METRICS:
+                    metric.series.clear()
+            try:
+                with open(self._path(os.getpid()), encoding='utf-8') as f:
+                    previous = json.load(f)
+            except (OSError, ValueError):
+                previous = {}
+            with _lock:
+                for metric in METRICS:
+                    for key, values in previous.get(metric.name, ()):
+                        metric.merge(tuple(key), values)
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='metrics-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self._interval)
+            self.write()
+
+    def write(self):
+        if self._pid != os.getpid():
+            return
+        path = self._path(self._pid)
+        try:
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(snapshot(), f, separators=(',', ':'))
+            os.replace(path + '.tmp', path)
+        except OSError:
+            pass
+
+    def others(self):
+        """Latest snapshots written by every other worker"""
+        snapshots = []
+        if self._directory is None:
+            return snapshots
+        own = f'worker-{self._pid}.json'
+        for name in os.listdir(self._directory):
+            if not name.startswith('worker-') or not name.endswith('.json') or name == own:
+                continue
+            try:
+                with open(os.path.join(self._directory, name), encoding='utf-8') as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+worker_files = WorkerFiles()
+atexit.register(worker_files.write)
+
+class RequestStats:
+    """What one request did, for its metrics and the slow-request log"""
+
+    __slots__ = ('started', 'queries', 'sql_seconds', 'statements', 'templates', 'rendering')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.statements = []
+        self.templates = []
+        self.rendering = []
+
+def _request_stats():
+    return g.get('request_stats') if has_request_context() else None
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.metrics_started = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, 'metrics_started', None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    stats = _request_stats()
+    if stats is not None:
+        stats.queries += 1
+        stats.sql_seconds += elapsed
+        stats.statements.append((elapsed, statement))
+    if not has_app_context():
+        return
+    threshold = current_app.config.get('SLOW_QUERY_THRESHOLD', 0)
+    if threshold and elapsed >= threshold:
+        endpoint = (request.endpoint or 'unmatched') if has_request_context() else 'background'
+        slow_queries.inc(endpoint=endpoint)
+        current_app.logger.warning(f'Slow query ({elapsed * 1000:.1f} ms, {endpoint}): {" ".join(statement.split())}')
+
+def _before_render(sender, template, context, **extra):
+    stats = _request_stats()
+    if stats is not None:
+        stats.rendering.append(time.perf_counter())
+
+def _template_rendered(sender, template, context, **extra):
+    stats = _request_stats()
+    if stats is None or not stats.rendering:
+        return
+    elapsed = time.perf_counter() - stats.rendering.pop()
+    name = template.name or '<string>'
+    stats.templates.append((name, elapsed))
+    template_seconds.observe(elapsed, template=name)
+
+def _start_request():
+    worker_files.start(current_app._get_current_object())
+    g.request_stats = RequestStats()
+
+def _finish_request(response):
+    stats = g.pop('request_stats', None)
+    if stats is None:
+        return response
+    elapsed = time.perf_counter() - stats.started
+    endpoint = request.endpoint or 'unmatched'
+    request_seconds.observe(elapsed, endpoint=endpoint, method=request.method, status=response.status_code)
+    request_queries.observe(stats.queries, endpoint=endpoint)
+    request_sql_seconds.observe(stats.sql_seconds, endpoint=endpoint)
+
+    threshold = current_app.config['SLOW_REQUEST_THRESHOLD']
+    if threshold and elapsed >= threshold:
+        slow_requests.inc(endpoint=endpoint)
+        _log_slow_request(stats, elapsed, endpoint, response.status_code)
+    return response
+
+def _log_slow_request(stats, elapsed, endpoint, status):
+    lines = [f'Slow request ({elapsed * 1000:.1f} ms): {request.method} {request.full_path.rstrip("?")} '
+             f'-> {status} [{endpoint}], {stats.queries} SQL statements in {stats.sql_seconds * 1000:.1f} ms']
+    for name, seconds in stats.templates:
+        lines.append(f'  template {name}: {seconds * 1000:.1f} ms')
+    slowest = sorted(stats.statements, key=lambda item: item[0], reverse=True)
+    for seconds, statement in slowest[:current_app.config['SLOW_REQUEST_STATEMENTS']]:
+        lines.append(f'  sql {seconds * 1000:.1f} ms: {" ".join(statement.split())}')
+    current_app.logger.warning('\n'.join(lines))
+
+@query_budget(0)
+def metrics_view():
+    token = current_app.config['METRICS_TOKEN']
+    if not token:
+        # Latencies and per-endpoint counts are not for the public; no token, no endpoint
+        abort(404)
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        abort(401)
+    worker_files.start(current_app._get_current_object())
+    body = render([snapshot(), *worker_files.others()])
+    response = current_app.response_class(body, content_type=CONTENT_TYPE)
+    response.cache_control.no_store = True
+    return response
+
+def init_app(app):
+    """Instrument requests, SQL and templates and serve /metrics (unless METRICS_ENABLED is off)"""
+    if not app.config['METRICS_ENABLED']:
+        return
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_template_rendered, app)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
@@ -0,0 +1,203 @@
+"""Versioned schema migrations.
+
+``db.create_all()`` only creates missing tables, so changes to existing
+tables are applied here. Each migration is a function registered with
+``@migration(version)`` that receives a Connection. Applied versions are
+recorded in ``schema_migrations``, and ``flask db-upgrade`` runs the rest
+in order. Migrations check the live schema before changing it, so they are
+safe on databases that ``create_all()`` has already brought up to date.
+
+Migrations marked ``transactional=False`` run in autocommit mode. On
+PostgreSQL their indexes are built with CREATE INDEX CONCURRENTLY, which
+does not block writes to the table while it runs.
+"""
+from collections import namedtuple
+from datetime import datetime
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, select
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateColumn, CreateIndex
+from app import db
+import related
+import search
+import site_stats
+from models import (Comment, DailyStats, ImportCheckpoint, Like, OutgoingEmail, Project, RelatedProject,
+                    UploadedImage, User)
+
+Migration = namedtuple('Migration', 'version name upgrade transactional')
+
+MIGRATIONS = []
+
+# Arbitrary key for pg_advisory_lock so two deploys never migrate at once
+_ADVISORY_LOCK_KEY = 7245019
+
+_metadata = MetaData()
+schema_migrations = Table(
+    'schema_migrations', _metadata,
+    Column('version', Integer, primary_key=True),
+    Column('name', String(100), nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+def migration(version, transactional=True):
+    """Register ``func(connection)`` as schema migration ``version``"""
+    def decorator(func):
+        MIGRATIONS.append(Migration(version, func.__name__, func, transactional))
+        MIGRATIONS.sort(key=lambda m: m.version)
+        return func
+    return decorator
+
+def _has_column(connection, table, column):
+    return column in {c['name'] for c in inspect(connection).get_columns(table)}
+
+def _add_column(connection, table, column):
+    """ALTER TABLE ... ADD COLUMN for a model column, unless it already exists"""
+    if _has_column(connection, table.name, column.name):
+        return False
+    quoted = connection.dialect.identifier_preparer.format_table(table)
+    definition = CreateColumn(column).compile(dialect=connection.dialect)
+    connection.exec_driver_sql(f'ALTER TABLE {quoted} ADD COLUMN {definition}')
+    return True
+
+def _find_index(name):
+    for table in db.metadata.tables.values():
+        for index in table.indexes:
+            if index.name == name:
+                return index
+    raise LookupError(f'No index named {name} is declared on the models')
+
+def _create_index(connection, name):
+    """Create a model-declared index, concurrently on PostgreSQL"""
+    index = _find_index(name)
+    concurrently = connection.dialect.name == 'postgresql'
+    if concurrently:
+        # A failed concurrent build leaves an INVALID index behind that IF NOT EXISTS would keep
+        invalid = connection.exec_driver_sql(
+            "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE c.relname = %(name)s AND NOT i.indisvalid", {'name': name}
+        ).first()
+        if invalid:
+            connection.exec_driver_sql(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+
+    options = index.dialect_options['postgresql']
+    previous = options['concurrently']
+    options['concurrently'] = concurrently
+    try:
+        connection.execute(CreateIndex(index, if_not_exists=True))
+    finally:
+        options['concurrently'] = previous
+
+@migration(1)
+def engagement_counters(connection):
+    """Project.like_count/comment_count, backfilled from the like and comment tables"""
+    table = Project.__table__
+    added = [_add_column(connection, table, table.c[name]) for name in ('like_count', 'comment_count')]
+    if not any(added):
+        return
+    like_total = select(db.func.count(Like.id)).where(Like.project_id == table.c.id).scalar_subquery()
+    comment_total = select(db.func.count(Comment.id)).where(Comment.project_id == table.c.id).scalar_subquery()
+    connection.execute(table.update().values(like_count=like_total, comment_count=comment_total,
+                                             updated_at=table.c.updated_at))
+
+@migration(2)
+def uploaded_image_variants(connection):
+    """Background image processing table and its responsive variants column"""
+    table = UploadedImage.__table__
+    table.create(connection, checkfirst=True)
+    _add_column(connection, table, table.c.variants)
+
+@migration(3)
+def project_search_index(connection):
+    """Full-text search table, populated with every published project"""
+    search.create_index(connection)
+    with Session(bind=connection) as session:
+        search.reindex(session)
+
+@migration(4, transactional=False)
+def hot_path_indexes(connection):
+    """Composite indexes for the listing, detail, dashboard and tag filter queries"""
+    for name in ('ix_project_status_created_at',
+                 'ix_project_featured_status_created_at',
+                 'ix_project_category_status_created_at',
+                 'ix_project_created_at',
+                 'ix_project_tags_tag_id',
+                 'ix_project_media_project_id',
+                 'ix_comment_project_id_created_at',
+                 'ix_comment_created_at',
+                 'ix_comment_user_id',
+                 'ix_like_project_id'):
+        _create_index(connection, name)
+
+@migration(5)
+def import_checkpoints(connection):
+    """Resumable progress of bulk JSONL imports"""
+    ImportCheckpoint.__table__.create(connection, checkfirst=True)
+
+@migration(6)
+def mail_outbox(connection):
+    """Outbox table drained by the background mail sender"""
+    OutgoingEmail.__table__.create(connection, checkfirst=True)
+
+@migration(7)
+def user_session_version(connection):
+    """User.session_version, compared by the per-worker user cache"""
+    table = User.__table__
+    _add_column(connection, table, table.c.session_version)
+
+@migration(8)
+def daily_stats(connection):
+    """Per-day rollups behind the admin dashboard, backfilled from the raw tables"""
+    DailyStats.__table__.create(connection, checkfirst=True)
+    site_stats.rebuild(connection)
+
+@migration(9)
+def related_projects(connection):
+    """Precomputed related project lists (built now when NumPy is installed)"""
+    RelatedProject.__table__.create(connection, checkfirst=True)
+    if related.available():
+        related.rebuild(connection)
+
+def applied_versions(connection):
+    schema_migrations.create(connection, checkfirst=True)
+    return {row.version for row in connection.execute(select(schema_migrations.c.version))}
+
+def pending():
+    """Migrations not yet recorded in schema_migrations"""
+    with db.engine.begin() as connection:
+        applied = applied_versions(connection)
+    return [m for m in MIGRATIONS if m.version not in applied]
+
+def _record(connection, m):
+    connection.execute(schema_migrations.insert().values(
+        version=m.version, name=m.name, applied_at=datetime.utcnow()))
+
+def _run(m):
+    if m.transactional:
+        with db.engine.begin() as connection:
+            m.upgrade(connection)
+            _record(connection, m)
+    else:
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            m.upgrade(connection)
+            _record(connection, m)
+
+def upgrade(target=None, on_applied=None):
+    """Apply pending migrations up to ``target`` (default: all) in version order"""
+    # Autocommit, so the lock holder has no open snapshot for CREATE INDEX CONCURRENTLY to wait on
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as lock_connection:
+        locked = lock_connection.dialect.name == 'postgresql'
+        if locked:
+            lock_connection.exec_driver_sql(f'SELECT pg_advisory_lock({_ADVISORY_LOCK_KEY})')
+        try:
+            applied = []
+            # Re-read under the lock: another process may have migrated while we waited
+            for m in pending():
+                if target is not None and m.version > target:
+                    break
+                _run(m)
+                applied.append(m)
+                if on_applied is not None:
+                    on_applied(m)
+            return applied
+        finally:
+            if locked:
+                lock_connection.exec_driver_sql(f'SELECT pg_advisory_unlock({_ADVISORY_LOCK_KEY})')
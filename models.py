@@ -1,4 +1,6 @@
 from datetime import datetime, timedelta
+from sqlalchemy import event
+from sqlalchemy.orm import Session, configure_mappers, joinedload, selectinload
 from app import db
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -17,10 +19,19 @@ class User(UserMixin, db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     reset_token = db.Column(db.String(100), unique=True)
     reset_token_expires = db.Column(db.DateTime)
+    # Bumped on every change to the row so cached copies (user_cache) can tell they are stale
+    session_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
     # Relationships
     comments = db.relationship('Comment', backref='author', lazy=True, cascade='all, delete-orphan')
     likes = db.relationship('Like', backref='user', lazy=True, cascade='all, delete-orphan')
+    profile_upload = db.relationship('UploadedImage', uselist=False, viewonly=True, lazy='joined',
+                                     primaryjoin='foreign(User.profile_image) == UploadedImage.filename')
+    
+    @property
+    def profile_image_ready(self):
+        """False while the uploaded profile image is still being processed"""
+        return self.profile_upload is None or self.profile_upload.status == 'ready'
     
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
@@ -72,7 +83,9 @@ class Tag(db.Model):
 # Association table for many-to-many relationship between projects and tags
 project_tags = db.Table('project_tags',
     db.Column('project_id', db.Integer, db.ForeignKey('project.id'), primary_key=True),
-    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id'), primary_key=True)
+    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id'), primary_key=True),
+    # The primary key covers project -> tags; the tag filter needs tag -> projects
+    db.Index('ix_project_tags_tag_id', 'tag_id', 'project_id')
 )
 
 class Project(db.Model):
@@ -89,6 +102,10 @@ class Project(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Denormalized engagement counters, kept in sync by the Like/Comment mapper events below
+    like_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    comment_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
     # Foreign Keys
     category_id = db.Column(db.Integer, db.ForeignKey('category.id'))
     
@@ -97,14 +114,55 @@ class Project(db.Model):
     media = db.relationship('ProjectMedia', backref='project', lazy=True, cascade='all, delete-orphan')
     comments = db.relationship('Comment', backref='project', lazy=True, cascade='all, delete-orphan')
     likes = db.relationship('Like', backref='project', lazy=True, cascade='all, delete-orphan')
+    featured_upload = db.relationship('UploadedImage', uselist=False, viewonly=True, lazy='joined',
+                                      primaryjoin='foreign(Project.featured_image) == UploadedImage.filename')
     
-    @property
-    def like_count(self):
-        return Like.query.filter_by(project_id=self.id).count()
+    # Composite indexes matched to the listing queries in routes.py (added by migration 4)
+    __table_args__ = (
+        db.Index('ix_project_status_created_at', 'status', 'created_at', 'id'),
+        db.Index('ix_project_featured_status_created_at', 'featured', 'status', 'created_at'),
+        db.Index('ix_project_category_status_created_at', 'category_id', 'status', 'created_at'),
+        db.Index('ix_project_created_at', 'created_at', 'id'),
+    )
     
     @property
-    def comment_count(self):
-        return Comment.query.filter_by(project_id=self.id).count()
+    def featured_image_ready(self):
+        """False while the uploaded featured image is still being processed"""
+        return self.featured_upload is None or self.featured_upload.status == 'ready'
+    
+    @staticmethod
+    def load_profile(name, only=None):
+        """Loader options that fetch the object graph a page renders in a fixed number of queries.
+        
+        ``only`` restricts them to the named relationships, for callers that
+        render a subset of the page's fields.
+        """
+        loaders = {
+            'category': joinedload(Project.category),
+            'tags': selectinload(Project.tags),
+            'media': selectinload(Project.media),
+        }
+        profiles = {
+            'card': ('category', 'tags'),
+            'detail': ('category', 'tags', 'media'),
+            'admin_row': ('category',),
+        }
+        return tuple(loaders[relationship] for relationship in profiles[name]
+                     if only is None or relationship in only)
+    
+    @classmethod
+    def recalculate_counters(cls):
+        """Recompute like_count/comment_count for every project from the raw tables"""
+        like_total = db.select(db.func.count(Like.id)).where(Like.project_id == cls.id).scalar_subquery()
+        comment_total = db.select(db.func.count(Comment.id)).where(Comment.project_id == cls.id).scalar_subquery()
+        result = db.session.execute(
+            db.update(cls.__table__).values(
+                like_count=like_total,
+                comment_count=comment_total,
+                updated_at=cls.__table__.c.updated_at,
+            )
+        )
+        return result.rowcount
     
     def is_liked_by(self, user):
         if not user.is_authenticated:
@@ -123,11 +181,52 @@ class ProjectMedia(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Foreign Keys
-    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False)
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False, index=True)
     
     def __repr__(self):
         return f'<ProjectMedia {self.original_filename}>'
 
+class UploadedImage(db.Model):
+    """Background processing state of an uploaded image.
+    
+    The raw upload waits in the incoming folder until a worker has resized it
+    into ``folder``/``filename``; images without a row predate this table and
+    are treated as ready.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    filename = db.Column(db.String(200), unique=True, nullable=False)
+    folder = db.Column(db.String(100), nullable=False)  # e.g. uploads/projects
+    max_width = db.Column(db.Integer, nullable=False)
+    max_height = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, ready, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text)
+    # Resized copies as [{'filename', 'width', 'format'}], written by image_processing
+    variants = db.Column(db.JSON)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime)
+    
+    MIME_TYPES = {'AVIF': 'image/avif', 'WEBP': 'image/webp', 'JPEG': 'image/jpeg',
+                  'PNG': 'image/png', 'GIF': 'image/gif'}
+    PREFERRED_FORMATS = ('AVIF', 'WEBP')
+    
+    def variant_groups(self):
+        """(mime_type, variants by ascending width) pairs, modern formats first, for <picture> sources"""
+        groups = {}
+        for variant in sorted(self.variants or [], key=lambda v: v['width']):
+            groups.setdefault(variant['format'], []).append(variant)
+        
+        def preference(image_format):
+            if image_format in self.PREFERRED_FORMATS:
+                return self.PREFERRED_FORMATS.index(image_format)
+            return len(self.PREFERRED_FORMATS)
+        
+        return [(self.MIME_TYPES.get(image_format, 'image/' + image_format.lower()), groups[image_format])
+                for image_format in sorted(groups, key=preference)]
+    
+    def __repr__(self):
+        return f'<UploadedImage {self.filename} {self.status}>'
+
 class Comment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.Text, nullable=False)
@@ -138,6 +237,12 @@ class Comment(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False)
     
+    __table_args__ = (
+        db.Index('ix_comment_project_id_created_at', 'project_id', 'created_at'),
+        db.Index('ix_comment_created_at', 'created_at'),
+        db.Index('ix_comment_user_id', 'user_id'),
+    )
+    
     def __repr__(self):
         return f'<Comment {self.id}>'
 
@@ -150,11 +255,122 @@ class Like(db.Model):
     project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False)
     
     # Unique constraint to prevent duplicate likes
-    __table_args__ = (db.UniqueConstraint('user_id', 'project_id'),)
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'project_id'),
+        db.Index('ix_like_project_id', 'project_id'),
+    )
     
     def __repr__(self):
         return f'<Like {self.user_id}-{self.project_id}>'
 
+def _bump_project_counter(connection, target, column, delta):
+    """Atomically adjust one of the denormalized counters on the project of ``target``"""
+    # A project's own deletion cascades to its likes and comments; its row is going away
+    if target.project_id in db.object_session(target).info.get('projects_deleted', ()):
+        return
+    table = Project.__table__
+    connection.execute(
+        table.update()
+        .where(table.c.id == target.project_id)
+        # Keep updated_at untouched: engagement is not a content change
+        .values({column: table.c[column] + delta, 'updated_at': table.c.updated_at})
+    )
+
+@event.listens_for(Session, 'before_flush')
+def _collect_deleted_projects(session, flush_context, instances):
+    session.info['projects_deleted'] = {obj.id for obj in session.deleted if isinstance(obj, Project)}
+
+@event.listens_for(Session, 'after_flush')
+def _forget_deleted_projects(session, flush_context):
+    session.info.pop('projects_deleted', None)
+
+@event.listens_for(Like, 'after_insert')
+def _like_inserted(mapper, connection, target):
+    _bump_project_counter(connection, target, 'like_count', 1)
+
+@event.listens_for(Like, 'after_delete')
+def _like_deleted(mapper, connection, target):
+    _bump_project_counter(connection, target, 'like_count', -1)
+
+@event.listens_for(Comment, 'after_insert')
+def _comment_inserted(mapper, connection, target):
+    _bump_project_counter(connection, target, 'comment_count', 1)
+
+@event.listens_for(Comment, 'after_delete')
+def _comment_deleted(mapper, connection, target):
+    _bump_project_counter(connection, target, 'comment_count', -1)
+
+@event.listens_for(User, 'before_update')
+def _user_updated(mapper, connection, target):
+    # Relationship-only changes (a new comment or like) issue no UPDATE of their own
+    if db.object_session(target).is_modified(target, include_collections=False):
+        target.session_version = User.session_version + 1
+
+class RelatedProject(db.Model):
+    """One precomputed neighbour in a project's related list (see related.py)"""
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id', ondelete='CASCADE'), primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True)  # 0 = most similar
+    related_id = db.Column(db.Integer, db.ForeignKey('project.id', ondelete='CASCADE'), nullable=False)
+    score = db.Column(db.Float, nullable=False)
+    
+    __table_args__ = (
+        # Finds the lists a project appears in when it changes or is removed
+        db.Index('ix_related_project_related_id', 'related_id'),
+    )
+    
+    def __repr__(self):
+        return f'<RelatedProject {self.project_id}#{self.rank} -> {self.related_id}>'
+
+class DailyStats(db.Model):
+    """Per-day rollup of the projects, likes and comments created that day that still exist.
+    
+    Kept up to date by site_stats on every write, so dashboard totals and trends
+    read these few rows instead of counting the raw tables.
+    """
+    day = db.Column(db.Date, primary_key=True)
+    projects = db.Column(db.Integer, nullable=False, default=0)
+    published = db.Column(db.Integer, nullable=False, default=0)
+    likes = db.Column(db.Integer, nullable=False, default=0)
+    comments = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<DailyStats {self.day}>'
+
+class OutgoingEmail(db.Model):
+    """A message waiting in (or sent from) the mail outbox"""
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String(255), nullable=False)
+    sender = db.Column(db.String(255))
+    recipients = db.Column(db.JSON, nullable=False)
+    body = db.Column(db.Text)
+    html = db.Column(db.Text)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, sending, sent, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text)
+    # When a pending message is due, or when a claimed ('sending') one may be taken over
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.Index('ix_outgoing_email_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
+    
+    def __repr__(self):
+        return f'<OutgoingEmail {self.id} {self.status}>'
+
+class ImportCheckpoint(db.Model):
+    """Progress of a bulk JSONL import, committed together with each batch"""
+    id = db.Column(db.Integer, primary_key=True)
+    job = db.Column(db.String(200), unique=True, nullable=False)
+    line = db.Column(db.Integer, nullable=False, default=0)  # input lines fully imported
+    projects = db.Column(db.Integer, nullable=False, default=0)
+    completed = db.Column(db.Boolean, nullable=False, default=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<ImportCheckpoint {self.job} line {self.line}>'
+
 class SiteSettings(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     site_title = db.Column(db.String(200), default='Digital Portfolio')
@@ -171,3 +387,7 @@ class SiteSettings(db.Model):
     
     def __repr__(self):
         return f'<SiteSettings {self.site_title}>'
+
+# Create the backref attributes (Project.category, Comment.author, ...) now, not on the first
+# query: code that builds loader options from them can run before any query in a new worker
+configure_mappers()
@@ -0,0 +1,164 @@
+"""Process-local full-page cache for anonymous visitors.
+
+Pages are stored with a placeholder where the CSRF token was rendered, and
+every response gets the token of the visitor it is sent to (with the
+session cookie that token belongs to).
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from urllib.parse import urlencode
+from flask import current_app, g, make_response, request, session
+from flask_login import current_user
+from flask_wtf.csrf import generate_csrf
+from settings_cache import site_settings_cache
+
+# WSGI environ key the static exporter sets to a set that collects the rendered page's tags
+EXPORT_TAGS_KEY = 'portfolio.export_tags'
+
+# Stands in for the CSRF token in stored bodies; the token is bound to the session of whoever rendered it
+CSRF_PLACEHOLDER = b'__page_cache_csrf_token__'
+
+class CachedPage:
+    """A rendered response body plus the validators and tags it was stored with"""
+    
+    def __init__(self, body, mimetype, last_modified, tags, ttl):
+        self.body = body
+        self.mimetype = mimetype
+        self.has_csrf_token = CSRF_PLACEHOLDER in body
+        # Over the stored body: a revalidated copy keeps the token it was sent with, which stays
+        # valid for its session until WTF_CSRF_TIME_LIMIT
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.last_modified = last_modified
+        self.tags = frozenset(tags)
+        self.expires = time.monotonic() + ttl
+    
+    def to_response(self):
+        body = self.body
+        if self.has_csrf_token:
+            body = body.replace(CSRF_PLACEHOLDER, generate_csrf().encode())
+        response = current_app.response_class(body, mimetype=self.mimetype)
+        response.set_etag(self.etag)
+        if self.last_modified:
+            response.last_modified = self.last_modified
+        # Let browsers keep the page but revalidate it with the ETag every time
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
+class PageCache:
+    """LRU of rendered pages with tag-based invalidation.
+    
+    Entries are tagged with what they render (``project:<id>``,
+    ``category:<id>``, ``listing``) so a write only evicts the pages that
+    show the changed data. The cache lives in each worker; PAGE_CACHE_TTL
+    bounds how long other workers may serve a page after a write.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._keys_by_tag = {}
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires <= time.monotonic():
+                self._discard(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+    
+    def set(self, key, entry, max_entries):
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = entry
+            for tag in entry.tags:
+                self._keys_by_tag.setdefault(tag, set()).add(key)
+            while len(self._entries) > max_entries:
+                self._discard(next(iter(self._entries)))
+    
+    def invalidate(self, *tags):
+        """Evict every page tagged with any of ``tags``"""
+        with self._lock:
+            for tag in tags:
+                for key in list(self._keys_by_tag.get(tag, ())):
+                    self._discard(key)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_tag.clear()
+    
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry.tags:
+            keys = self._keys_by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_tag[tag]
+
+page_cache = PageCache()
+
+def cache_depends_on(*tags, projects=()):
+    """Record what the page being rendered shows, for invalidation and Last-Modified"""
+    if 'page_cache_tags' not in g:
+        return
+    g.page_cache_tags.update(tags)
+    for project in projects:
+        g.page_cache_tags.add(f'project:{project.id}')
+        if project.featured_image and not project.featured_image_ready:
+            g.page_cache_tags.add(f'image:{project.featured_image}')
+        if project.updated_at and (g.page_last_modified is None or project.updated_at > g.page_last_modified):
+            g.page_last_modified = project.updated_at
+
+def _cacheable_request():
+    if current_app.config.get('PAGE_CACHE_TTL', 0) <= 0:
+        return False
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    # Pending flash messages are rendered into the page, so it must not be shared
+    if '_flashes' in session:
+        return False
+    return not current_user.is_authenticated
+
+def _cache_key():
+    query = urlencode(sorted(request.args.items(multi=True)))
+    return (request.path, query, site_settings_cache.version)
+
+def cached_page(view):
+    """Serve ``view`` from the page cache for anonymous GET requests"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        export_tags = request.environ.get(EXPORT_TAGS_KEY)
+        if export_tags is not None:
+            # Rendered for the static export: record the tags, bypass the cache
+            g.page_cache_tags = export_tags
+            g.page_last_modified = None
+            return view(*args, **kwargs)
+        if not _cacheable_request():
+            return view(*args, **kwargs)
+        
+        key = _cache_key()
+        entry = page_cache.get(key)
+        if entry is None:
+            g.page_cache_tags = set()
+            g.page_last_modified = None
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200 or '_flashes' in session:
+                return response
+            
+            settings_updated = site_settings_cache.get().updated_at
+            last_modified = max(filter(None, (g.page_last_modified, settings_updated)), default=None)
+            body = response.get_data().replace(generate_csrf().encode(), CSRF_PLACEHOLDER)
+            entry = CachedPage(body, response.mimetype, last_modified,
+                               g.page_cache_tags, current_app.config['PAGE_CACHE_TTL'])
+            page_cache.set(key, entry, current_app.config.get('PAGE_CACHE_SIZE', 512))
+        return entry.to_response()
+    return wrapper
@@ -0,0 +1,130 @@
+"""Page-number and keyset (cursor) pagination over ``(created_at, id)``.
+
+Page numbers use an OFFSET plus a total that is cached per filter set for
+PAGINATION_COUNT_TTL seconds instead of being counted on every request.
+The PAGINATION_COUNT_SIZE most recently used totals are kept, and project
+writes in this worker drop them all.
+Keyset pages carry opaque ``after``/``before`` cursors, so deep pages cost
+the same as the first one and stay stable while new rows are inserted.
+Catalogs larger than PAGINATION_KEYSET_THRESHOLD use keyset navigation
+unless a ``page`` number is requested explicitly.
+"""
+import base64
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from flask import abort, current_app, request
+from app import db
+
+class KeysetPage:
+    """One page of a keyset-paginated query"""
+    
+    is_keyset = True
+    
+    def __init__(self, items, next_cursor, prev_cursor, total=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+    
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+    
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+def encode_cursor(row):
+    raw = f'{row.created_at.isoformat()}|{row.id}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(token):
+    """(created_at, id) from a cursor token, or None if it is malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        created_at, row_id = raw.split('|')
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+def keyset_paginate(query, model, per_page, after=None, before=None, total=None):
+    """Newest-first page of ``query`` after or before the given cursor"""
+    created_at, row_id = model.created_at, model.id
+    after_key = decode_cursor(after) if after else None
+    before_key = decode_cursor(before) if before else None
+    
+    if before_key:
+        query = query.filter(db.or_(created_at > before_key[0],
+                                    db.and_(created_at == before_key[0], row_id > before_key[1])))
+        rows = query.order_by(created_at.asc(), row_id.asc()).limit(per_page + 1).all()
+        has_prev = len(rows) > per_page
+        items = rows[:per_page][::-1]
+        has_next = True
+    else:
+        if after_key:
+            query = query.filter(db.or_(created_at < after_key[0],
+                                        db.and_(created_at == after_key[0], row_id < after_key[1])))
+        rows = query.order_by(created_at.desc(), row_id.desc()).limit(per_page + 1).all()
+        has_next = len(rows) > per_page
+        items = rows[:per_page]
+        has_prev = after_key is not None
+    
+    return KeysetPage(
+        items,
+        next_cursor=encode_cursor(items[-1]) if has_next and items else None,
+        prev_cursor=encode_cursor(items[0]) if has_prev and items else None,
+        total=total,
+    )
+
+_counts = OrderedDict()  # key -> (counted_at, total), least recently used first
+_counts_lock = threading.Lock()
+
+def cached_count(query, key):
+    """Row count of ``query``, reused for PAGINATION_COUNT_TTL seconds per ``key``.
+
+    Keys should be built from resolved ids, not raw query-string values,
+    so that made-up filters do not each get a count of their own.
+    """
+    ttl = current_app.config.get('PAGINATION_COUNT_TTL', 60)
+    now = time.monotonic()
+    with _counts_lock:
+        cached = _counts.get(key)
+        if cached and now - cached[0] < ttl:
+            _counts.move_to_end(key)
+            return cached[1]
+    
+    total = query.order_by(None).count()
+    with _counts_lock:
+        _counts[key] = (now, total)
+        _counts.move_to_end(key)
+        while len(_counts) > current_app.config.get('PAGINATION_COUNT_SIZE', 1000):
+            _counts.popitem(last=False)
+    return total
+
+def invalidate_counts():
+    """Forget every cached total so the next listings count afresh"""
+    with _counts_lock:
+        _counts.clear()
+
+def paginate(query, model, per_page, count_key):
+    """Page-number or keyset pagination, chosen from the request and catalog size"""
+    after = request.args.get('after')
+    before = request.args.get('before')
+    # Like the comments and API listings: a broken cursor is an error, not page one
+    if any(cursor and decode_cursor(cursor) is None for cursor in (after, before)):
+        abort(400)
+    total = cached_count(query, count_key)
+    
+    threshold = current_app.config.get('PAGINATION_KEYSET_THRESHOLD', 1000)
+    wants_page = 'page' in request.args
+    if after or before or (threshold and total > threshold and not wants_page):
+        return keyset_paginate(query, model, per_page, after=after, before=before, total=total)
+    
+    page = request.args.get('page', 1, type=int)
+    pagination = query.order_by(model.created_at.desc(), model.id.desc()).paginate(
+        page=page, per_page=per_page, error_out=False, count=False
+    )
+    pagination.total = total
+    return pagination
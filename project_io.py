@@ -0,0 +1,306 @@
+"""Streaming JSONL import/export of projects with their categories, tags and media.
+
+Every line is a JSON object with a ``type`` of ``category``, ``tag`` or
+``project``. Projects reference their category and tags by name and carry
+media as file references; the files themselves are copied separately.
+Categories and tags are matched by name, but projects have no key: import
+appends, so importing an export into the database it came from duplicates
+its projects. Names longer than their column are cut to fit.
+
+Export reads the tables in id order, one fixed-size chunk at a time. Import
+inserts fixed-size batches with executemany. Memory use therefore does not
+grow with the file. Each import batch is committed together with the job's
+ImportCheckpoint row, so rerunning an interrupted job skips the lines it
+has already imported.
+"""
+import json
+from collections import namedtuple
+from datetime import datetime
+from app import db
+from database import dialect_insert
+import search
+import site_stats
+from models import Category, ImportCheckpoint, Project, ProjectMedia, Tag, project_tags
+
+PROJECT_FIELDS = ('title', 'description', 'content', 'featured_image', 'external_url',
+                  'github_url', 'demo_url', 'status', 'featured')
+MEDIA_FIELDS = ('filename', 'original_filename', 'media_type', 'file_size')
+STATUSES = ('draft', 'published')
+
+ImportResult = namedtuple('ImportResult', 'job lines projects categories tags media resumed_from')
+
+class ImportFormatError(ValueError):
+    """A line of the import file cannot be imported; earlier batches stay committed"""
+
+    def __init__(self, line, message):
+        super().__init__(f'line {line}: {message}')
+        self.line = line
+
+def _dumps(record):
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+def _chunks(statement, id_column, batch_size):
+    """Rows of ``statement`` in id order, fetched ``batch_size`` at a time by keyset"""
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            statement.where(id_column > last_id).order_by(id_column).limit(batch_size)
+        ).all()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1].id
+
+def export_lines(batch_size=500):
+    """Yield the catalog as JSONL: categories, then tags, then projects"""
+    category = Category.__table__
+    for rows in _chunks(db.select(category.c.id, category.c.name, category.c.description),
+                        category.c.id, batch_size):
+        for row in rows:
+            yield _dumps({'type': 'category', 'name': row.name, 'description': row.description})
+
+    tag = Tag.__table__
+    for rows in _chunks(db.select(tag.c.id, tag.c.name), tag.c.id, batch_size):
+        for row in rows:
+            yield _dumps({'type': 'tag', 'name': row.name})
+
+    project = Project.__table__
+    media = ProjectMedia.__table__
+    statement = db.select(project, category.c.name.label('category_name')).outerjoin(
+        category, category.c.id == project.c.category_id)
+    for rows in _chunks(statement, project.c.id, batch_size):
+        ids = [row.id for row in rows]
+        tag_names, media_refs = {}, {}
+        for link in db.session.execute(
+            db.select(project_tags.c.project_id, tag.c.name)
+            .join(tag, tag.c.id == project_tags.c.tag_id)
+            .where(project_tags.c.project_id.in_(ids))
+            .order_by(project_tags.c.project_id, tag.c.name)
+        ):
+            tag_names.setdefault(link.project_id, []).append(link.name)
+        for item in db.session.execute(
+            db.select(media).where(media.c.project_id.in_(ids)).order_by(media.c.id)
+        ):
+            media_refs.setdefault(item.project_id, []).append(
+                {**{field: item._mapping[field] for field in MEDIA_FIELDS},
+                 'created_at': _isoformat(item.created_at)})
+
+        for row in rows:
+            record = {'type': 'project'}
+            record.update((field, row._mapping[field]) for field in PROJECT_FIELDS)
+            record.update(
+                created_at=_isoformat(row.created_at),
+                updated_at=_isoformat(row.updated_at),
+                category=row.category_name,
+                tags=tag_names.get(row.id, []),
+                media=media_refs.get(row.id, []),
+            )
+            yield _dumps(record)
+
+def _parse_datetime(value, line):
+    if value is None:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ImportFormatError(line, f'invalid timestamp {value!r}')
+
+def _text(record, field, line, required=False):
+    value = record.get(field)
+    if value is None:
+        if required:
+            raise ImportFormatError(line, f'missing {field}')
+        return None
+    if not isinstance(value, str):
+        raise ImportFormatError(line, f'{field} must be a string')
+    return value
+
+def _check_lengths(row, table, line):
+    """Reject strings longer than their column; PostgreSQL would fail the whole batch instead"""
+    for field, value in row.items():
+        length = getattr(table.c[field].type, 'length', None)
+        if isinstance(value, str) and length is not None and len(value) > length:
+            raise ImportFormatError(line, f'{field} is longer than {length} characters')
+
+def _project_row(record, line, now):
+    row = {field: _text(record, field, line) for field in PROJECT_FIELDS if field not in ('status', 'featured')}
+    row['title'] = _text(record, 'title', line, required=True)
+    row['description'] = _text(record, 'description', line, required=True)
+    row['status'] = record.get('status') or 'draft'
+    if row['status'] not in STATUSES:
+        raise ImportFormatError(line, f'status must be one of {", ".join(STATUSES)}')
+    row['featured'] = bool(record.get('featured', False))
+    row['created_at'] = _parse_datetime(record.get('created_at'), line) or now
+    row['updated_at'] = _parse_datetime(record.get('updated_at'), line) or row['created_at']
+    _check_lengths(row, Project.__table__, line)
+    return row
+
+def _media_rows(record, line, now):
+    rows = []
+    for item in record.get('media') or []:
+        if not isinstance(item, dict):
+            raise ImportFormatError(line, 'media entries must be objects')
+        row = {field: item.get(field) for field in MEDIA_FIELDS}
+        for field in ('filename', 'original_filename', 'media_type'):
+            if not isinstance(row[field], str) or not row[field]:
+                raise ImportFormatError(line, f'media entry is missing {field}')
+        row['created_at'] = _parse_datetime(item.get('created_at'), line) or now
+        _check_lengths(row, ProjectMedia.__table__, line)
+        rows.append(row)
+    return rows
+
+def _name(record, field, line, table, required=False):
+    """The stripped name in ``field``, cut to the length of ``table``'s name column"""
+    value = _text(record, field, line, required)
+    return (value or '').strip()[:table.c.name.type.length]
+
+def _tag_list(record, line):
+    tags = record.get('tags') or []
+    if not isinstance(tags, list) or not all(isinstance(name, str) for name in tags):
+        raise ImportFormatError(line, 'tags must be a list of names')
+    max_length = Tag.__table__.c.name.type.length
+    return list(dict.fromkeys(name.strip()[:max_length] for name in tags if name.strip()))
+
+def _ensure_named(table, rows, known):
+    """Insert-or-get rows of a table with a unique ``name``; fills ``known`` name -> id.
+
+    Returns how many names were not in the database before.
+    """
+    missing = {row['name']: row for row in rows if row['name'] not in known}
+    if not missing:
+        return 0
+    known.update(db.session.execute(
+        db.select(table.c.name, table.c.id).where(table.c.name.in_(list(missing)))).all())
+    new_rows = [row for name, row in missing.items() if name not in known]
+    if not new_rows:
+        return 0
+    # Names created concurrently by someone else are skipped and picked up by the re-select
+    db.session.execute(dialect_insert(db.session, table).on_conflict_do_nothing(index_elements=['name']), new_rows)
+    names = [row['name'] for row in new_rows]
+    known.update(db.session.execute(
+        db.select(table.c.name, table.c.id).where(table.c.name.in_(names))).all())
+    return len(new_rows)
+
+class _Batch:
+    """Parsed records waiting to be written by ``_write_batch``"""
+
+    def __init__(self):
+        self.categories = {}
+        self.tags = {}
+        self.projects = []  # (project row, category name, tag names, media rows)
+        self.records = 0
+
+def _add_record(batch, record, line, now):
+    if not isinstance(record, dict):
+        raise ImportFormatError(line, 'expected a JSON object')
+    batch.records += 1
+    kind = record.get('type', 'project')
+    if kind == 'category':
+        name = _name(record, 'name', line, Category.__table__, required=True)
+        if name:
+            batch.categories[name] = {'name': name, 'description': _text(record, 'description', line),
+                                      'created_at': now}
+    elif kind == 'tag':
+        name = _name(record, 'name', line, Tag.__table__, required=True)
+        if name:
+            batch.tags.setdefault(name, {'name': name, 'created_at': now})
+    elif kind == 'project':
+        category = _name(record, 'category', line, Category.__table__)
+        tags = _tag_list(record, line)
+        if category:
+            batch.categories.setdefault(category, {'name': category, 'description': None, 'created_at': now})
+        for name in tags:
+            batch.tags.setdefault(name, {'name': name, 'created_at': now})
+        batch.projects.append((_project_row(record, line, now), category, tags, _media_rows(record, line, now)))
+    else:
+        raise ImportFormatError(line, f'unknown record type {kind!r}')
+
+def _write_batch(batch, categories, tags, totals):
+    totals['categories'] += _ensure_named(Category.__table__, list(batch.categories.values()), categories)
+    totals['tags'] += _ensure_named(Tag.__table__, list(batch.tags.values()), tags)
+    if not batch.projects:
+        return
+
+    project_rows = []
+    for row, category, _, _ in batch.projects:
+        row['category_id'] = categories[category] if category else None
+        project_rows.append(row)
+    project_table = Project.__table__
+    ids = db.session.execute(
+        project_table.insert().returning(project_table.c.id, sort_by_parameter_order=True), project_rows
+    ).scalars().all()
+
+    links, media_rows = [], []
+    for project_id, (_, _, tag_names, media) in zip(ids, batch.projects):
+        links.extend({'project_id': project_id, 'tag_id': tags[name]} for name in tag_names)
+        media_rows.extend(dict(item, project_id=project_id) for item in media)
+    if links:
+        db.session.execute(project_tags.insert(), links)
+    if media_rows:
+        db.session.execute(ProjectMedia.__table__.insert(), media_rows)
+    # Core inserts bypass the session and mapper events that keep the search index
+    # and the dashboard rollups in sync
+    search.reindex(db.session, ids)
+    daily = {}
+    for row in project_rows:
+        site_stats.add(daily, row['created_at'], projects=1, published=int(row['status'] == 'published'))
+    site_stats.bump(db.session.connection(), daily)
+    totals['projects'] += len(ids)
+    totals['media'] += len(media_rows)
+
+def import_lines(lines, job, batch_size=500, restart=False, progress=None):
+    """Import JSONL ``lines`` under the checkpoint ``job``, resuming where it stopped.
+
+    ``progress(line, projects)`` is called after every committed batch.
+    """
+    checkpoint = ImportCheckpoint.query.filter_by(job=job).first()
+    if checkpoint is None:
+        checkpoint = ImportCheckpoint(job=job, line=0, projects=0, completed=False)
+        db.session.add(checkpoint)
+        db.session.commit()
+    elif restart:
+        checkpoint.line, checkpoint.projects, checkpoint.completed = 0, 0, False
+        db.session.commit()
+    resumed_from = checkpoint.line
+    totals = {'projects': 0, 'categories': 0, 'tags': 0, 'media': 0}
+    if checkpoint.completed:
+        return ImportResult(job, checkpoint.line, 0, 0, 0, 0, resumed_from)
+
+    categories, tags = {}, {}
+    batch = _Batch()
+    line = 0
+
+    def commit(line):
+        _write_batch(batch, categories, tags, totals)
+        checkpoint.line = line
+        checkpoint.projects = checkpoint.projects + len(batch.projects)
+        db.session.commit()
+        if progress is not None:
+            progress(line, checkpoint.projects)
+
+    now = datetime.utcnow()
+    for line, text in enumerate(lines, 1):
+        if line <= resumed_from or not text.strip():
+            continue
+        try:
+            record = json.loads(text)
+        except ValueError as e:
+            db.session.rollback()
+            raise ImportFormatError(line, f'invalid JSON ({e})')
+        try:
+            _add_record(batch, record, line, now)
+        except ImportFormatError:
+            db.session.rollback()
+            raise
+        if batch.records >= batch_size:
+            commit(line)
+            batch = _Batch()
+            now = datetime.utcnow()
+
+    checkpoint.completed = True
+    commit(max(line, resumed_from))
+    return ImportResult(job, checkpoint.line, totals['projects'], totals['categories'],
+                        totals['tags'], totals['media'], resumed_from)
@@ -0,0 +1,43 @@
+"""Per-request SQL query counting with an optional budget to catch N+1 regressions"""
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+class QueryBudgetExceeded(RuntimeError):
+    """Raised when a view runs more SQL statements than its declared budget"""
+
+def query_budget(limit):
+    """Declare the maximum number of SQL statements a view may run per request"""
+    def decorator(view):
+        view.query_budget = limit
+        return view
+    return decorator
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.query_count = g.get('query_count', 0) + 1
+
+def _check_query_budget(response):
+    mode = current_app.config.get('QUERY_BUDGET_MODE', 'off')
+    if mode == 'off':
+        return response
+    
+    count = g.get('query_count', 0)
+    response.headers['X-Query-Count'] = str(count)
+    
+    view = current_app.view_functions.get(request.endpoint)
+    limit = getattr(view, 'query_budget', None)
+    if limit is None or count <= limit:
+        return response
+    
+    message = f'{request.endpoint} ran {count} SQL queries (budget {limit})'
+    if mode == 'raise':
+        raise QueryBudgetExceeded(message)
+    current_app.logger.warning(message)
+    return response
+
+def init_app(app):
+    """Count queries on every engine and check budgets after each request"""
+    if not event.contains(Engine, 'before_cursor_execute', _count_query):
+        event.listen(Engine, 'before_cursor_execute', _count_query)
+    app.after_request(_check_query_budget)
@@ -0,0 +1,155 @@
+"""Query-plan regression check for the hot routes.
+
+``flask check-query-plans`` requests each route below with the test
+client, captures every SELECT it runs, and EXPLAINs them against the
+current database. Any statement that reads a large table with a full
+sequential scan instead of an index is reported. Run it against a seeded
+database; with only a handful of rows PostgreSQL would prefer sequential
+scans anyway, so ``enable_seqscan`` is turned off while explaining and a
+sequential scan in the plan means that no usable index exists. A route
+that does not answer with a 2xx status fails the check as well.
+"""
+import contextvars
+import re
+from flask import current_app
+from sqlalchemy import event
+from app import db
+from models import Category, Project, Tag, User
+
+# Small lookup tables (and the one-row-per-day rollups) that are read whole on purpose
+FULL_SCAN_ALLOWED = {'category', 'tag', 'site_settings', 'project_search', 'daily_stats'}
+
+# "SCAN t" reads every row; "SCAN t USING INDEX i" walks a whole index, fine only under a LIMIT
+_SQLITE_SCAN_RE = re.compile(r'^SCAN (\w+)(?: USING (COVERING )?INDEX \w+)?$')
+_SQLITE_AUTOMATIC_RE = re.compile(r'^(?:SCAN|SEARCH) (\w+) USING AUTOMATIC')
+_POSTGRES_SCAN_RE = re.compile(r'Seq Scan on "?(\w+)"?')
+_LIMIT_RE = re.compile(r'\bLIMIT\b', re.IGNORECASE)
+_ALIAS_SUFFIX_RE = re.compile(r'_\d+$')
+
+def route_paths():
+    """(label, path, as_admin) for every route the check drives, using real ids from the database"""
+    project = Project.query.filter_by(status='published').order_by(Project.created_at.desc()).first()
+    category = Category.query.first()
+    tag = Tag.query.first()
+    paths = [
+        ('index', '/', False),
+        ('about', '/about', False),
+        ('projects', '/projects', False),
+        ('search', '/search?q=projeto', False),
+        ('api_projects', '/api/v1/projects', False),
+        ('api_categories', '/api/v1/categories', False),
+        ('api_tags', '/api/v1/tags', False),
+        ('admin_dashboard', '/admin', True),
+        ('admin_projects', '/admin/projects', True),
+    ]
+    if category is not None:
+        paths.append(('projects by category', f'/projects?category={category.id}', False))
+    if tag is not None:
+        paths.append(('projects by tag', f'/projects?tag={tag.name}', False))
+        paths.append(('api_projects by tag', f'/api/v1/projects?tag={tag.name}', False))
+    if project is not None:
+        paths.append(('project_detail', f'/project/{project.id}', False))
+        paths.append(('project_comments', f'/project/{project.id}/comments', False))
+        paths.append(('api_project', f'/api/v1/projects/{project.id}', False))
+        paths.append(('api_project_comments', f'/api/v1/projects/{project.id}/comments', False))
+        paths.append(('edit_project', f'/admin/project/{project.id}/edit', True))
+    return paths
+
+def missing_endpoint(error, endpoint, values):
+    # Templates may link to pages this tree does not define; the check is about SQL, not links
+    return '#'
+
+def log_in(client, user_id):
+    """Sign a test client in as ``user_id`` without going through the login form"""
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+
+def capture_statements(app, path, user_id=None):
+    """SELECT statements (with their DB-API parameters) run while serving ``path``"""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT') and not executemany:
+            statements.append((statement, parameters))
+
+    client = app.test_client()
+    if user_id is not None:
+        contextvars.Context().run(log_in, client, user_id)
+
+    engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    app.url_build_error_handlers.append(missing_endpoint)
+    try:
+        # Run outside the caller's app context so the request gets its own g, session and user
+        response = contextvars.Context().run(client.get, path)
+    finally:
+        app.url_build_error_handlers.remove(missing_endpoint)
+        event.remove(engine, 'before_cursor_execute', record)
+    return response.status_code, statements
+
+def explain(connection, statement, parameters):
+    """Plan lines for one statement on the connection's dialect"""
+    if connection.dialect.name == 'sqlite':
+        rows = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters)
+        return [row[-1] for row in rows]
+    rows = connection.exec_driver_sql('EXPLAIN ' + statement, parameters)
+    return [row[0] for row in rows]
+
+def _sqlite_full_scan(line, limited):
+    automatic = _SQLITE_AUTOMATIC_RE.match(line)
+    if automatic:
+        # SQLite builds a throwaway index when no real one exists
+        return automatic.group(1)
+    match = _SQLITE_SCAN_RE.match(line)
+    if match is None:
+        return None
+    table, using_index, covering = match.group(1), ' USING ' in line, match.group(2)
+    if not using_index or not (covering or limited):
+        return table
+    return None
+
+def full_scans(dialect, statement, plan):
+    """Tables the plan reads in full instead of through an index"""
+    tables = set()
+    limited = bool(_LIMIT_RE.search(statement))
+    for line in plan:
+        if dialect == 'sqlite':
+            table = _sqlite_full_scan(line.strip(), limited)
+        else:
+            match = _POSTGRES_SCAN_RE.search(line)
+            table = match.group(1) if match else None
+        if table:
+            # SQLite reports the query's aliases, e.g. category_1
+            tables.add(_ALIAS_SUFFIX_RE.sub('', table))
+    return tables - FULL_SCAN_ALLOWED
+
+def check(app=None):
+    """Yield (label, path, status, statement, plan, tables) for every statement with a full scan
+
+    A route that does not answer 2xx is yielded once with no statement.
+    """
+    app = app or current_app._get_current_object()
+    admin = User.query.filter_by(is_admin=True).first()
+    cache_ttl = app.config['PAGE_CACHE_TTL']
+    app.config['PAGE_CACHE_TTL'] = 0  # every request must reach the database
+    try:
+        for label, path, as_admin in route_paths():
+            if as_admin and admin is None:
+                continue
+            status, statements = capture_statements(app, path, admin.id if as_admin else None)
+            if not 200 <= status < 300:
+                # An error page's queries say nothing about the route's plans
+                yield label, path, status, None, [], set()
+                continue
+            with db.engine.connect() as connection:
+                if connection.dialect.name == 'postgresql':
+                    connection.exec_driver_sql('SET enable_seqscan = off')
+                for statement, parameters in statements:
+                    plan = explain(connection, statement, parameters)
+                    tables = full_scans(connection.dialect.name, statement, plan)
+                    if tables:
+                        yield label, path, status, statement, plan, tables
+                connection.rollback()
+    finally:
+        app.config['PAGE_CACHE_TTL'] = cache_ttl
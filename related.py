@@ -0,0 +1,367 @@
+"""Precomputed related projects from text, tag and category similarity.
+
+Every published project becomes one feature vector made of three
+L2-normalised blocks: signed, hashed TF-IDF of its title, description and
+content; its tags, hashed and IDF-weighted; and a one-hot category. Each
+block is scaled by the square root of its weight, so the dot product of two
+vectors is the weighted sum of the three cosine similarities.
+
+``flask build-related`` finds every project's RELATED_PROJECTS_K nearest
+neighbours with blocked matrix products and stores them as RelatedProject
+rows, so the detail page reads its list with one primary-key lookup.
+Saving, unpublishing or deleting a project updates its own list and the
+lists it enters or leaves. That uses a per-worker copy of the feature
+matrix, rebuilt after RELATED_INDEX_TTL seconds; until then new words and
+tags weigh as much as a term seen once. Web requests leave that work, and
+full rebuilds after an import, to one background thread per worker: an
+update queued with queue_update() runs once the request's transaction
+commits.
+
+NumPy is a dependency, but imported on first use rather than when workers
+start. Without it nothing is precomputed, project pages fall back to other
+projects from the same category, and a warning is logged once per worker.
+"""
+import logging
+import math
+import re
+import threading
+import time
+import zlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app import db
+from models import Project, RelatedProject, project_tags
+from page_cache import page_cache
+
+# NumPy once available() has imported it; related lists are not precomputed without it
+np = None
+_numpy_checked = False
+
+TEXT_DIMENSIONS = 256
+TAG_DIMENSIONS = 64
+# Share of the similarity contributed by each block
+WEIGHTS = {'text': 0.5, 'tags': 0.35, 'category': 0.15}
+# Neighbours scoring below this are noise from hash collisions, not related
+MIN_SCORE = 0.05
+# Lists re-checked when a project changes: those of its most similar projects
+UPDATE_CANDIDATES = 500
+
+_TOKEN_RE = re.compile(r'[^\W\d_]{2,}')
+
+_projects = Project.__table__
+_related = RelatedProject.__table__
+
+_executor = None
+_executor_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+def available():
+    global np, _numpy_checked
+    if not _numpy_checked:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+            logger.warning('NumPy is not installed; related projects fall back to the same category')
+        np, _numpy_checked = numpy, True
+    return np is not None
+
+def _bucket(key, dimensions):
+    digest = zlib.crc32(key.encode())
+    return digest % dimensions, 1.0 if digest & 0x80000000 else -1.0
+
+def _documents(connection, ids=None):
+    """Yield (id, category_id, term counts, tag ids) for the published projects, in id order"""
+    statement = (db.select(_projects.c.id, _projects.c.category_id, _projects.c.title,
+                           _projects.c.description, _projects.c.content)
+                 .where(_projects.c.status == 'published').order_by(_projects.c.id))
+    tag_statement = (db.select(project_tags.c.project_id, project_tags.c.tag_id)
+                     .join(_projects, _projects.c.id == project_tags.c.project_id)
+                     .where(_projects.c.status == 'published'))
+    if ids is not None:
+        statement = statement.where(_projects.c.id.in_(ids))
+        tag_statement = tag_statement.where(project_tags.c.project_id.in_(ids))
+
+    tags = {}
+    for project_id, tag_id in connection.execute(tag_statement):
+        tags.setdefault(project_id, []).append(tag_id)
+    for row in connection.execute(statement).yield_per(1000):
+        text = ' '.join(filter(None, (row.title, row.description, row.content))).lower()
+        yield row.id, row.category_id, Counter(_TOKEN_RE.findall(text)), tags.get(row.id, [])
+
+class _Features:
+    """IDF tables and category columns fixed at build time, plus one matrix row per project.
+
+    Built in two passes over the projects, one for the document frequencies
+    and one for the vectors, so only the matrix is ever held in memory.
+    """
+
+    def __init__(self, connection):
+        term_df, tag_df, categories, self.ids = Counter(), Counter(), set(), []
+        for project_id, category_id, terms, tags in _documents(connection):
+            self.ids.append(project_id)
+            categories.add(category_id)
+            term_df.update(terms.keys())
+            tag_df.update(set(tags))
+        self._count = len(self.ids)
+        self.term_idf = {term: self._idf(df) for term, df in term_df.items()}
+        self.tag_idf = {tag_id: self._idf(df) for tag_id, df in tag_df.items()}
+        categories.discard(None)
+        self.categories = {category_id: column for column, category_id in enumerate(sorted(categories))}
+        self._term_columns = {}
+        self.positions = {project_id: position for position, project_id in enumerate(self.ids)}
+        # Projects published between the passes are skipped; ones removed keep a zero row,
+        # which never scores above MIN_SCORE
+        self.matrix = self._fill(np.zeros((self._count, self._width), dtype=np.float32),
+                                 ((self.positions.get(document[0]), document) for document in _documents(connection)))
+
+    def _idf(self, df):
+        return math.log((1 + self._count) / (1 + df)) + 1
+
+    def _term_column(self, term):
+        """(column, signed IDF) of ``term``; words unseen at build time weigh as much as a rare one"""
+        entry = self._term_columns.get(term)
+        if entry is None:
+            column, sign = _bucket(term, TEXT_DIMENSIONS)
+            entry = self._term_columns[term] = (column, sign * self.term_idf.get(term, self._idf(1)))
+        return entry
+
+    @property
+    def _width(self):
+        return TEXT_DIMENSIONS + TAG_DIMENSIONS + len(self.categories)
+
+    def vectors(self, documents):
+        """Feature rows for ``documents``, weighted with this build's IDF tables"""
+        documents = list(documents)
+        return self._fill(np.zeros((len(documents), self._width), dtype=np.float32), enumerate(documents))
+
+    def _fill(self, matrix, rows):
+        for row, document in rows:
+            if row is None:
+                continue
+            _, category_id, terms, tags = document
+            columns, values = [], []
+            for term, count in terms.items():
+                column, weight = self._term_column(term)
+                columns.append(column)
+                values.append(weight * (1 + math.log(count)) if count > 1 else weight)
+            for tag_id in tags:
+                column, sign = _bucket(str(tag_id), TAG_DIMENSIONS)
+                columns.append(TEXT_DIMENSIONS + column)
+                values.append(sign * self.tag_idf.get(tag_id, self._idf(1)))
+            if category_id in self.categories:
+                columns.append(TEXT_DIMENSIONS + TAG_DIMENSIONS + self.categories[category_id])
+                values.append(1.0)
+            # add.at, not assignment: hashed terms and tags can share a column
+            np.add.at(matrix[row], columns, values)
+
+        blocks = (('text', 0, TEXT_DIMENSIONS),
+                  ('tags', TEXT_DIMENSIONS, TEXT_DIMENSIONS + TAG_DIMENSIONS),
+                  ('category', TEXT_DIMENSIONS + TAG_DIMENSIONS, self._width))
+        for name, start, stop in blocks:
+            block = matrix[:, start:stop]
+            norms = np.linalg.norm(block, axis=1, keepdims=True)
+            np.divide(block, norms, out=block, where=norms > 0)
+            block *= math.sqrt(WEIGHTS[name])
+        return matrix
+
+    def put(self, project_id, vector):
+        position = self.positions.get(project_id)
+        if position is None:
+            self.positions[project_id] = len(self.ids)
+            self.ids.append(project_id)
+            self.matrix = np.vstack([self.matrix, vector])
+        else:
+            self.matrix[position] = vector
+
+    def remove(self, project_id):
+        position = self.positions.pop(project_id, None)
+        if position is None:
+            return
+        del self.ids[position]
+        self.matrix = np.delete(self.matrix, position, axis=0)
+        self.positions = {project_id: position for position, project_id in enumerate(self.ids)}
+
+    def neighbours(self, positions, k):
+        """Related rows (dicts for RelatedProject) for the projects at matrix ``positions``"""
+        positions = np.asarray(positions, dtype=np.intp)
+        k = min(k, len(self.ids) - 1)
+        if k <= 0 or not len(positions):
+            return []
+        similarities = self.matrix[positions] @ self.matrix.T
+        similarities[np.arange(len(positions)), positions] = -np.inf
+        top = np.argpartition(similarities, -k, axis=1)[:, -k:]
+        scores = np.take_along_axis(similarities, top, axis=1)
+        order = np.argsort(-scores, axis=1, kind='stable')
+        top = np.take_along_axis(top, order, axis=1)
+        scores = np.take_along_axis(scores, order, axis=1)
+
+        rows = []
+        for position, neighbour_positions, neighbour_scores in zip(positions.tolist(), top.tolist(), scores.tolist()):
+            ranked = [(neighbour, score) for neighbour, score in zip(neighbour_positions, neighbour_scores)
+                      if score >= MIN_SCORE]
+            rows.extend({'project_id': self.ids[position], 'rank': rank,
+                         'related_id': self.ids[neighbour], 'score': score}
+                        for rank, (neighbour, score) in enumerate(ranked))
+        return rows
+
+def _replace_lists(connection, features, project_ids, k):
+    """Recompute and store the lists of ``project_ids`` (ids no longer indexed are just cleared)"""
+    project_ids = list(project_ids)
+    for start in range(0, len(project_ids), 500):
+        chunk = project_ids[start:start + 500]
+        connection.execute(_related.delete().where(_related.c.project_id.in_(chunk)))
+        rows = features.neighbours([features.positions[project_id] for project_id in chunk
+                                    if project_id in features.positions], k)
+        if rows:
+            connection.execute(_related.insert(), rows)
+
+def rebuild(connection, block_size=256):
+    """Recompute every published project's related list; returns how many projects were indexed"""
+    features = _Features(connection)
+    k = current_app.config['RELATED_PROJECTS_K']
+    connection.execute(_related.delete())
+    for start in range(0, len(features.ids), block_size):
+        rows = features.neighbours(range(start, min(start + block_size, len(features.ids))), k)
+        if rows:
+            connection.execute(_related.insert(), rows)
+    related_index.replace(features)
+    return len(features.ids)
+
+def _get_executor():
+    # One thread per worker process: jobs rewrite the same rows, so they take turns
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='related-worker')
+        return _executor
+
+def _run_job(app, job, *args):
+    with app.app_context():
+        try:
+            job(*args)
+        except Exception:
+            db.session.rollback()
+            app.logger.exception('Related projects job %s failed', job.__name__)
+
+def _rebuild_and_commit():
+    rebuild(db.session.connection())
+    db.session.commit()
+    page_cache.clear()
+
+def submit_rebuild(app):
+    """Run ``rebuild`` on the background thread and commit it; returns the job's Future"""
+    return _get_executor().submit(_run_job, app, _rebuild_and_commit)
+
+def _update_and_commit(project_ids):
+    refreshed = set()
+    for project_id in sorted(project_ids):
+        refreshed |= related_index.update(project_id)
+    db.session.commit()
+    page_cache.invalidate(*(f'project:{project_id}' for project_id in refreshed))
+
+def queue_update(project_id):
+    """Update the related lists ``project_id`` affects on the background thread, once the session commits"""
+    if available():
+        db.session.info.setdefault('related_updates', set()).add(project_id)
+
+@event.listens_for(Session, 'after_commit')
+def _submit_queued_updates(session):
+    project_ids = session.info.pop('related_updates', None)
+    if project_ids:
+        _get_executor().submit(_run_job, current_app._get_current_object(), _update_and_commit, project_ids)
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_queued_updates(session):
+    session.info.pop('related_updates', None)
+
+class RelatedIndex:
+    """Per-worker feature matrix used to update related lists one project at a time"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._features = None
+        self._built_at = None
+
+    def _current(self, connection):
+        ttl = current_app.config.get('RELATED_INDEX_TTL', 600)
+        if self._features is None or time.monotonic() - self._built_at >= ttl:
+            self._features = _Features(connection)
+            self._built_at = time.monotonic()
+        return self._features
+
+    def replace(self, features):
+        with self._lock:
+            self._features = features
+            self._built_at = time.monotonic()
+
+    def invalidate(self):
+        with self._lock:
+            self._features = None
+
+    def update(self, project_id):
+        """Refresh related lists after ``project_id`` was saved, unpublished or deleted.
+
+        Writes in the session's transaction, which the caller commits. Returns
+        the ids of the projects whose list was rewritten.
+        """
+        if not available():
+            return set()
+        connection = db.session.connection()
+        k = current_app.config['RELATED_PROJECTS_K']
+        listed_in = set(connection.execute(
+            db.select(_related.c.project_id).where(_related.c.related_id == project_id)).scalars())
+        with self._lock:
+            features = self._current(connection)
+            documents = list(_documents(connection, [project_id]))
+            refresh = listed_in | {project_id}
+            if not documents:
+                if project_id in features.positions:
+                    # With ON DELETE CASCADE the lists it was in are already short; find them by similarity
+                    vector = features.matrix[features.positions[project_id]].copy()
+                    refresh |= self._displaced_by(connection, features, project_id, vector, k)
+                features.remove(project_id)
+            else:
+                vector = features.vectors(documents)[0]
+                features.put(project_id, vector)
+                refresh |= self._displaced_by(connection, features, project_id, vector, k)
+            _replace_lists(connection, features, refresh, k)
+        return refresh
+
+    @staticmethod
+    def _displaced_by(connection, features, project_id, vector, k):
+        """Projects among the closest matches of ``vector`` whose stored list it should enter, or that are short"""
+        similarities = features.matrix @ vector
+        similarities[features.positions[project_id]] = -np.inf
+        count = min(UPDATE_CANDIDATES, len(similarities))
+        closest = np.argpartition(similarities, -count)[-count:] if count else []
+        scores = {features.ids[position]: float(similarities[position]) for position in closest
+                  if similarities[position] >= MIN_SCORE}
+        if not scores:
+            return set()
+        stored = {row.project_id: (row.entries, row.lowest) for row in connection.execute(
+            db.select(_related.c.project_id, db.func.count().label('entries'), db.func.min(_related.c.score).label('lowest'))
+            .where(_related.c.project_id.in_(list(scores))).group_by(_related.c.project_id))}
+        return {candidate for candidate, score in scores.items()
+                if candidate not in stored or stored[candidate][0] < k or score > stored[candidate][1]}
+
+related_index = RelatedIndex()
+
+def related_projects(project, limit=3):
+    """Published projects most similar to ``project``, best first.
+
+    Reads the precomputed list; falls back to projects from the same
+    category while no list has been built for it.
+    """
+    query = Project.query.options(*Project.load_profile('card')).filter(Project.status == 'published')
+    related = (query.join(RelatedProject, RelatedProject.related_id == Project.id)
+               .filter(RelatedProject.project_id == project.id)
+               .order_by(RelatedProject.rank).limit(limit).all())
+    if related or project.category_id is None:
+        return related
+    available()  # logs the reason once when NumPy is missing
+    return query.filter(Project.id != project.id, Project.category_id == project.category_id).limit(limit).all()
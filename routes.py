@@ -1,42 +1,53 @@
-import os
+import io
 import secrets
 from datetime import datetime
-from flask import render_template, redirect, url_for, flash, request, jsonify, abort, send_from_directory
+from flask import (render_template, redirect, url_for, flash, request, jsonify, abort,
+                   Response, stream_with_context)
 from flask_login import login_user, logout_user, login_required, current_user
-from flask_mail import Message
+from markupsafe import Markup, escape
 from werkzeug.utils import secure_filename
-from PIL import Image
-from app import app, db, mail
-from models import User, Project, Category, Tag, Comment, Like, ProjectMedia, SiteSettings
+from sqlalchemy.orm import joinedload
+from app import app, db
+from database import primary_database
+from query_budget import query_budget
+from settings_cache import site_settings_cache
+from page_cache import page_cache, cached_page, cache_depends_on
+from image_processing import queue_picture
+from uploads import send_upload, upload_version
+from assets import asset_urls, send_asset
+from search import search_projects
+from pagination import decode_cursor, invalidate_counts, keyset_paginate, paginate
+from tag_index import tag_index, parse_tag_names, set_project_tags
+import project_io
+import related
+from related import related_projects
+import site_stats
+import static_export
+from likes import toggle_like as toggle_project_like
+import mail_outbox
+from mail_outbox import queue_mail
+from models import User, Project, Category, Comment, Like, ProjectMedia, SiteSettings, project_tags
 from forms import (LoginForm, RegisterForm, ForgotPasswordForm, ResetPasswordForm, 
                   ProfileForm, ProjectForm, CategoryForm, CommentForm, MediaUploadForm, SiteSettingsForm)
 
 # Utility functions
 def save_picture(form_picture, folder, size=(800, 600)):
-    """Save uploaded picture with resizing"""
-    random_hex = secrets.token_hex(8)
-    _, f_ext = os.path.splitext(form_picture.filename)
-    picture_fn = random_hex + f_ext
-    picture_path = os.path.join(app.root_path, 'static', folder, picture_fn)
-    
-    # Create directory if it doesn't exist
-    os.makedirs(os.path.dirname(picture_path), exist_ok=True)
-    
-    # Resize image
-    img = Image.open(form_picture)
-    img.thumbnail(size, Image.Resampling.LANCZOS)
-    img.save(picture_path)
-    
-    return picture_fn
+    """Save uploaded picture; resizing happens in the background image workers"""
+    return queue_picture(form_picture, folder, size)
 
 def get_site_settings():
-    """Get or create site settings"""
-    settings = SiteSettings.query.first()
-    if not settings:
-        settings = SiteSettings()
-        db.session.add(settings)
-        db.session.commit()
-    return settings
+    """Get or create site settings (served from the process-local cache)"""
+    return site_settings_cache.get()
+
+app.add_template_global(asset_urls)
+
+@app.template_filter('nl2br')
+def nl2br(value):
+    """Line breaks as <br> (markup passed through |safe stays unescaped)"""
+    return escape(value).replace('\n', Markup('<br>\n'))
+
+mail_outbox.init_app(app)
+static_export.init_app(app)
 
 @app.context_processor
 def inject_site_settings():
@@ -45,17 +56,41 @@ def inject_site_settings():
 
 # Main routes
 @app.route('/')
+@query_budget(6)
+@cached_page
 def index():
     """Home page with featured projects"""
-    featured_projects = Project.query.filter_by(status='published', featured=True).limit(3).all()
-    recent_projects = Project.query.filter_by(status='published').order_by(Project.created_at.desc()).limit(6).all()
+    card = Project.load_profile('card')
+    featured_projects = Project.query.options(*card).filter_by(status='published', featured=True).limit(3).all()
+    recent_projects = Project.query.options(*card).filter_by(status='published').order_by(Project.created_at.desc()).limit(6).all()
+    cache_depends_on('listing', projects=featured_projects + recent_projects)
     return render_template('index.html', featured_projects=featured_projects, recent_projects=recent_projects)
 
 @app.route('/about')
+@cached_page
 def about():
     """About page"""
     return render_template('portfolio/about.html')
 
+@app.route('/search')
+@query_budget(4)
+def search():
+    """Live search over published projects (JSON; title/description are HTML with <mark> highlights)"""
+    query = request.args.get('q', '').strip()
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+    results = search_projects(query, limit=limit) if len(query) >= 2 else []
+    
+    return jsonify({
+        'query': query,
+        'results': [{
+            'id': result['id'],
+            'type': 'Projeto',
+            'url': url_for('project_detail', id=result['id']),
+            'title': result['title'],
+            'description': result['snippet'],
+        } for result in results]
+    })
+
 # Authentication routes
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -112,27 +147,22 @@ def forgot_password():
         user = User.query.filter_by(email=form.email.data).first()
         if user:
             token = user.generate_reset_token()
-            db.session.commit()
             
-            # Send reset email
+            # Queue the reset email; the outbox sender delivers it after this commit
             if app.config.get('MAIL_USERNAME'):
-                msg = Message(
+                queue_mail(
                     'Password Reset Request',
-                    recipients=[user.email]
-                )
-                msg.body = f'''To reset your password, visit the following link:
+                    recipients=[user.email],
+                    body=f'''To reset your password, visit the following link:
 {url_for('reset_password', token=token, _external=True)}
 
 If you did not make this request, please ignore this email.
 '''
-                try:
-                    mail.send(msg)
-                    flash('A password reset link has been sent to your email.', 'info')
-                except Exception as e:
-                    flash('Failed to send email. Please try again later.', 'danger')
-                    app.logger.error(f'Mail sending failed: {e}')
+                )
+                flash('A password reset link has been sent to your email.', 'info')
             else:
                 flash('Email service not configured. Please contact administrator.', 'warning')
+            db.session.commit()
         else:
             flash('A password reset link has been sent to your email.', 'info')  # Same message for security
         
@@ -141,6 +171,7 @@ If you did not make this request, please ignore this email.
     return render_template('auth/forgot_password.html', form=form)
 
 @app.route('/reset-password/<token>', methods=['GET', 'POST'])
+@primary_database  # the link may be opened on another device before the token reaches the replica
 def reset_password(token):
     if current_user.is_authenticated:
         return redirect(url_for('index'))
@@ -164,16 +195,18 @@ def reset_password(token):
 @app.route('/profile/edit', methods=['GET', 'POST'])
 @login_required
 def edit_profile():
-    form = ProfileForm(obj=current_user)
+    # current_user is a shared, partially loaded copy from the user cache; edit the real row
+    user = db.session.get(User, current_user.id)
+    form = ProfileForm(obj=user)
     
     if form.validate_on_submit():
-        current_user.first_name = form.first_name.data
-        current_user.last_name = form.last_name.data
-        current_user.bio = form.bio.data
+        user.first_name = form.first_name.data
+        user.last_name = form.last_name.data
+        user.bio = form.bio.data
         
         if form.profile_image.data:
             picture_file = save_picture(form.profile_image.data, 'uploads/profiles', (300, 300))
-            current_user.profile_image = picture_file
+            user.profile_image = picture_file
         
         db.session.commit()
         flash('Profile updated successfully!', 'success')
@@ -183,57 +216,81 @@ def edit_profile():
 
 # Portfolio routes
 @app.route('/projects')
+@query_budget(8)
+@cached_page
 def projects():
-    page = request.args.get('page', 1, type=int)
     category_id = request.args.get('category', type=int)
     tag_name = request.args.get('tag')
     
-    query = Project.query.filter_by(status='published')
+    query = Project.query.options(*Project.load_profile('card')).filter_by(status='published')
     
     if category_id:
         query = query.filter_by(category_id=category_id)
     
-    if tag_name:
-        tag = Tag.query.filter_by(name=tag_name).first()
-        if tag:
-            query = query.filter(Project.tags.contains(tag))
+    tag_id = tag_index.id_for(tag_name) if tag_name else None
+    if tag_id:
+        query = query.filter(Project.id.in_(
+            db.select(project_tags.c.project_id).where(project_tags.c.tag_id == tag_id)))
     
-    projects = query.order_by(Project.created_at.desc()).paginate(
-        page=page, per_page=9, error_out=False
-    )
+    # An unknown tag lists everything, so it shares the unfiltered total
+    projects = paginate(query, Project, per_page=9, count_key=('projects', category_id, tag_id))
+    filters = {key: value for key, value in (('category', category_id), ('tag', tag_name)) if value}
     
     categories = Category.query.all()
-    tags = Tag.query.all()
+    tags = tag_index.popular()
+    cache_depends_on('listing', projects=projects.items)
     
     return render_template('portfolio/projects.html', 
-                         projects=projects, categories=categories, tags=tags)
+                         projects=projects, categories=categories, tags=tags, filters=filters)
 
 @app.route('/project/<int:id>')
+@query_budget(9)
+@cached_page
 def project_detail(id):
-    project = Project.query.filter_by(id=id, status='published').first_or_404()
+    project = Project.query.options(*Project.load_profile('detail')).filter_by(id=id, status='published').first_or_404()
     
-    # Get comments
-    comments = Comment.query.filter_by(project_id=id).order_by(Comment.created_at.desc()).all()
+    # First page of comments; the rest is fetched from project_comments as the reader scrolls
+    comments = keyset_paginate(_comment_query(id), Comment, app.config['COMMENTS_PER_PAGE'])
     
     # Comment form for authenticated users
     comment_form = CommentForm() if current_user.is_authenticated else None
     
-    # Related projects
-    related_projects = Project.query.filter(
-        Project.id != id,
-        Project.status == 'published',
-        Project.category_id == project.category_id
-    ).limit(3).all()
+    # Related projects, precomputed by content similarity
+    related_list = related_projects(project)
+    # related:<id> lets the static export notice a changed list; the page cache is invalidated per project
+    cache_depends_on(f'category:{project.category_id}', f'related:{project.id}', projects=[project] + related_list)
     
     return render_template('portfolio/project_detail.html', 
                          project=project, comments=comments, 
-                         comment_form=comment_form, related_projects=related_projects)
+                         comment_form=comment_form, related_projects=related_list)
+
+def _comment_query(project_id):
+    return Comment.query.options(joinedload(Comment.author)).filter_by(project_id=project_id)
+
+@app.route('/project/<int:id>/comments')
+@query_budget(4)
+@cached_page
+def project_comments(id):
+    """Next page of a project's comments as an HTML fragment plus the URL of the page after it"""
+    Project.query.with_entities(Project.id).filter_by(id=id, status='published').first_or_404()
+    after = request.args.get('after')
+    if after and decode_cursor(after) is None:
+        abort(400)
+    comments = keyset_paginate(_comment_query(id), Comment, app.config['COMMENTS_PER_PAGE'], after=after)
+    cache_depends_on(f'project:{id}')
+    
+    return jsonify({
+        'html': ''.join(render_template('components/comment.html', comment=comment) for comment in comments.items),
+        'next_url': url_for('project_comments', id=id, after=comments.next_cursor) if comments.has_next else None
+    })
 
 @app.route('/project/<int:id>/comment', methods=['POST'])
 @login_required
 def add_comment(id):
     project = Project.query.filter_by(id=id, status='published').first_or_404()
     form = CommentForm()
+    # modern.js posts the form with fetch and inserts the returned fragment
+    wants_json = request.accept_mimetypes.best == 'application/json'
     
     if form.validate_on_submit():
         comment = Comment(
@@ -243,69 +300,67 @@ def add_comment(id):
         )
         db.session.add(comment)
         db.session.commit()
+        page_cache.invalidate(f'project:{project.id}')
+        if wants_json:
+            return jsonify({
+                'success': True,
+                'html': render_template('components/comment.html', comment=comment),
+                'comment_count': project.comment_count
+            })
         flash('Comment added successfully!', 'success')
+    elif wants_json:
+        errors = [error for field_errors in form.errors.values() for error in field_errors]
+        return jsonify({'success': False, 'message': ' '.join(errors) or 'Could not add the comment.'}), 400
     
     return redirect(url_for('project_detail', id=id))
 
 @app.route('/project/<int:id>/like', methods=['POST'])
 @login_required
 def toggle_like(id):
-    project = Project.query.filter_by(id=id, status='published').first_or_404()
-    
-    like = Like.query.filter_by(user_id=current_user.id, project_id=project.id).first()
-    
-    if like:
-        db.session.delete(like)
-        liked = False
-    else:
-        like = Like(user_id=current_user.id, project_id=project.id)
-        db.session.add(like)
-        liked = True
-    
-    db.session.commit()
+    result = toggle_project_like(current_user.id, id)
+    if result is None:
+        abort(404)
+    liked, like_count = result
+    page_cache.invalidate(f'project:{id}')
     
     return jsonify({
+        'success': True,
         'liked': liked,
-        'like_count': project.like_count
+        'like_count': like_count
     })
 
 # Admin routes
 @app.route('/admin')
 @login_required
+@query_budget(6)
 def admin_dashboard():
     if not current_user.is_admin:
         abort(403)
     
-    # Dashboard stats
-    total_projects = Project.query.count()
-    published_projects = Project.query.filter_by(status='published').count()
-    draft_projects = Project.query.filter_by(status='draft').count()
-    total_comments = Comment.query.count()
-    total_likes = Like.query.count()
+    # Totals and the 30-day trend come from the incrementally maintained daily rollups
+    stats = site_stats.totals()
+    trend = site_stats.trend(30)
     
     # Recent activity
-    recent_comments = Comment.query.order_by(Comment.created_at.desc()).limit(5).all()
+    recent_comments = (Comment.query.options(joinedload(Comment.author), joinedload(Comment.project))
+                       .order_by(Comment.created_at.desc()).limit(5).all())
     recent_projects = Project.query.order_by(Project.created_at.desc()).limit(5).all()
     
     return render_template('admin/dashboard.html',
-                         total_projects=total_projects,
-                         published_projects=published_projects,
-                         draft_projects=draft_projects,
-                         total_comments=total_comments,
-                         total_likes=total_likes,
+                         stats=stats,
+                         trend=trend,
                          recent_comments=recent_comments,
                          recent_projects=recent_projects)
 
 @app.route('/admin/projects')
 @login_required
+@query_budget(5)
 def admin_projects():
     if not current_user.is_admin:
         abort(403)
     
-    page = request.args.get('page', 1, type=int)
-    projects = Project.query.order_by(Project.created_at.desc()).paginate(
-        page=page, per_page=10, error_out=False
-    )
+    query = Project.query.options(*Project.load_profile('admin_row'))
+    projects = paginate(query, Project, per_page=10, count_key=('admin_projects',))
     
     return render_template('admin/projects.html', projects=projects)
 
@@ -338,16 +393,13 @@ def admin_new_project():
         db.session.flush()  # Get the project ID
         
         # Handle tags
-        if form.tags.data:
-            tag_names = [name.strip() for name in form.tags.data.split(',') if name.strip()]
-            for tag_name in tag_names:
-                tag = Tag.query.filter_by(name=tag_name).first()
-                if not tag:
-                    tag = Tag(name=tag_name)
-                    db.session.add(tag)
-                project.tags.append(tag)
+        set_project_tags(project, parse_tag_names(form.tags.data))
+        related.queue_update(project.id)
         
         db.session.commit()
+        tag_index.invalidate()
+        invalidate_counts()
+        page_cache.invalidate('listing', f'category:{project.category_id}')
         flash('Project created successfully!', 'success')
         return redirect(url_for('admin_projects'))
     
@@ -366,6 +418,7 @@ def admin_edit_project(id):
         form.tags.data = ', '.join([tag.name for tag in project.tags])
     
     if form.validate_on_submit():
+        previous_category_id = project.category_id
         project.title = form.title.data
         project.description = form.description.data
         project.content = form.content.data
@@ -382,17 +435,14 @@ def admin_edit_project(id):
             project.featured_image = picture_file
         
         # Handle tags
-        project.tags.clear()
-        if form.tags.data:
-            tag_names = [name.strip() for name in form.tags.data.split(',') if name.strip()]
-            for tag_name in tag_names:
-                tag = Tag.query.filter_by(name=tag_name).first()
-                if not tag:
-                    tag = Tag(name=tag_name)
-                    db.session.add(tag)
-                project.tags.append(tag)
+        set_project_tags(project, parse_tag_names(form.tags.data))
+        related.queue_update(project.id)
         
         db.session.commit()
+        tag_index.invalidate()
+        invalidate_counts()
+        page_cache.invalidate('listing', f'project:{project.id}',
+                              f'category:{previous_category_id}', f'category:{project.category_id}')
         flash('Project updated successfully!', 'success')
         return redirect(url_for('admin_projects'))
     
@@ -405,15 +455,74 @@ def admin_delete_project(id):
         abort(403)
     
     project = Project.query.get_or_404(id)
+    category_id = project.category_id
     db.session.delete(project)
+    related.queue_update(id)
     db.session.commit()
+    tag_index.invalidate()
+    invalidate_counts()
+    page_cache.invalidate('listing', f'project:{id}', f'category:{category_id}')
     flash('Project deleted successfully!', 'success')
     return redirect(url_for('admin_projects'))
 
+@app.route('/admin/projects/export')
+@login_required
+def admin_export_projects():
+    if not current_user.is_admin:
+        abort(403)
+    
+    filename = f"portfolio-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}.jsonl"
+    return Response(stream_with_context(project_io.export_lines()), mimetype='application/x-ndjson',
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+@app.route('/admin/projects/import', methods=['POST'])
+@login_required
+def admin_import_projects():
+    if not current_user.is_admin:
+        abort(403)
+    
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        flash('Choose a JSONL file to import.', 'danger')
+        return redirect(url_for('admin_projects'))
+    
+    # Reusing a job name resumes an interrupted import of the same file
+    job = request.form.get('job') or f"upload:{secure_filename(upload.filename)}:{datetime.utcnow().strftime('%Y%m%d%H%M%S')}:{secrets.token_hex(2)}"
+    try:
+        result = project_io.import_lines(io.TextIOWrapper(upload.stream, encoding='utf-8'), job)
+    except (project_io.ImportFormatError, UnicodeDecodeError) as e:
+        flash(f'Import stopped at {e}. Fix the file and import it again with job "{job}" to resume.', 'danger')
+        return redirect(url_for('admin_projects'))
+    finally:
+        tag_index.invalidate()
+        invalidate_counts()
+        page_cache.clear()
+    
+    # Only a finished import rebuilds (a failed one does once it is resumed), off the request thread;
+    # until then new projects show same-category projects
+    if related.available():
+        related.submit_rebuild(app)
+    
+    flash(f'Imported {result.projects} projects, {result.media} media references, '
+          f'{result.categories} new categories and {result.tags} new tags.', 'success')
+    return redirect(url_for('admin_projects'))
+
 # File serving
 @app.route('/uploads/<path:filename>')
 def uploaded_file(filename):
-    return send_from_directory(os.path.join(app.root_path, 'static', 'uploads'), filename)
+    return send_upload(filename)
+
+@app.route('/assets/<path:filename>')
+def asset(filename):
+    return send_asset(filename)
+
+@app.url_defaults
+def add_upload_version(endpoint, values):
+    """Append the content hash to upload URLs so they can be cached forever"""
+    if endpoint == 'uploaded_file' and 'v' not in values:
+        version = upload_version(values['filename'])
+        if version:
+            values['v'] = version
 
 # Error handlers
 @app.errorhandler(403)
@@ -0,0 +1,197 @@
+"""Full-text search over published projects.
+
+SQLite databases get an FTS5 table (``project_search``) and PostgreSQL a
+``tsvector`` table with a GIN index. Each row holds a project's title,
+description, content, tag names and category name. Session events reindex
+affected projects inside the same transaction as the write, so the index
+can never disagree with committed data. Other dialects fall back to a LIKE
+scan.
+"""
+import re
+from flask import current_app
+from markupsafe import escape
+from sqlalchemy import bindparam, event, text
+from sqlalchemy.orm import Session
+from app import db
+from models import Category, Project
+
+# Sentinels wrapped around matches by the database, turned into <mark> after escaping
+_MARK_START, _MARK_END = '\x02', '\x03'
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+_SQLITE_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS project_search USING fts5("
+    "title, description, content, tags, category, "
+    "tokenize = 'unicode61 remove_diacritics 2')",
+)
+
+_POSTGRES_DDL = (
+    "CREATE TABLE IF NOT EXISTS project_search ("
+    "project_id INTEGER PRIMARY KEY REFERENCES project (id) ON DELETE CASCADE, "
+    "title TEXT NOT NULL, "
+    "document TSVECTOR NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS ix_project_search_document ON project_search USING GIN (document)",
+)
+
+# Columns shared by both backends' indexing queries
+_DOCUMENT_SOURCE = """
+    FROM project p
+    LEFT JOIN category c ON c.id = p.category_id
+    LEFT JOIN (
+        SELECT pt.project_id, {tag_agg} AS names
+        FROM project_tags pt JOIN tag t ON t.id = pt.tag_id
+        {tag_filter}
+        GROUP BY pt.project_id
+    ) tags ON tags.project_id = p.id
+    WHERE p.status = 'published' {filter}
+"""
+
+def _dialect(connection):
+    return connection.dialect.name
+
+def create_index(connection=None):
+    """Create the search table if it does not exist, on ``connection`` or committed via the session"""
+    use_session = connection is None
+    if use_session:
+        connection = db.session.connection()
+    ddl = {'sqlite': _SQLITE_DDL, 'postgresql': _POSTGRES_DDL}.get(_dialect(connection), ())
+    for statement in ddl:
+        connection.execute(text(statement))
+    if use_session:
+        db.session.commit()
+
+def _index_statements(dialect, all_projects):
+    id_filter = '' if all_projects else 'AND p.id IN :ids'
+    # Filter the tag aggregate too, or every partial reindex aggregates all of project_tags
+    tag_filter = '' if all_projects else 'WHERE pt.project_id IN :ids'
+    if dialect == 'sqlite':
+        delete = "DELETE FROM project_search" + ('' if all_projects else " WHERE rowid IN :ids")
+        insert = (
+            "INSERT INTO project_search (rowid, title, description, content, tags, category) "
+            "SELECT p.id, p.title, p.description, coalesce(p.content, ''), coalesce(tags.names, ''), coalesce(c.name, '')"
+            + _DOCUMENT_SOURCE.format(tag_agg="group_concat(t.name, ' ')", filter=id_filter, tag_filter=tag_filter)
+        )
+    else:
+        delete = "DELETE FROM project_search" + ('' if all_projects else " WHERE project_id IN :ids")
+        insert = (
+            "INSERT INTO project_search (project_id, title, document) "
+            "SELECT p.id, p.title, "
+            "setweight(to_tsvector(CAST(:config AS regconfig), p.title), 'A') || "
+            "setweight(to_tsvector(CAST(:config AS regconfig), coalesce(tags.names, '')), 'B') || "
+            "setweight(to_tsvector(CAST(:config AS regconfig), coalesce(c.name, '')), 'B') || "
+            "setweight(to_tsvector(CAST(:config AS regconfig), p.description), 'C') || "
+            "setweight(to_tsvector(CAST(:config AS regconfig), coalesce(p.content, '')), 'D')"
+            + _DOCUMENT_SOURCE.format(tag_agg="string_agg(t.name, ' ')", filter=id_filter, tag_filter=tag_filter)
+        )
+    statements = [text(delete), text(insert)]
+    if not all_projects:
+        statements = [s.bindparams(bindparam('ids', expanding=True)) for s in statements]
+    return statements
+
+def reindex(session, project_ids=None):
+    """Rebuild index rows for ``project_ids`` (or every project) in the session's transaction"""
+    connection = session.connection()
+    dialect = _dialect(connection)
+    if dialect not in ('sqlite', 'postgresql'):
+        return
+    params = {}
+    if dialect == 'postgresql':
+        params['config'] = _search_config()
+    if project_ids is not None:
+        if not project_ids:
+            return
+        params['ids'] = sorted(project_ids)
+    for statement in _index_statements(dialect, project_ids is None):
+        connection.execute(statement, params)
+
+def _search_config():
+    return current_app.config.get('SEARCH_LANGUAGE', 'simple')
+
+@event.listens_for(Session, 'after_flush')
+def _collect_search_changes(session, flush_context):
+    pending = session.info.setdefault('search_reindex', {'projects': set(), 'categories': set()})
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Project) and obj.id is not None:
+            pending['projects'].add(obj.id)
+        elif isinstance(obj, Category) and obj.id is not None and obj not in session.new:
+            pending['categories'].add(obj.id)
+
+@event.listens_for(Session, 'before_commit')
+def _apply_search_changes(session):
+    # Commit only flushes after this hook, so flush now to see every pending change
+    session.flush()
+    if 'search_reindex' not in session.info:
+        return
+    pending = session.info.pop('search_reindex')
+    project_ids = set(pending['projects'])
+    if pending['categories']:
+        rows = session.execute(db.select(Project.id).where(Project.category_id.in_(pending['categories'])))
+        project_ids.update(row.id for row in rows)
+    reindex(session, project_ids)
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_search_changes(session):
+    session.info.pop('search_reindex', None)
+
+def _query_tokens(query):
+    return _TOKEN_RE.findall(query.lower())[:8]
+
+def _to_html(value):
+    """Escape highlighted text from the database and turn the sentinels into <mark>"""
+    return str(escape(value or '')).replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>')
+
+def search_projects(query, limit=10):
+    """Ranked matches as dicts with id, title (HTML) and snippet (HTML)"""
+    tokens = _query_tokens(query)
+    if not tokens:
+        return []
+    connection = db.session.connection()
+    dialect = _dialect(connection)
+    
+    if dialect == 'sqlite':
+        # Every token must match, the last one as a prefix for search-as-you-type
+        match = (' '.join(f'"{token}"' for token in tokens[:-1]) + f' "{tokens[-1]}"*').strip()
+        # bm25 has to score every match, so broad queries only rank the newest
+        # SEARCH_RANK_CANDIDATES matches; FTS5 walks rowids in order, which is cheap
+        floor = connection.execute(text(
+            "SELECT min(rowid) FROM (SELECT rowid FROM project_search WHERE project_search MATCH :match "
+            "ORDER BY rowid DESC LIMIT :candidates)"
+        ), {'match': match, 'candidates': current_app.config.get('SEARCH_RANK_CANDIDATES', 1000)}).scalar()
+        if floor is None:
+            return []
+        rows = connection.execute(text(
+            "SELECT rowid AS id, "
+            "highlight(project_search, 0, :start, :end) AS title, "
+            "snippet(project_search, -1, :start, :end, '…', 16) AS snippet "
+            "FROM project_search WHERE project_search MATCH :match AND rowid >= :floor "
+            "ORDER BY bm25(project_search, 10.0, 2.0, 1.0, 5.0, 3.0) LIMIT :limit"
+        ), {'start': _MARK_START, 'end': _MARK_END, 'match': match, 'floor': floor, 'limit': limit})
+    elif dialect == 'postgresql':
+        tsquery = ' & '.join(tokens[:-1] + [tokens[-1] + ':*'])
+        rows = connection.execute(text(
+            "WITH q AS (SELECT to_tsquery(CAST(:config AS regconfig), :tsquery) AS query), "
+            "ranked AS ("
+            "  SELECT s.project_id, s.title, ts_rank_cd(s.document, q.query) AS rank "
+            "  FROM project_search s, q WHERE s.document @@ q.query "
+            "  ORDER BY rank DESC LIMIT :limit"
+            ") "
+            "SELECT r.project_id AS id, "
+            "ts_headline(CAST(:config AS regconfig), r.title, q.query, :title_options) AS title, "
+            "ts_headline(CAST(:config AS regconfig), p.description || ' ' || coalesce(p.content, ''), q.query, :options) AS snippet "
+            "FROM ranked r JOIN project p ON p.id = r.project_id, q ORDER BY r.rank DESC"
+        ), {
+            'config': _search_config(), 'tsquery': tsquery, 'limit': limit,
+            'title_options': f'StartSel={_MARK_START}, StopSel={_MARK_END}, HighlightAll=true',
+            'options': f'StartSel={_MARK_START}, StopSel={_MARK_END}, MaxWords=30, MinWords=12',
+        })
+    else:
+        pattern = f'%{tokens[0]}%'
+        rows = db.session.execute(
+            db.select(Project.id, Project.title, Project.description.label('snippet'))
+            .where(Project.status == 'published')
+            .where(db.or_(Project.title.ilike(pattern), Project.description.ilike(pattern)))
+            .order_by(Project.created_at.desc()).limit(limit)
+        )
+    
+    return [{'id': row.id, 'title': _to_html(row.title), 'snippet': _to_html(row.snippet)} for row in rows]
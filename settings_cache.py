@@ -0,0 +1,75 @@
+"""Process-local cache for the SiteSettings row"""
+import threading
+import time
+from flask import current_app
+from app import db
+from models import SiteSettings
+
+class SiteSettingsCache:
+    """Keeps a detached SiteSettings instance in memory.
+    
+    Every worker re-checks the row's (id, updated_at) pair at most once per
+    SITE_SETTINGS_TTL seconds, so an update committed by any worker is picked
+    up everywhere within that bound while most requests run no query at all.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._settings = None
+        self._version = None
+        self._checked_at = 0.0
+    
+    @property
+    def version(self):
+        """Opaque token that changes whenever the settings row changes"""
+        self.get()
+        return self._version
+    
+    def get(self):
+        ttl = current_app.config.get('SITE_SETTINGS_TTL', 5)
+        if self._settings is not None and time.monotonic() - self._checked_at < ttl:
+            return self._settings
+        
+        with self._lock:
+            now = time.monotonic()
+            if self._settings is not None and now - self._checked_at < ttl:
+                return self._settings
+            
+            if self._settings is None or self._current_version() != self._version:
+                self._settings = self._load()
+                self._version = self._version_of(self._settings)
+            self._checked_at = now
+            return self._settings
+    
+    def invalidate(self):
+        """Drop the cached row; call after committing a change to SiteSettings"""
+        with self._lock:
+            self._settings = None
+            self._version = None
+    
+    @staticmethod
+    def _version_of(settings):
+        return f'{settings.id}:{settings.updated_at.isoformat() if settings.updated_at else ""}'
+    
+    def _current_version(self):
+        row = db.session.execute(
+            db.select(SiteSettings.id, SiteSettings.updated_at).order_by(SiteSettings.id).limit(1)
+        ).first()
+        if row is None:
+            return None
+        return f'{row.id}:{row.updated_at.isoformat() if row.updated_at else ""}'
+    
+    @staticmethod
+    def _load():
+        settings = SiteSettings.query.order_by(SiteSettings.id).first()
+        if not settings:
+            # Insert on a separate connection so the request session is not committed
+            # (and its loaded objects expired) halfway through rendering
+            with db.engine.begin() as connection:
+                connection.execute(db.insert(SiteSettings))
+            settings = SiteSettings.query.order_by(SiteSettings.id).first()
+        # Detach so the instance outlives the request session that loaded it
+        db.session.expunge(settings)
+        return settings
+
+site_settings_cache = SiteSettingsCache()
@@ -0,0 +1,132 @@
+"""Incrementally maintained site statistics for the admin dashboard.
+
+Every project, like and comment is counted in the DailyStats row of the
+day it was created: +1 when it is written, -1 when it is deleted, and a
+project's ``published`` count follows its status. Totals are the sum of
+those rows. A trend is a slice of them, so the dashboard never counts the
+raw tables. ORM writes are tracked by the mapper events below. Modules that
+write with Core statements (likes, project_io) call bump() themselves.
+``flask recount`` rebuilds the table from scratch.
+"""
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from sqlalchemy import event
+from app import db
+from database import dialect_insert
+from models import Comment, DailyStats, Like, Project
+
+COUNTERS = ('projects', 'published', 'likes', 'comments')
+
+SiteTotals = namedtuple('SiteTotals', 'total_projects published_projects draft_projects total_likes total_comments')
+
+_stats = DailyStats.__table__
+
+def day_of(created_at):
+    """The rollup day for a row created at ``created_at`` (today when unknown)"""
+    if created_at is None:
+        return datetime.utcnow().date()
+    return created_at.date() if isinstance(created_at, datetime) else created_at
+
+def bump(connection, deltas):
+    """Add ``deltas`` ({day: {counter: delta}}) to the rollup rows, creating missing days"""
+    rows = [{'day': day, **{name: counters.get(name, 0) for name in COUNTERS}}
+            for day, counters in sorted(deltas.items()) if any(counters.values())]
+    if not rows:
+        return
+    insert = dialect_insert(connection, _stats)
+    connection.execute(
+        insert.on_conflict_do_update(
+            index_elements=['day'],
+            set_={name: _stats.c[name] + insert.excluded[name] for name in COUNTERS},
+        ),
+        rows,
+    )
+
+def add(deltas, created_at, **counters):
+    """Accumulate ``counters`` for the day of ``created_at`` into a deltas dict for bump()"""
+    day = deltas.setdefault(day_of(created_at), {})
+    for name, delta in counters.items():
+        day[name] = day.get(name, 0) + delta
+    return deltas
+
+def totals():
+    """Site-wide counts from a single aggregate over the rollup rows"""
+    row = db.session.execute(
+        db.select(*(db.func.coalesce(db.func.sum(_stats.c[name]), 0) for name in COUNTERS))
+    ).one()
+    projects, published, likes, comments = (int(value) for value in row)
+    return SiteTotals(projects, published, projects - published, likes, comments)
+
+_TrendDay = namedtuple('_TrendDay', ('day',) + COUNTERS)
+
+def trend(days=30):
+    """Rollup rows for each of the last ``days`` days, oldest first, with empty days as zeros"""
+    today = datetime.utcnow().date()
+    first = today - timedelta(days=days - 1)
+    stored = {row.day: row for row in db.session.execute(
+        db.select(_stats).where(_stats.c.day >= first).order_by(_stats.c.day))}
+    return [stored.get(day) or _TrendDay(day, *(0 for _ in COUNTERS))
+            for day in (first + timedelta(days=offset) for offset in range(days))]
+
+def _day_column(column, dialect):
+    if dialect.name == 'sqlite':
+        return db.func.date(column)
+    return db.cast(column, db.Date)
+
+def rebuild(connection):
+    """Recompute every rollup row from the raw tables; returns the number of days"""
+    deltas = {}
+    sources = (
+        (Project.__table__, {'projects': db.func.count(),
+                             'published': db.func.sum(db.case((Project.__table__.c.status == 'published', 1), else_=0))}),
+        (Like.__table__, {'likes': db.func.count()}),
+        (Comment.__table__, {'comments': db.func.count()}),
+    )
+    for table, aggregates in sources:
+        day = _day_column(table.c.created_at, connection.dialect).label('day')
+        labels = list(aggregates)
+        for row in connection.execute(
+                db.select(day, *(aggregates[name].label(name) for name in labels)).group_by(day)):
+            value = row.day
+            if isinstance(value, str):
+                value = date.fromisoformat(value)
+            add(deltas, value, **{name: int(row._mapping[name] or 0) for name in labels})
+    connection.execute(_stats.delete())
+    bump(connection, deltas)
+    return len(deltas)
+
+# ORM writes. Deletions are counted before the DELETE so created_at can still be loaded.
+
+@event.listens_for(Project, 'after_insert')
+def _project_inserted(mapper, connection, target):
+    bump(connection, add({}, target.created_at, projects=1, published=int(target.status == 'published')))
+
+@event.listens_for(Project, 'after_update')
+def _project_updated(mapper, connection, target):
+    history = db.inspect(target).attrs.status.history
+    if not history.has_changes():
+        return
+    was_published = 'published' in history.deleted
+    delta = int(target.status == 'published') - int(was_published)
+    if delta:
+        bump(connection, add({}, target.created_at, published=delta))
+
+@event.listens_for(Project, 'before_delete')
+def _project_deleted(mapper, connection, target):
+    bump(connection, add({}, target.created_at, projects=-1, published=-int(target.status == 'published')))
+
+@event.listens_for(Like, 'after_insert')
+def _like_inserted(mapper, connection, target):
+    bump(connection, add({}, target.created_at, likes=1))
+
+@event.listens_for(Like, 'before_delete')
+def _like_deleted(mapper, connection, target):
+    bump(connection, add({}, target.created_at, likes=-1))
+
+@event.listens_for(Comment, 'after_insert')
+def _comment_inserted(mapper, connection, target):
+    bump(connection, add({}, target.created_at, comments=1))
+
+@event.listens_for(Comment, 'before_delete')
+def _comment_deleted(mapper, connection, target):
+    bump(connection, add({}, target.created_at, comments=-1))
@@ -97,7 +97,7 @@ function initLikeButtons() {
             }
             
             // Send AJAX request
-            fetch(`/toggle_like/${projectId}`, {
+            fetch(`/project/${projectId}/like`, {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
@@ -183,7 +183,7 @@ function initCommentForms() {
             
             const formData = new FormData(this);
             const submitBtn = this.querySelector('button[type="submit"]');
-            const originalText = submitBtn.textContent;
+            const originalHtml = submitBtn.innerHTML;
             const textarea = this.querySelector('textarea');
             
             // Validation
@@ -200,14 +200,14 @@ function initCommentForms() {
                 method: 'POST',
                 body: formData,
                 headers: {
-                    'X-CSRFToken': getCSRFToken()
+                    'Accept': 'application/json'
                 }
             })
             .then(response => response.json())
             .then(data => {
                 if (data.success) {
                     // Add new comment to the list
-                    addCommentToList(data.comment);
+                    addCommentToList(data.html, data.comment_count);
                     
                     // Clear form
                     this.reset();
@@ -224,7 +224,7 @@ function initCommentForms() {
             })
             .finally(() => {
                 submitBtn.disabled = false;
-                submitBtn.textContent = originalText;
+                submitBtn.innerHTML = originalHtml;
             });
         });
         
@@ -237,32 +237,86 @@ function initCommentForms() {
             });
         }
     });
+    
+    initCommentScroll();
 }
 
-function addCommentToList(comment) {
+function addCommentToList(html, commentCount) {
     const commentsList = document.getElementById('comments-list');
     if (commentsList) {
-        const commentHtml = `
-            <div class="comment-item animate-on-scroll">
-                <div class="d-flex">
-                    <img src="${comment.user.profile_image || '/static/img/default-avatar.svg'}" 
-                         alt="${comment.user.name}" class="profile-image-sm rounded-circle me-3">
-                    <div class="flex-grow-1">
-                        <div class="comment-author">${comment.user.name}</div>
-                        <div class="comment-date">${comment.created_at}</div>
-                        <div class="comment-content">${comment.content}</div>
-                    </div>
-                </div>
-            </div>
-        `;
-        
-        commentsList.insertAdjacentHTML('afterbegin', commentHtml);
+        // The server renders the fragment with the same template as the page, escaped
+        commentsList.insertAdjacentHTML('afterbegin', html);
         
         // Animate new comment
         const newComment = commentsList.firstElementChild;
         setTimeout(() => {
             newComment.classList.add('fade-in');
         }, 100);
+        
+        const emptyState = document.getElementById('comments-empty');
+        if (emptyState) {
+            emptyState.classList.add('d-none');
+        }
+    }
+    
+    if (commentCount !== undefined) {
+        document.querySelectorAll('.comment-count').forEach(count => {
+            count.textContent = commentCount;
+        });
+    }
+}
+
+// Infinite scroll for comments beyond the first server-rendered page
+function initCommentScroll() {
+    const more = document.getElementById('comments-more');
+    const commentsList = document.getElementById('comments-list');
+    if (!more || !commentsList) return;
+    
+    const button = more.querySelector('button');
+    let loading = false;
+    let observer = null;
+    
+    function loadMore() {
+        const url = more.dataset.url;
+        if (loading || !url) return;
+        loading = true;
+        button.disabled = true;
+        
+        fetch(url, { headers: { 'Accept': 'application/json' } })
+        .then(response => {
+            if (!response.ok) throw new Error(`HTTP ${response.status}`);
+            return response.json();
+        })
+        .then(data => {
+            commentsList.insertAdjacentHTML('beforeend', data.html);
+            if (data.next_url) {
+                more.dataset.url = data.next_url;
+            } else {
+                if (observer) observer.disconnect();
+                more.remove();
+            }
+        })
+        .catch(error => {
+            console.error('Error:', error);
+            // Stop loading automatically; the button still lets the reader retry
+            if (observer) observer.disconnect();
+            showToast('Erro ao carregar comentários', 'error');
+        })
+        .finally(() => {
+            loading = false;
+            button.disabled = false;
+        });
+    }
+    
+    button.addEventListener('click', loadMore);
+    
+    if ('IntersectionObserver' in window) {
+        observer = new IntersectionObserver(entries => {
+            if (entries.some(entry => entry.isIntersecting)) {
+                loadMore();
+            }
+        }, { rootMargin: '200px' });
+        observer.observe(more);
     }
 }
 
@@ -0,0 +1,301 @@
+"""Static export of the public pages for nginx or a CDN to serve.
+
+``flask export-static`` renders the home, about, project listing (all, per
+category and per tag, following their pagination links) and project pages
+through the normal views, as an anonymous visitor, and copies the uploads
+they reference. A page for ``/path`` is written to ``path/index.html``, and
+one for ``/path?query`` to ``path/__query.html`` (the query string exactly
+as the page links write it). Only the file names differ from the URLs.
+
+Every page records the page cache tags it was rendered with
+(``project:<id>``, ``category:<id>``, ``listing``, ...). The manifest keeps
+a fingerprint of each tag's data as of the last export. An incremental
+export recomputes the fingerprints and re-renders only the pages whose
+tags changed, plus pages that are new. Pages that now 404 or that no page
+links to any more are removed. A change to the site settings re-renders
+everything. Writes made with Core statements are picked up too, since
+nothing depends on hooks in the write paths.
+
+Signed-in visitors and everything that is not a page (forms, likes, the
+"load more comments" fragments, /static and /assets) must still reach the
+app, e.g.::
+
+    location / {
+        set $page $uri/index.html;
+        if ($args) { set $page $uri/__$args.html; }
+        if ($cookie_session) { set $page /-; }
+        root /srv/portfolio-export;
+        try_files $page @app;
+    }
+"""
+import hashlib
+import html
+import json
+import os
+import re
+import shutil
+from collections import deque
+from urllib.parse import urlsplit
+from flask import current_app, request, url_for
+from werkzeug.exceptions import HTTPException
+from app import db
+from database import PRIMARY_KEY
+from models import Category, Project, RelatedProject, SiteSettings, Tag, UploadedImage, project_tags
+from page_cache import EXPORT_TAGS_KEY
+from pagination import invalidate_counts
+from settings_cache import site_settings_cache
+from tag_index import tag_index
+from uploads import uploads_directory
+
+MANIFEST = '.export-manifest.json'
+# Endpoints that are exported; links to anything else are left to the app
+PAGE_ENDPOINTS = ('index', 'about', 'projects', 'project_detail')
+
+_LINK_RE = re.compile(r'''\s(?:href|src)\s*=\s*["']([^"']+)["']''')
+_SRCSET_RE = re.compile(r'''\ssrcset\s*=\s*["']([^"']+)["']''')
+
+def _digest(value):
+    return hashlib.sha1(repr(value).encode()).hexdigest()
+
+def fingerprints():
+    """Fingerprint of the data behind every page cache tag, plus ``settings`` for the whole site"""
+    session = db.session
+    tags_by_project = {}
+    for project_id, tag_id in session.execute(db.select(project_tags.c.project_id, project_tags.c.tag_id)
+                                              .order_by(project_tags.c.project_id, project_tags.c.tag_id)):
+        tags_by_project.setdefault(project_id, []).append(tag_id)
+
+    prints, listing = {}, []
+    projects = Project.__table__
+    for row in session.execute(db.select(projects).order_by(projects.c.id)):
+        tags = tuple(tags_by_project.get(row.id, ()))
+        prints[f'project:{row.id}'] = _digest((tuple(row), tags))
+        if row.status == 'published':
+            listing.append((row.id, row.created_at, row.category_id, row.featured, tags))
+    categories = session.execute(db.select(Category.__table__).order_by(Category.id)).all()
+    for row in categories:
+        prints[f'category:{row.id}'] = _digest(tuple(row))
+    for filename, status in session.execute(db.select(UploadedImage.filename, UploadedImage.status)):
+        prints[f'image:{filename}'] = status
+    related = {}
+    for project_id, related_id in session.execute(
+            db.select(RelatedProject.project_id, RelatedProject.related_id)
+            .order_by(RelatedProject.project_id, RelatedProject.rank)):
+        related.setdefault(project_id, []).append(related_id)
+    for project_id, related_ids in related.items():
+        prints[f'related:{project_id}'] = _digest(related_ids)
+
+    tag_names = session.execute(db.select(Tag.id, Tag.name).order_by(Tag.id)).all()
+    # Membership, order and filters of the listings, and the category and tag lists they show
+    prints['listing'] = _digest((listing, [tuple(row) for row in categories], [tuple(row) for row in tag_names]))
+    prints['settings'] = _digest([tuple(row) for row in session.execute(db.select(SiteSettings.__table__))])
+    return prints
+
+def seed_urls():
+    """Every page reachable without following pagination: the site's entry points"""
+    urls = [url_for('index'), url_for('about'), url_for('projects')]
+    urls += [url_for('projects', category=category_id)
+             for category_id in db.session.execute(db.select(Category.id).order_by(Category.id)).scalars()]
+    urls += [url_for('projects', tag=name)
+             for name in db.session.execute(db.select(Tag.name).order_by(Tag.name)).scalars()]
+    urls += [url_for('project_detail', id=project_id) for project_id in db.session.execute(
+        db.select(Project.id).where(Project.status == 'published').order_by(Project.id)).scalars()]
+    return urls
+
+class StaticExporter:
+    """Renders pages into ``output`` and keeps the manifest that makes the next run incremental"""
+
+    def __init__(self, app, output, base_url):
+        self.app = app
+        self.output = os.path.abspath(output)
+        self.base_url = base_url.rstrip('/')
+        self._host = urlsplit(self.base_url).netloc
+        self._client = app.test_client()
+        self._adapter = app.url_map.bind(self._host or 'localhost')
+        self._uploads = uploads_directory(app)
+        with app.test_request_context(base_url=self.base_url):
+            self._upload_prefix = url_for('uploaded_file', filename='-')[:-1]
+        self.manifest = self._load_manifest()
+        self.rendered = self.written = self.removed = 0
+
+    def _load_manifest(self):
+        try:
+            with open(os.path.join(self.output, MANIFEST), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'fingerprints': {}, 'pages': {}, 'uploads': {}}
+
+    def _save_manifest(self):
+        self._write(MANIFEST, json.dumps(self.manifest, separators=(',', ':')).encode())
+
+    def _path(self, relative):
+        path = os.path.abspath(os.path.join(self.output, relative))
+        # Query strings are user data (tag names); never write outside the export
+        if os.path.commonpath([path, self.output]) != self.output:
+            return None
+        return path
+
+    def _write(self, relative, data):
+        path = self._path(relative)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(path + '.tmp', path)
+
+    def _remove(self, relative):
+        path = self._path(relative)
+        if path and os.path.exists(path):
+            os.remove(path)
+
+    @staticmethod
+    def page_file(url):
+        """Export file (relative) for a page URL"""
+        parts = urlsplit(url)
+        segments = [segment for segment in parts.path.split('/') if segment]
+        return os.path.join(*segments, f'__{parts.query}.html' if parts.query else 'index.html')
+
+    def _page_url(self, link):
+        """``link`` as a page URL to export, or None if it points elsewhere"""
+        parts = urlsplit(html.unescape(link))
+        if parts.netloc and parts.netloc != self._host:
+            return None
+        try:
+            endpoint, _ = self._adapter.match(parts.path, method='GET')
+        except HTTPException:
+            return None
+        if endpoint not in PAGE_ENDPOINTS:
+            return None
+        return parts.path + (f'?{parts.query}' if parts.query else '')
+
+    @staticmethod
+    def _links(body):
+        text = body.decode('utf-8', 'replace')
+        links = _LINK_RE.findall(text)
+        for srcset in _SRCSET_RE.findall(text):
+            links += [candidate.split()[0] for candidate in srcset.split(',') if candidate.strip()]
+        return links
+
+    def _upload(self, link):
+        path = urlsplit(html.unescape(link)).path
+        prefix = self._upload_prefix
+        return path[len(prefix):] if path.startswith(prefix) else None
+
+    def render(self, url):
+        """Render one page; returns its manifest entry, or None if it is not a public page (any more)"""
+        tags = set()
+        # A fresh app context per page, so g and the session are not shared with the caller or other pages
+        with self.app.app_context():
+            # From the primary, which the fingerprints are computed from too
+            response = self._client.get(url, base_url=self.base_url,
+                                        environ_base={EXPORT_TAGS_KEY: tags, PRIMARY_KEY: True})
+        self.rendered += 1
+        if response.status_code != 200:
+            return None
+        body = response.get_data()
+        links = self._links(body)
+        entry = {
+            'file': self.page_file(url),
+            'tags': sorted(tags),
+            'links': sorted({page for page in map(self._page_url, links) if page and page != url}),
+            'uploads': sorted({upload for upload in map(self._upload, links) if upload}),
+            'digest': hashlib.sha1(body).hexdigest(),
+        }
+        if self._path(entry['file']) is None:
+            return None
+        previous = self.manifest['pages'].get(url)
+        # Unchanged pages keep their file (and mtime), so syncing to a CDN only ships real changes
+        if previous is None or previous['digest'] != entry['digest'] or not os.path.exists(self._path(entry['file'])):
+            self._write(entry['file'], body)
+            self.written += 1
+        return entry
+
+    def _copy_upload(self, filename, uploads):
+        source = os.path.join(self._uploads, filename)
+        try:
+            stat = os.stat(source)
+        except OSError:
+            return
+        stamp = [stat.st_mtime_ns, stat.st_size]
+        target = self._path(os.path.join('uploads', filename))
+        if target is None:
+            return
+        if self.manifest['uploads'].get(filename) != stamp or not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copy2(source, target + '.tmp')
+            os.replace(target + '.tmp', target)
+        uploads[filename] = stamp
+
+    def export(self, full=False):
+        """Bring the export up to date; returns (pages rendered, files written, files removed)"""
+        # Render from the database, not from what this worker's caches last saw
+        site_settings_cache.invalidate()
+        tag_index.invalidate()
+        invalidate_counts()
+        with self.app.test_request_context(base_url=self.base_url):
+            current = fingerprints()
+            seeds = seed_urls()
+            db.session.rollback()
+        previous = self.manifest['fingerprints']
+        pages = self.manifest['pages']
+        if full or current.get('settings') != previous.get('settings'):
+            stale = set(pages)
+        else:
+            changed = {tag for tag in current.keys() | previous.keys() if current.get(tag) != previous.get(tag)}
+            stale = {url for url, entry in pages.items() if changed.intersection(entry['tags'])}
+
+        queue = deque(url for url in seeds if url in stale or url not in pages)
+        queue.extend(stale.difference(seeds))
+        queued = set(queue)
+        while queue:
+            url = queue.popleft()
+            entry = self.render(url)
+            if entry is None:
+                gone = pages.pop(url, None)
+                if gone is not None:
+                    self._remove(gone['file'])
+                    self.removed += 1
+                continue
+            pages[url] = entry
+            for link in entry['links']:
+                if link not in pages and link not in queued:
+                    queued.add(link)
+                    queue.append(link)
+
+        # Keep what the entry points still link to; drop pages that fell off the site
+        reachable, frontier = set(), [url for url in seeds if url in pages]
+        while frontier:
+            url = frontier.pop()
+            if url in reachable:
+                continue
+            reachable.add(url)
+            frontier.extend(link for link in pages[url]['links'] if link in pages)
+        for url in list(pages):
+            if url not in reachable:
+                self._remove(pages.pop(url)['file'])
+                self.removed += 1
+
+        uploads = {}
+        for entry in pages.values():
+            for filename in entry['uploads']:
+                if filename not in uploads:
+                    self._copy_upload(filename, uploads)
+        for filename in self.manifest['uploads'].keys() - uploads.keys():
+            self._remove(os.path.join('uploads', filename))
+            self.removed += 1
+        self.manifest['uploads'] = uploads
+        self.manifest['fingerprints'] = current
+        self._save_manifest()
+        return self.rendered, self.written, self.removed
+
+def export_site(output=None, full=False):
+    """Export into ``output`` (STATIC_EXPORT_DIR by default); returns (rendered, written, removed)"""
+    app = current_app._get_current_object()
+    output = output or app.config['STATIC_EXPORT_DIR']
+    exporter = StaticExporter(app, output, app.config['STATIC_EXPORT_BASE_URL'])
+    return exporter.export(full=full)
+
+def init_app(app):
+    """Let templates leave per-visitor bits (the CSRF token) out of exported pages"""
+    @app.context_processor
+    def _static_export_flag():
+        return {'static_export': EXPORT_TAGS_KEY in request.environ}
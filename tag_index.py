@@ -0,0 +1,115 @@
+"""Tag resolution for project writes and a process-local tag index for reads"""
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+from flask import current_app
+from app import db
+from database import dialect_insert
+from models import Project, Tag, project_tags
+
+TagEntry = namedtuple('TagEntry', 'id name project_count')
+
+def parse_tag_names(text):
+    """Unique, stripped tag names from a comma-separated string, in the order given"""
+    max_length = Tag.__table__.c.name.type.length
+    names = []
+    for name in (text or '').split(','):
+        name = name.strip()[:max_length]
+        if name and name not in names:
+            names.append(name)
+    return names
+
+def _insert_missing(names):
+    now = datetime.utcnow()
+    # A tag created by a concurrent admin is simply skipped and picked up by the re-select
+    db.session.execute(
+        dialect_insert(db.session, Tag.__table__)
+        .values([{'name': name, 'created_at': now} for name in names])
+        .on_conflict_do_nothing(index_elements=['name'])
+    )
+
+def resolve_tags(names):
+    """Tag rows for ``names`` in order, creating the missing ones (insert-or-get)"""
+    if not names:
+        return []
+    found = {tag.name: tag for tag in Tag.query.filter(Tag.name.in_(names))}
+    missing = [name for name in names if name not in found]
+    if missing:
+        _insert_missing(missing)
+        found.update((tag.name, tag) for tag in Tag.query.filter(Tag.name.in_(missing)))
+    return [found[name] for name in names]
+
+def set_project_tags(project, names):
+    """Make ``project.tags`` match ``names``, touching only the associations that change"""
+    tags = resolve_tags(names)
+    wanted = {tag.id for tag in tags}
+    for tag in [tag for tag in project.tags if tag.id not in wanted]:
+        project.tags.remove(tag)
+    current = {tag.id for tag in project.tags}
+    for tag in tags:
+        if tag.id not in current:
+            project.tags.append(tag)
+            current.add(tag.id)
+
+class TagIndex:
+    """Tag name -> id map plus the tag list ordered by published project count.
+
+    Each worker reloads both with a single query at most once per
+    TAG_INDEX_TTL seconds; writes in this worker call invalidate() so they
+    show up immediately, other workers within the TTL.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = {}
+        self._popular = []
+        self._loaded_at = None
+
+    def _current(self):
+        ttl = current_app.config.get('TAG_INDEX_TTL', 30)
+        loaded_at = self._loaded_at
+        if loaded_at is not None and time.monotonic() - loaded_at < ttl:
+            return self._ids, self._popular
+
+        with self._lock:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at >= ttl:
+                self._ids, self._popular = self._load()
+                self._loaded_at = time.monotonic()
+            return self._ids, self._popular
+
+    @staticmethod
+    def _load():
+        project_count = db.func.count(Project.id)
+        rows = db.session.execute(
+            db.select(Tag.id, Tag.name, project_count)
+            .outerjoin(project_tags, project_tags.c.tag_id == Tag.id)
+            .outerjoin(Project, db.and_(Project.id == project_tags.c.project_id, Project.status == 'published'))
+            .group_by(Tag.id, Tag.name)
+            .order_by(project_count.desc(), Tag.name)
+        )
+        popular = [TagEntry(*row) for row in rows]
+        return {entry.name: entry.id for entry in popular}, popular
+
+    def id_for(self, name):
+        """Id of the tag called ``name``, or None if there is no such tag"""
+        ids, _ = self._current()
+        tag_id = ids.get(name)
+        if tag_id is None:
+            # Possibly created by another worker since the last reload
+            tag_id = db.session.execute(db.select(Tag.id).where(Tag.name == name)).scalar()
+            if tag_id is not None:
+                ids[name] = tag_id
+        return tag_id
+
+    def popular(self):
+        """TagEntry tuples, most used on published projects first"""
+        _, popular = self._current()
+        return popular
+
+    def invalidate(self):
+        """Reload on next use; call after committing tag or project changes"""
+        with self._lock:
+            self._loaded_at = None
+
+tag_index = TagIndex()
@@ -0,0 +1,71 @@
+"""Shared fixtures: the app on a throwaway SQLite database prepared by ``flask db-init``"""
+import itertools
+import os
+import shutil
+import tempfile
+import pytest
+
+_DB_DIR = tempfile.mkdtemp(prefix='portfolio-tests-')
+# Set before the app is imported, since create_app() reads its settings from the environment
+os.environ.update(
+    DATABASE_URL=f'sqlite:///{os.path.join(_DB_DIR, "test.db")}',
+    MAIL_OUTBOX_SENDER='false',
+    METRICS_ENABLED='false',
+    PAGE_CACHE_TTL='0',
+    JINJA_BYTECODE_CACHE='false',
+)
+
+from app import app as flask_app, db  # noqa: E402
+import main  # noqa: E402,F401  (registers the routes, the API and the CLI commands)
+from models import Category, Project, User  # noqa: E402
+
+_ids = itertools.count(1)
+
+@pytest.fixture(scope='session')
+def app():
+    flask_app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    result = flask_app.test_cli_runner().invoke(args=['db-init'])
+    assert result.exit_code == 0, result.output
+    yield flask_app
+    with flask_app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+    shutil.rmtree(_DB_DIR, ignore_errors=True)
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def make_user(app):
+    """Create a user; returns its id"""
+    def make(is_admin=False):
+        number = next(_ids)
+        with app.app_context():
+            user = User(username=f'tester{number}', email=f'tester{number}@tests.example.com',
+                        first_name='Test', last_name=f'User {number}', is_admin=is_admin)
+            user.set_password('secret')
+            db.session.add(user)
+            db.session.commit()
+            return user.id
+    return make
+
+@pytest.fixture
+def make_project(app):
+    """Create a published project; returns its id"""
+    def make(**fields):
+        number = next(_ids)
+        with app.app_context():
+            category = Category(name=f'Category {number}')
+            project = Project(title=f'Project {number}', description='A test project', content='Test content',
+                              status='published', category=category, **fields)
+            db.session.add(project)
+            db.session.commit()
+            return project.id
+    return make
+
+@pytest.fixture
+def upload_folder(app, tmp_path, monkeypatch):
+    """Point UPLOAD_FOLDER at a temporary directory; returns it"""
+    monkeypatch.setitem(app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    return tmp_path
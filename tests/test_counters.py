@@ -0,0 +1,82 @@
+"""Project.like_count and comment_count stay equal to the real row counts"""
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import event, func
+from app import db
+from models import Comment, Like, Project, RelatedProject
+
+THREADS = 8
+
+def _counts(app, project_id):
+    with app.app_context():
+        project = db.session.get(Project, project_id)
+        likes = db.session.execute(db.select(func.count()).select_from(Like)
+                                   .where(Like.project_id == project_id)).scalar()
+        comments = db.session.execute(db.select(func.count()).select_from(Comment)
+                                      .where(Comment.project_id == project_id)).scalar()
+        return (project.like_count, likes), (project.comment_count, comments)
+
+def test_counters_match_rows_under_concurrent_writes(app, make_user, make_project):
+    project_id = make_project()
+    users = [make_user() for _ in range(THREADS)]
+
+    def engage(index):
+        user_id = users[index]
+        with app.app_context():
+            db.session.add(Like(user_id=user_id, project_id=project_id))
+            for n in range(5):
+                db.session.add(Comment(user_id=user_id, project_id=project_id, content=f'comment {n}'))
+                db.session.commit()
+            # Every other user takes their like and two comments back
+            if index % 2:
+                db.session.delete(Like.query.filter_by(user_id=user_id, project_id=project_id).one())
+                for comment in Comment.query.filter_by(user_id=user_id, project_id=project_id).limit(2):
+                    db.session.delete(comment)
+                db.session.commit()
+
+    with ThreadPoolExecutor(THREADS) as pool:
+        list(pool.map(engage, range(THREADS)))
+
+    (like_count, likes), (comment_count, comments) = _counts(app, project_id)
+    assert likes == THREADS // 2
+    assert comments == THREADS * 5 - THREADS // 2 * 2
+    assert like_count == likes
+    assert comment_count == comments
+
+def test_deleting_a_project_does_not_bump_its_counters(app, make_user, make_project):
+    project_id = make_project()
+    users = [make_user() for _ in range(3)]
+    with app.app_context():
+        for user_id in users:
+            db.session.add(Like(user_id=user_id, project_id=project_id))
+            db.session.add(Comment(user_id=user_id, project_id=project_id, content='hello'))
+        db.session.commit()
+
+    updates = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('UPDATE project'):
+            updates.append(statement)
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            db.session.delete(db.session.get(Project, project_id))
+            db.session.commit()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        assert db.session.get(Project, project_id) is None
+        assert Like.query.filter_by(project_id=project_id).count() == 0
+        assert Comment.query.filter_by(project_id=project_id).count() == 0
+    assert updates == []
+
+def test_deleting_a_project_cascades_to_related_rows(app, make_project):
+    project_id, other_id = make_project(), make_project()
+    with app.app_context():
+        assert db.session.execute(db.text('PRAGMA foreign_keys')).scalar() == 1
+        db.session.add_all([RelatedProject(project_id=project_id, rank=0, related_id=other_id, score=0.5),
+                            RelatedProject(project_id=other_id, rank=0, related_id=project_id, score=0.5)])
+        db.session.commit()
+        db.session.delete(db.session.get(Project, project_id))
+        db.session.commit()
+        assert RelatedProject.query.filter(db.or_(RelatedProject.project_id == project_id,
+                                                  RelatedProject.related_id == project_id)).count() == 0
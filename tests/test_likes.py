@@ -0,0 +1,99 @@
+"""Concurrent like toggles keep Project.like_count equal to the like rows, in both write modes"""
+import random
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from sqlalchemy import event, func
+from app import db
+import query_plans
+from likes import like_buffer, toggle_like
+from models import Like, Project
+
+THREADS = 12
+# The stress test: hundreds of toggles from several users, all in flight together
+STRESS_USERS = 8
+STRESS_TOGGLES = 400
+STRESS_THREADS = 64
+
+@pytest.fixture(params=[False, True], ids=['immediate', 'write-behind'])
+def write_behind(app, request):
+    """Run the test with LIKES_WRITE_BEHIND off and on; buffered toggles are flushed by the test"""
+    saved = {key: app.config[key] for key in ('LIKES_WRITE_BEHIND', 'LIKES_FLUSH_INTERVAL', 'LIKES_FLUSH_SIZE')}
+    app.config.update(LIKES_WRITE_BEHIND=request.param, LIKES_FLUSH_INTERVAL=3600, LIKES_FLUSH_SIZE=10 ** 6)
+    yield request.param
+    like_buffer.flush()
+    app.config.update(saved)
+
+def _counts(app, project_id):
+    with app.app_context():
+        like_count = db.session.get(Project, project_id).like_count
+        likes = db.session.execute(db.select(func.count()).select_from(Like)
+                                   .where(Like.project_id == project_id)).scalar()
+        return like_count, likes
+
+def _toggle(app, user_id, project_id):
+    client = app.test_client()
+    query_plans.log_in(client, user_id)
+    # TESTING propagates exceptions, so an IntegrityError would fail the thread rather than return 500
+    return client.post(f'/project/{project_id}/like').status_code
+
+def test_one_user_toggling_concurrently(app, make_user, make_project, write_behind):
+    user_id, project_id = make_user(), make_project()
+    with ThreadPoolExecutor(THREADS) as pool:
+        statuses = list(pool.map(lambda _: _toggle(app, user_id, project_id), range(THREADS)))
+    assert statuses == [200] * THREADS
+    like_buffer.flush()
+
+    like_count, likes = _counts(app, project_id)
+    assert likes in (0, 1)
+    assert like_count == likes
+
+def test_many_users_toggling_concurrently(app, make_user, make_project, write_behind):
+    project_id = make_project()
+    users = [make_user() for _ in range(THREADS)]
+
+    def toggle_three_times(user_id):
+        return [_toggle(app, user_id, project_id) for _ in range(3)]
+
+    with ThreadPoolExecutor(THREADS) as pool:
+        statuses = [status for result in pool.map(toggle_three_times, users) for status in result]
+    assert statuses == [200] * THREADS * 3
+    like_buffer.flush()
+
+    # Every user toggled an odd number of times, so every user likes the project
+    assert _counts(app, project_id) == (THREADS, THREADS)
+
+@pytest.mark.slow
+def test_hundreds_of_togglers(app, make_user, make_project, write_behind):
+    project_id = make_project()
+    users = [make_user() for _ in range(STRESS_USERS)]
+    rng = random.Random(1)
+    togglers = [rng.choice(users) for _ in range(STRESS_TOGGLES)]
+    with ThreadPoolExecutor(STRESS_THREADS) as pool:
+        statuses = list(pool.map(lambda user_id: _toggle(app, user_id, project_id), togglers))
+    assert statuses == [200] * STRESS_TOGGLES
+    like_buffer.flush()
+
+    # Whatever order the toggles ran in, a user who toggled an odd number of times likes the project
+    likers = sum(togglers.count(user_id) % 2 for user_id in users)
+    assert _counts(app, project_id) == (likers, likers)
+
+def test_like_inserted_between_delete_and_insert(app, make_user, make_project):
+    """The toggle's DELETE found nothing and a concurrent toggle liked it before the INSERT"""
+    user_id, project_id = make_user(), make_project()
+
+    def concurrent_like(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('INSERT INTO "like"'):
+            cursor.connection.execute('INSERT INTO "like" (user_id, project_id, created_at) '
+                                      'VALUES (?, ?, CURRENT_TIMESTAMP)', (user_id, project_id))
+            cursor.connection.execute('UPDATE project SET like_count = like_count + 1 WHERE id = ?',
+                                      (project_id,))
+
+    with app.test_request_context():
+        event.listen(db.engine, 'before_cursor_execute', concurrent_like)
+        try:
+            result = toggle_like(user_id, project_id)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', concurrent_like)
+    # The end state is the one asked for, and the counter only moved once
+    assert result == (True, 1)
+    assert _counts(app, project_id) == (1, 1)
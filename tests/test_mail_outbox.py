@@ -0,0 +1,113 @@
+"""Mail queued by a request is delivered later by the background sender, with a retry after a failure"""
+import socketserver
+import threading
+import time
+import pytest
+from app import db
+from mail_outbox import mail_sender
+from models import OutgoingEmail, User
+
+# A slow mail server: the request must not wait for it
+SMTP_DELAY = 3
+
+class SMTPStub(socketserver.ThreadingTCPServer):
+    """Just enough of an SMTP server for smtplib
+
+    Greets each connection after ``delay`` seconds and answers the first ``fail`` DATA commands with 451.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, fail=0, delay=0):
+        super().__init__(('127.0.0.1', 0), _SMTPHandler)
+        self.fail = fail
+        self.delay = delay
+        self.messages = []
+        self.rejected = 0
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        time.sleep(self.server.delay)
+        self.reply('220 stub ESMTP')
+        recipients = []
+        while line := self.rfile.readline():
+            command = line.decode().strip()
+            verb = command[:4].upper()
+            if verb in ('EHLO', 'HELO'):
+                self.reply('250 stub')
+            elif verb == 'MAIL':
+                recipients = []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                recipients.append(command.split(':', 1)[1].strip(' <>'))
+                self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                while (line := self.rfile.readline()) not in (b'.\r\n', b''):
+                    data.append(line.decode())
+                if self.server.rejected < self.server.fail:
+                    self.server.rejected += 1
+                    self.reply('451 Try again later')
+                else:
+                    self.server.messages.append((recipients, ''.join(data)))
+                    self.reply('250 Queued')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('250 OK')
+
+@pytest.fixture
+def smtp_server(app, monkeypatch):
+    server = SMTPStub(fail=1, delay=SMTP_DELAY)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    state = app.extensions['mail']
+    for name, value in dict(server='127.0.0.1', port=server.server_address[1], use_tls=False, use_ssl=False,
+                            username=None, password=None, suppress=False).items():
+        monkeypatch.setattr(state, name, value)
+    for name, value in dict(MAIL_USERNAME='portfolio@tests.example.com', MAIL_OUTBOX_SENDER=True,
+                            MAIL_RETRY_DELAY=0.2, MAIL_SMTP_IDLE=0.5, MAIL_SMTP_TIMEOUT=5).items():
+        monkeypatch.setitem(app.config, name, value)
+    yield server
+    mail_sender.stop(timeout=10)
+    server.shutdown()
+    server.server_close()
+
+@pytest.mark.slow
+def test_reset_mail_is_sent_after_a_retry(app, client, make_user, smtp_server):
+    with app.app_context():
+        email = db.session.get(User, make_user()).email
+
+    started = time.monotonic()
+    response = client.post('/forgot-password', data={'email': email})
+    elapsed = time.monotonic() - started
+    assert response.status_code == 302
+    assert elapsed < SMTP_DELAY / 3
+    with app.app_context():
+        assert OutgoingEmail.query.order_by(OutgoingEmail.id.desc()).first().status != 'sent'
+
+    deadline = time.monotonic() + 30
+    while True:
+        with app.app_context():
+            row = OutgoingEmail.query.order_by(OutgoingEmail.id.desc()).first()
+            assert row.recipients == [email]
+            status, attempts, last_error, sent_at = row.status, row.attempts, row.last_error, row.sent_at
+        if status == 'sent' or time.monotonic() > deadline:
+            break
+        time.sleep(0.05)
+
+    assert mail_sender.running
+    assert status == 'sent'
+    assert sent_at is not None and last_error is None
+    assert time.monotonic() - started >= SMTP_DELAY
+    # The first delivery was answered with 451 and retried after MAIL_RETRY_DELAY
+    assert attempts == 1
+    assert smtp_server.rejected == 1
+    [(recipients, data)] = smtp_server.messages
+    assert recipients == [email]
+    assert 'Subject: Password Reset Request' in data
+    assert '/reset-password/' in data
@@ -0,0 +1,17 @@
+"""/metrics is not served without a token"""
+import pytest
+from werkzeug.exceptions import NotFound, Unauthorized
+import metrics
+
+def test_metrics_need_a_configured_token(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'METRICS_TOKEN', None)
+    with app.test_request_context('/metrics'):
+        with pytest.raises(NotFound):
+            metrics.metrics_view()
+
+def test_metrics_reject_a_wrong_token(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'METRICS_TOKEN', 'scrape-secret')
+    for headers in ({}, {'Authorization': 'Bearer wrong'}):
+        with app.test_request_context('/metrics', headers=headers):
+            with pytest.raises(Unauthorized):
+                metrics.metrics_view()
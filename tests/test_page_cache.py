@@ -0,0 +1,31 @@
+"""Cached anonymous pages carry each visitor's own CSRF token"""
+import re
+import pytest
+from page_cache import page_cache
+
+@pytest.fixture
+def page_cache_on(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'PAGE_CACHE_TTL', 60)
+    monkeypatch.setitem(app.config, 'WTF_CSRF_ENABLED', True)
+    page_cache.clear()
+    yield
+    page_cache.clear()
+
+def _token(response):
+    return re.search(r'<meta name="csrf-token" content="([^"]+)"', response.get_data(as_text=True)).group(1)
+
+def test_visitors_get_their_own_token_from_a_cached_page(app, page_cache_on):
+    first, second = app.test_client(), app.test_client()
+    first_page, second_page = first.get('/about'), second.get('/about')
+    assert first_page.status_code == second_page.status_code == 200
+    # The second visitor was served the stored copy
+    assert first_page.headers['ETag'] == second_page.headers['ETag']
+    assert _token(first_page) != _token(second_page)
+    assert 'session=' in second_page.headers.get('Set-Cookie', '')
+
+    for client, page in ((first, first_page), (second, second_page)):
+        token = _token(page)
+        response = client.post('/login', headers={'X-CSRFToken': token},
+                               data={'csrf_token': token, 'email': 'nobody@tests.example.com', 'password': 'wrong'})
+        # 400 is a CSRF failure; a wrong password re-renders the form
+        assert response.status_code == 200
@@ -0,0 +1,41 @@
+"""Cursor validation and the cached listing totals"""
+import pytest
+import pagination
+import query_plans
+from pagination import encode_cursor
+from app import db
+from models import Project
+
+@pytest.mark.parametrize('path, argument', [
+    ('/projects', 'after'), ('/projects', 'before'), ('/api/v1/projects', 'after'),
+    ('/api/v1/projects', 'before'), ('/project/{project_id}/comments', 'after')])
+def test_malformed_cursor_is_rejected_everywhere(client, make_project, path, argument):
+    path = path.format(project_id=make_project())
+    response = client.get(path, query_string={argument: 'not-a-cursor!'})
+    assert response.status_code == 400
+
+def test_valid_cursor_pages_the_listing(app, client, make_project):
+    project_id = make_project()
+    with app.app_context():
+        cursor = encode_cursor(db.session.get(Project, project_id))
+    assert client.get('/projects', query_string={'after': cursor}).status_code == 200
+
+def test_listing_totals_are_bounded(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, 'PAGINATION_COUNT_SIZE', 5)
+    pagination.invalidate_counts()
+    # Made-up tags list everything and share the unfiltered total
+    for n in range(20):
+        assert client.get('/projects', query_string={'tag': f'no-such-tag-{n}'}).status_code == 200
+    assert len(pagination._counts) == 1
+    for n in range(20):
+        client.get('/projects', query_string={'category': 10 ** 6 + n})
+    assert len(pagination._counts) == 5
+
+def test_project_writes_drop_listing_totals(app, client, make_user):
+    client.get('/projects')
+    assert pagination._counts
+    query_plans.log_in(client, make_user(is_admin=True))
+    response = client.post('/admin/project/new', data={'title': 'Counted project', 'description': 'New',
+                                                       'category_id': 0, 'status': 'published'})
+    assert response.status_code == 302
+    assert not pagination._counts
@@ -0,0 +1,92 @@
+"""Admin JSONL imports: related lists are rebuilt off the request, and only after a finished import"""
+import io
+import json
+import threading
+import uuid
+import pytest
+from app import db
+import query_plans
+import project_io
+import related
+from models import Project, RelatedProject
+
+def _jsonl(*records):
+    return io.BytesIO(''.join(json.dumps(record) + '\n' for record in records).encode())
+
+def _project(title):
+    return {'type': 'project', 'title': title, 'description': 'Import test gardening planner',
+            'status': 'published', 'category': 'Imported', 'tags': ['gardening']}
+
+@pytest.fixture
+def rebuilds(monkeypatch):
+    """Futures of the rebuilds the routes submit"""
+    futures = []
+    submit = related.submit_rebuild
+    monkeypatch.setattr(related, 'submit_rebuild', lambda app: futures.append(submit(app)) or futures[-1])
+    return futures
+
+def _import(app, admin_id, data):
+    client = app.test_client()
+    query_plans.log_in(client, admin_id)
+    return client.post('/admin/projects/import', content_type='multipart/form-data',
+                       data={'file': (data, 'catalog.jsonl'), 'job': f'test-{uuid.uuid4()}'})
+
+def test_failed_import_does_not_rebuild(app, make_user, rebuilds):
+    response = _import(app, make_user(is_admin=True), _jsonl(_project('Import test ok'), {'type': 'unknown'}))
+    assert response.status_code == 302
+    assert rebuilds == []
+
+def test_import_rebuilds_related_in_the_background(app, make_user, rebuilds):
+    pytest.importorskip('numpy')
+    release = threading.Event()
+    blocker = related._get_executor().submit(release.wait, 30)
+    try:
+        response = _import(app, make_user(is_admin=True),
+                           _jsonl(_project('Import test planner one'), _project('Import test planner two')))
+        assert response.status_code == 302
+        assert len(rebuilds) == 1 and not rebuilds[0].done()
+    finally:
+        release.set()
+        blocker.result()
+    rebuilds[0].result(timeout=60)
+
+    with app.app_context():
+        ids = db.session.execute(db.select(Project.id).where(Project.title.like('Import test planner%'))).scalars().all()
+        assert len(ids) == 2
+        related_ids = db.session.execute(db.select(RelatedProject.related_id)
+                                         .where(RelatedProject.project_id == ids[0])).scalars().all()
+        assert ids[1] in related_ids
+
+def test_export_has_no_ids_and_long_category_names_are_cut(app, make_user):
+    long_name = 'Import test category ' + 'x' * 100
+    response = _import(app, make_user(is_admin=True), _jsonl(
+        {'type': 'category', 'name': long_name},
+        dict(_project('Import test long category'), category=long_name)))
+    assert response.status_code == 302
+
+    with app.app_context():
+        project = Project.query.filter_by(title='Import test long category').one()
+        assert project.category.name == long_name[:80]
+        lines = [json.loads(line) for line in project_io.export_lines()
+                 if 'Import test long category' in line]
+    assert lines and all('id' not in line for line in lines)
+
+@pytest.mark.parametrize('field, value', [('title', 'Import test overlong title ' + 'x' * 200),
+                                          ('github_url', 'https://github.com/' + 'x' * 500)],
+                         ids=['title', 'github_url'])
+def test_overlong_fields_stop_the_import_at_their_line(app, make_user, field, value):
+    # SQLite stores them anyway, PostgreSQL raises DataError; either way the admin gets the line, not a 500
+    record = dict(_project('Import test overlong field'), **{field: value})
+    client = app.test_client()
+    query_plans.log_in(client, make_user(is_admin=True))
+    response = client.post('/admin/projects/import', content_type='multipart/form-data',
+                           data={'file': (_jsonl(_project('Import test short fields'), record), 'catalog.jsonl')})
+    assert response.status_code == 302
+    with client.session_transaction() as session:
+        [(category, message)] = session['_flashes']
+    assert category == 'danger'
+    length = Project.__table__.c[field].type.length
+    assert f'line 2: {field} is longer than {length} characters' in message
+
+    with app.app_context():
+        assert Project.query.filter(Project.title.like('Import test overlong%')).count() == 0
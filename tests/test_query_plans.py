@@ -0,0 +1,44 @@
+"""check-query-plans fails on routes that do not answer 2xx, and passes on a seeded database"""
+import os
+import sqlite3
+import subprocess
+import sys
+import query_plans
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_error_status_fails_the_check(app, monkeypatch):
+    monkeypatch.setattr(query_plans, 'route_paths', lambda: [
+        ('about', '/about', False), ('missing page', '/no-such-page', False)])
+    result = app.test_cli_runner().invoke(args=['check-query-plans'])
+    assert result.exit_code == 1
+    assert 'missing page (/no-such-page): HTTP 404' in result.output
+    assert 'about' not in result.output
+
+def test_project_detail_renders(client, make_project):
+    assert client.get(f'/project/{make_project()}').status_code == 200
+
+def _flask(database, *args):
+    # seed-data needs an empty database, so this runs the CLI against its own file
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{database}', LOG_LEVEL='ERROR')
+    return subprocess.run([sys.executable, '-m', 'flask', '--app', 'main', *args],
+                          cwd=ROOT, env=env, capture_output=True, text=True, timeout=120)
+
+def test_hot_routes_use_indexes_on_a_seeded_database(tmp_path):
+    database = tmp_path / 'seeded.db'
+    for args in (['db-init'], ['seed-data', '--users', '50', '--projects', '120', '--likes', '600',
+                               '--comments', '300']):
+        result = _flask(database, *args)
+        assert result.returncode == 0, result.stderr
+
+    result = _flask(database, 'check-query-plans')
+    assert result.returncode == 0, result.stderr
+    assert 'Every hot-route query uses an index.' in result.stdout
+
+    # Without the tag index the tag filters read project_tags in full, and the check says so
+    with sqlite3.connect(database) as connection:
+        connection.execute('DROP INDEX ix_project_tags_tag_id')
+    result = _flask(database, 'check-query-plans')
+    assert result.returncode == 1
+    assert 'projects by tag (/projects?tag=' in result.stderr
+    assert 'full scan of project_tags' in result.stderr
@@ -0,0 +1,63 @@
+"""Saving a project updates related lists on the background thread, after the request has answered"""
+import logging
+import sys
+import threading
+import pytest
+from app import db
+import query_plans
+import related
+from models import Project, RelatedProject
+
+def _save(app, admin_id, title):
+    client = app.test_client()
+    query_plans.log_in(client, admin_id)
+    return client.post('/admin/project/new', data={
+        'title': title, 'description': 'Related test beekeeping hives honey', 'content': '',
+        'category_id': 0, 'tags': 'beekeeping', 'status': 'published'})
+
+def _drain():
+    related._get_executor().submit(lambda: None).result(timeout=60)
+
+def _related_ids(project_id):
+    return db.session.execute(db.select(RelatedProject.related_id)
+                              .where(RelatedProject.project_id == project_id)).scalars().all()
+
+def test_saved_projects_are_related_in_the_background(app, make_user):
+    pytest.importorskip('numpy')
+    admin_id = make_user(is_admin=True)
+    release = threading.Event()
+    blocker = related._get_executor().submit(release.wait, 30)
+    try:
+        assert _save(app, admin_id, 'Related test hives one').status_code == 302
+        assert _save(app, admin_id, 'Related test hives two').status_code == 302
+        with app.app_context():
+            first, second = db.session.execute(db.select(Project.id).where(Project.title.like('Related test hives%'))
+                                               .order_by(Project.id)).scalars().all()
+            # The worker is busy, so the requests answered without touching the lists
+            assert _related_ids(first) == [] and _related_ids(second) == []
+    finally:
+        release.set()
+        blocker.result()
+    _drain()
+
+    with app.app_context():
+        assert second in _related_ids(first)
+        assert first in _related_ids(second)
+
+    client = app.test_client()
+    query_plans.log_in(client, admin_id)
+    assert client.post(f'/admin/project/{second}/delete').status_code == 302
+    _drain()
+    with app.app_context():
+        assert second not in _related_ids(first)
+
+def test_missing_numpy_falls_back_to_the_category_with_a_warning(app, client, make_project, monkeypatch, caplog):
+    monkeypatch.setitem(sys.modules, 'numpy', None)  # makes ``import numpy`` raise ImportError
+    monkeypatch.setattr(related, 'np', None)
+    monkeypatch.setattr(related, '_numpy_checked', False)
+    project_id = make_project()
+    with caplog.at_level(logging.WARNING, logger='related'):
+        for _ in range(2):
+            assert client.get(f'/project/{project_id}').status_code == 200
+    assert [record.getMessage() for record in caplog.records if record.name == 'related'] == [
+        'NumPy is not installed; related projects fall back to the same category']
@@ -0,0 +1,21 @@
+"""Profile images are rendered with their width/format variants"""
+from app import db
+from models import Comment, UploadedImage, User
+
+def test_comment_avatar_has_variant_sources(app, client, make_user, make_project):
+    user_id, project_id = make_user(), make_project()
+    with app.app_context():
+        db.session.add(UploadedImage(filename='avatar-test.jpg', folder='uploads/profiles', status='ready',
+                                     max_width=300, max_height=300, variants=[
+                                         {'filename': 'avatar-test-160w.webp', 'width': 160, 'format': 'WEBP'},
+                                         {'filename': 'avatar-test.webp', 'width': 300, 'format': 'WEBP'},
+                                         {'filename': 'avatar-test-160w.jpg', 'width': 160, 'format': 'JPEG'},
+                                         {'filename': 'avatar-test.jpg', 'width': 300, 'format': 'JPEG'}]))
+        db.session.get(User, user_id).profile_image = 'avatar-test.jpg'
+        db.session.add(Comment(user_id=user_id, project_id=project_id, content='Nice work'))
+        db.session.commit()
+
+    html = client.get(f'/project/{project_id}/comments').get_json()['html']
+    assert '<source type="image/webp" sizes="40px"' in html
+    assert '/uploads/profiles/avatar-test-160w.webp' in html
+    assert '/uploads/profiles/avatar-test.jpg' in html
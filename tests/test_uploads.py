@@ -0,0 +1,33 @@
+"""Uploads are linked through content-hashed URLs and cached for good when the hash matches"""
+import os
+import re
+from flask import url_for
+import uploads
+
+TEMPLATES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'templates')
+
+def test_versioned_upload_is_immutable(app, client, upload_folder):
+    (upload_folder / 'projects').mkdir()
+    (upload_folder / 'projects' / 'test-upload.jpg').write_bytes(b'\xff\xd8' + os.urandom(1024))
+    filename = 'projects/test-upload.jpg'
+    with app.test_request_context():
+        url = url_for('uploaded_file', filename=filename)
+        version = uploads.upload_version(filename)
+    assert url.endswith(f'?v={version}')
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.cache_control.immutable
+    assert response.cache_control.max_age == uploads.IMMUTABLE_MAX_AGE
+
+    stale = client.get(f'/uploads/{filename}?v=0000')
+    assert stale.cache_control.no_cache
+
+def test_templates_link_uploads_through_the_upload_endpoint():
+    offenders = []
+    for root, _, files in os.walk(TEMPLATES):
+        for name in files:
+            with open(os.path.join(root, name), encoding='utf-8') as f:
+                if re.search(r"url_for\('static',\s*filename='uploads/", f.read()):
+                    offenders.append(os.path.relpath(os.path.join(root, name), TEMPLATES))
+    assert offenders == []
@@ -0,0 +1,73 @@
+"""Delivery of files under UPLOAD_FOLDER (static/uploads) with content-hashed, long-lived URLs"""
+import hashlib
+import mimetypes
+import os
+from urllib.parse import quote
+from flask import abort, current_app, request, send_from_directory
+from werkzeug.security import safe_join
+
+# Far-future lifetime for URLs whose ?v= matches the file's current content hash
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+_digests = {}
+
+def uploads_directory(app=None):
+    """Absolute UPLOAD_FOLDER (a relative one is under the app's root)"""
+    app = app or current_app
+    return os.path.join(app.root_path, app.config['UPLOAD_FOLDER'])
+
+def folder_path(folder, app=None):
+    """Directory of an ``uploads/<name>`` folder, as UploadedImage and UPLOAD_SIZES name them"""
+    return os.path.join(uploads_directory(app), os.path.relpath(folder, 'uploads'))
+
+def upload_version(filename):
+    """Short content hash of an upload, or None if the file does not exist (yet)"""
+    path = safe_join(uploads_directory(), filename)
+    if path is None:
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    
+    # Hash each file once per (mtime, size) so url_for stays cheap on busy pages
+    cached = _digests.get(path)
+    if cached and cached[0] == (stat.st_mtime_ns, stat.st_size):
+        return cached[1]
+    
+    digest = hashlib.blake2b(digest_size=8)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    _digests[path] = ((stat.st_mtime_ns, stat.st_size), digest.hexdigest())
+    return digest.hexdigest()
+
+def _accel_redirect(filename):
+    directory = uploads_directory()
+    path = safe_join(directory, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    response = current_app.response_class()
+    response.headers['X-Accel-Redirect'] = current_app.config['UPLOADS_ACCEL_PREFIX'].rstrip('/') + '/' + quote(filename)
+    response.mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    return response
+
+def send_upload(filename):
+    """Serve an upload, letting a front proxy send the bytes when configured"""
+    if current_app.config.get('UPLOADS_SENDFILE') == 'x-accel':
+        # nginx answers conditional and Range requests itself for internal locations
+        response = _accel_redirect(filename)
+    else:
+        # X-Sendfile is applied by send_file when USE_X_SENDFILE is set
+        response = send_from_directory(uploads_directory(), filename, conditional=True, etag=True, max_age=0)
+    
+    version = request.args.get('v')
+    if version and version == upload_version(filename):
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+        response.cache_control.no_cache = None
+    else:
+        # Unversioned or stale URL: cacheable, but revalidated with the ETag
+        response.cache_control.no_cache = True
+    return response
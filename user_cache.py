@@ -0,0 +1,100 @@
+"""Process-local cache of the users Flask-Login loads for each request"""
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session, load_only
+from app import db
+from models import User
+
+# What authentication and the navbar/profile header read; bio, password hash and reset
+# token stay in the database (touching them on a cached user raises DetachedInstanceError)
+CACHED_COLUMNS = (User.id, User.username, User.email, User.first_name, User.last_name,
+                  User.profile_image, User.is_admin, User.created_at, User.session_version)
+
+class UserCache:
+    """Detached, partially loaded User instances keyed by id.
+
+    An entry is served without a query for USER_CACHE_TTL seconds. After
+    that the worker re-reads only the row's ``session_version`` (bumped by
+    every UPDATE of the user) and reloads the user if it moved. Commits in
+    this worker evict the changed users immediately. The cached instances
+    are shared between requests, so routes that modify the signed-in user
+    load it from the session first.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # user id -> (user, checked_at)
+
+    def get(self, user_id):
+        """The user with ``user_id``, or None if there is no such user"""
+        ttl = current_app.config.get('USER_CACHE_TTL', 10)
+        entry = self._entries.get(user_id)
+        now = time.monotonic()
+        # A profile image still being processed is not cached, so the navbar picks it up once ready
+        if entry is not None and entry[0].profile_image_ready:
+            user, checked_at = entry
+            if now - checked_at < ttl:
+                return user
+            if self._current_version(user_id) == user.session_version:
+                self._store(user_id, user, now)
+                return user
+
+        user = self._load(user_id)
+        if user is None:
+            self.invalidate(user_id)
+        else:
+            self._store(user_id, user, now)
+        return user
+
+    def invalidate(self, *user_ids):
+        """Drop the given users (all users when none are given)"""
+        with self._lock:
+            if not user_ids:
+                self._entries.clear()
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+
+    def _store(self, user_id, user, checked_at):
+        with self._lock:
+            self._entries[user_id] = (user, checked_at)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > current_app.config.get('USER_CACHE_SIZE', 1000):
+                self._entries.popitem(last=False)
+
+    @staticmethod
+    def _current_version(user_id):
+        return db.session.execute(db.select(User.session_version).where(User.id == user_id)).scalar()
+
+    @staticmethod
+    def _load(user_id):
+        user = db.session.execute(
+            db.select(User).options(load_only(*CACHED_COLUMNS)).where(User.id == user_id)
+        ).scalar()
+        if user is None:
+            return None
+        # Detach so the instance outlives the request session that loaded it
+        if user.profile_upload is not None:
+            db.session.expunge(user.profile_upload)
+        db.session.expunge(user)
+        return user
+
+user_cache = UserCache()
+
+@event.listens_for(Session, 'before_flush')
+def _collect_changed_users(session, flush_context, instances):
+    changed = session.info.setdefault('users_changed', set())
+    changed.update(obj.id for obj in session.dirty if isinstance(obj, User) and obj.id is not None)
+    changed.update(obj.id for obj in session.deleted if isinstance(obj, User))
+
+@event.listens_for(Session, 'after_commit')
+def _evict_changed_users(session):
+    changed = session.info.pop('users_changed', None)
+    if changed:
+        user_cache.invalidate(*changed)
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_changed_users(session):
+    session.info.pop('users_changed', None)